@@ -40,7 +40,8 @@ setup(
     #
     entry_points={
         'console_scripts': [
-            'run-valkka-live = valkka.live.main:main'
+            'run-valkka-live = valkka.live.main:main',
+            'valkka-mvision-benchmark = valkka.mvision.benchmark:main'
     ]
     },
 
@@ -55,6 +56,7 @@ setup(
         'valkka.live.qt',
         'valkka.mvision',
         'valkka.mvision.movement',
+        'valkka.mvision.movementmulti',
         'valkka.mvision.nix',
         'valkka.mvision.yolo3',
         'valkka.mvision.yolo2',
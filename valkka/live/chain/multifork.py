@@ -47,6 +47,7 @@ class RecordType(Enum):
     never = 0
     movement = 1
     always = 2
+    analyzer = 3 # machine vision processes open & close the gate, see MultiForkFilterchain.openRecordingGate
 
     
 
@@ -220,6 +221,7 @@ class MultiForkFilterchain(BaseFilterchain):
         self.record_type = None
         self.id_rec = None
         self.valkkafsmanager = None
+        self.recording_owners = set() # ids of the objects keeping the recording gate open, see openRecordingGate
         
         self.closed = False
         
@@ -261,6 +263,31 @@ class MultiForkFilterchain(BaseFilterchain):
                 self.fs_gate.unSet()
         except Exception as e:
             print("MultiFork: movement_cb failed with", e)
+
+
+    def openRecordingGate(self, owner):
+        """Record this stream while at least one owner keeps the gate open (record_type must be RecordType.analyzer)
+
+        owner is any object, i.e. an analyzer container that relays the "recording" signal of a machine vision process
+
+        There is no pre-roll: the gate only lets through frames arriving after it opens, as there is no frame buffering filter in front of fs_gate.  The post-roll is the hold time of the machine vision process (see MVisionMixin.record_hold)
+        """
+        self.recording_owners.add(id(owner))
+        self.updateRecordingGate__()
+
+
+    def closeRecordingGate(self, owner):
+        self.recording_owners.discard(id(owner))
+        self.updateRecordingGate__()
+
+
+    def updateRecordingGate__(self):
+        if self.record_type != RecordType.analyzer:
+            return
+        if len(self.recording_owners) > 0:
+            self.fs_gate.set()
+        else:
+            self.fs_gate.unSet()
             
             
     # (De)activate ValkkaFSWriterThread for this slot
@@ -289,6 +316,8 @@ class MultiForkFilterchain(BaseFilterchain):
             print("setRecording: movement")
             self.movement_client(inc = 1)
             self.movement_filter.setCallback(self.movement_cb)
+        elif self.record_type == RecordType.analyzer: # analyzers might have opened the gate already
+            self.updateRecordingGate__()
         self.valkkafsmanager.setInput(self.id_rec, self.slot) 
        
        
@@ -298,7 +327,7 @@ class MultiForkFilterchain(BaseFilterchain):
         if self.valkkafsmanager is None:
             return
         
-        if self.record_type == RecordType.always:
+        if self.record_type in [RecordType.always, RecordType.analyzer]:
             self.fs_gate.unSet()
         elif self.record_type == RecordType.movement:
             self.movement_client(inc = -1)
@@ -573,12 +602,16 @@ class MultiForkFilterchain(BaseFilterchain):
 
     # *** Shmem hooks ***
             
-    def getShmem(self):
+    def getShmem(self, event_fd = None):
         """Returns the unique name identifying the shared mem and semaphores.  The name can be passed to the machine vision routines.
+
+        If event_fd (core.EventFd) is given, new frames are signaled through it (instead of a semaphore).  The client must then use the same eventfd
         """
         shmem_name = self.idst + "_" + str(len(self.shmem_terminals))
         print("getShmem : reserving", shmem_name)
         shmem_filter = core.RGBShmemFrameFilter(shmem_name, self.shmem_n_buffer, self.width, self.height)
+        if event_fd is not None:
+            shmem_filter.useFd(event_fd)
         # shmem_filter = core.BriefInfoFrameFilter(shmem_name) # DEBUG: see if you are actually getting any frames here ..
         self.shmem_terminals[shmem_name] = shmem_filter
         self.sws_fork_filter.connect(shmem_name, shmem_filter)
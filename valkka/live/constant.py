@@ -85,6 +85,16 @@ shmem_image_dimensions = (1920//4, 1080//4)
 # shmem_image_interval = 1000
 shmem_image_interval = 100 # 10 fps
 
+# how often client processes are migrated between master processes according to their load (milliseconds)
+mvision_rebalance_interval = 10000
+
+# machine vision processes are started on demand: how many idle processes to keep running per class ..
+mvision_warm_processes = 1
+# .. how long (secs) other processes may stay idle before they are stopped ..
+mvision_idle_timeout = 300
+# .. and how often (milliseconds) idle processes are checked
+mvision_pool_interval = 30000
+
 # minimum size for video root widget
 root_video_container_minsize = (300, 300)
 
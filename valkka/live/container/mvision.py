@@ -19,6 +19,8 @@ You should have received a copy of the GNU Affero General Public License along w
 @version 0.12.1 
 @brief   a container class that manages Qt widgets for stream visualization and frame streaming to machine vision modules
 """
+import time
+import functools
 from pprint import pprint, pformat
 
 from PySide2 import QtWidgets, QtCore, QtGui # Qt5
@@ -69,6 +71,8 @@ class MVisionContainer(VideoContainer):
         tag = self.mvision_class.tag # identifies a list of multiprocesses in singleton.process_map
         
         self.verbose = True
+        self.process_connections = [] # (signal, slot) pairs connected in setDevice, see connectProcessSignal
+        self.process_listeners = [] # (process, command, callback) triplets listened to in setDevice, see listenProcess
         
         self.mvision_process = self.getProcess(tag)
         if self.mvision_process is None: return
@@ -101,16 +105,11 @@ class MVisionContainer(VideoContainer):
     
     def getProcess(self, tag):
         try:
-            queue = singleton.process_map[tag]
+            pool = singleton.process_map[tag]
         except KeyError:
             return None
-        
-        try:
-            mvision_process = queue.pop()
-        except IndexError:
-            return None
-
-        return mvision_process
+        # an idle process or a new one, if max_instances is not reached
+        return pool.get()
     
 
     def serialize(self):
@@ -182,7 +181,8 @@ class MVisionContainer(VideoContainer):
             self.filterchain.addViewPort(self.viewport)
             
             # now the shared mem / semaphore part :
-            self.shmem_name = self.filterchain.getShmem()
+            # the shmem server signals new frames through the eventfd of the process
+            self.shmem_name = self.filterchain.getShmem(event_fd = self.mvision_process.getEventFd())
             print(self.pre, "setDevice : got shmem name", self.shmem_name)
             
             self.mvision_widget = self.mvision_process.getWidget()
@@ -194,9 +194,51 @@ class MVisionContainer(VideoContainer):
             # singleton.thread.addProcess(self.mvision_process)
             
             # is there a signal giving the bounding boxes..?  let's connect it
-            if hasattr(self.mvision_process.signals,"bboxes"):
-                print(self.pre, "setDevice : connecting bboxes signal")
-                self.mvision_process.signals.bboxes.connect(self.set_bounding_boxes_slot)
+            if self.connectProcessSignal("bboxes", self.set_bounding_boxes_slot):
+                print(self.pre, "setDevice : connected bboxes signal")
+            elif self.connectProcessSignal("objects", self.set_bounding_boxes_slot): # objects carry the bounding boxes as well
+                print(self.pre, "setDevice : connected objects signal")
+
+            # the process can open & close the recording gate of the stream
+            self.connectProcessSignal("recording", self.recording_slot)
+
+            # detections & movement events are saved into the metadata store.  Every message, not just the coalesced signals
+            if singleton.metadata_writer is not None:
+                slot = self.device.slot
+                self.listenProcess("objects", functools.partial(self.storeObjects, slot))
+                self.listenProcess("start_move", functools.partial(self.storeEvent, slot, "start_move"))
+                self.listenProcess("stop_move", functools.partial(self.storeEvent, slot, "stop_move"))
+
+
+    def connectProcessSignal(self, name, slot):
+        """Connect a signal of the machine vision process to a slot, if the process has such a signal.  Returns True if connected
+
+        The connections are undone in disconnectProcessSignals, so that a recycled process doesn't keep on calling this container
+        """
+        signal = getattr(self.mvision_process.signals, name, None)
+        if signal is None:
+            return False
+        signal.connect(slot)
+        self.process_connections.append((signal, slot))
+        return True
+
+
+    def listenProcess(self, command, callback):
+        """Call callback(message_object) for every message having command from the machine vision process (see QMultiProcess.listen)
+
+        The callback is called in the frontend thread of the process, not in the GUI thread.  Undone in disconnectProcessSignals
+        """
+        self.mvision_process.listen(command, callback)
+        self.process_listeners.append((self.mvision_process, command, callback))
+
+
+    def disconnectProcessSignals(self):
+        for signal, slot in self.process_connections:
+            signal.disconnect(slot)
+        self.process_connections = []
+        for process, command, callback in self.process_listeners:
+            process.unlisten(command, callback)
+        self.process_listeners = []
             
 
     def setFile(self, fname):
@@ -208,19 +250,48 @@ class MVisionContainer(VideoContainer):
         self.mvision_process.activate(
                 n_buffer         = constant.shmem_n_buffer,
                 image_dimensions = constant.shmem_image_dimensions,
-                shmem_name       = self.shmem_name
+                shmem_name       = self.shmem_name,
+                use_event_fd     = True
                 )
         # creates the shmem client at the multiprocess
             
 
     def set_bounding_boxes_slot(self, message_object):
-        if (self.device):
+        if (self.device) and ("bbox_list" in message_object):
             bbox_list = message_object["bbox_list"]
             # device might have been cleared while the yolo object detector takes it time ..
             # .. and then it still calls this
             self.filterchain.setBoundingBoxes(self.viewport, bbox_list)
             
 
+    def recording_slot(self, message_object):
+        if not self.filterchain: # device might have been cleared meanwhile
+            return
+        if message_object["recording"]:
+            self.filterchain.openRecordingGate(self)
+        else:
+            self.filterchain.closeRecordingGate(self)
+
+
+    # the store methods are called in the frontend thread of the process (see listenProcess): MetadataWriter.add is thread-safe
+
+    def storeObjects(self, slot, message_object):
+        if "bbox_list" not in message_object:
+            return
+        bbox_list = message_object["bbox_list"]
+        singleton.metadata_writer.add(
+            slot,
+            message_object.get("mstimestamp", int(time.time() * 1000)),
+            message_object["object_list"][0:len(bbox_list)], # the rest are messages
+            boxes = bbox_list,
+            scores = message_object.get("score_list", None)
+            )
+
+
+    def storeEvent(self, slot, tag, message_object):
+        singleton.metadata_writer.addEvent(slot, message_object["mstimestamp"], tag)
+
+
     def right_double_click_slot(self):
         if self.filterchain:
             self.analyzer_widget.activate(
@@ -246,6 +317,8 @@ class MVisionContainer(VideoContainer):
 
         self.filterchain.delViewPort(self.viewport)
         self.filterchain.releaseShmem(self.shmem_name)
+        self.filterchain.closeRecordingGate(self)
+        self.disconnectProcessSignals()
 
         self.mvision_process.deactivate() # deactivates the shmem client at the multiprocess & puts process back to sleep ..
         
@@ -261,8 +334,9 @@ class MVisionContainer(VideoContainer):
         if self.mvision_process is None:
             return
         tag = self.mvision_class.tag
-        singleton.process_map[tag].append(self.mvision_process) # .. and recycle it
-        print(self.pre, "close: process_map=", singleton.process_map)
+        self.disconnectProcessSignals()
+        singleton.process_map[tag].put(self.mvision_process) # .. and recycle it
+        print(self.pre, "close: process pool=", singleton.process_map[tag])
         if self.analyzer_widget_connected:
             self.mvision_process.disconnectAnalyzerWidget(self.analyzer_widget)
         self.mvision_process = None
@@ -285,14 +359,12 @@ class MVisionClientContainer(MVisionContainer):
             self.mvision_master_process = None
             return
 
-        master_tag = self.mvision_process.master
-        self.mvision_master_process = self.getMasterProcess(master_tag)
-        if self.mvision_master_process is None: 
+        # the master process is chosen at activate, according to the load at that moment
+        self.mvision_master_process = None
+        if len(singleton.master_process_map.get(self.mvision_process.master, [])) < 1:
             self.clearProcess()
             return
 
-        # self.mvision_process.setMasterProcess(self.mvision_master_process)
-
 
     def getProcess(self, tag):
         try:
@@ -311,6 +383,7 @@ class MVisionClientContainer(MVisionContainer):
             return
         self.mvision_process.unsetMasterProcess()        
         tag = self.mvision_class.tag
+        self.disconnectProcessSignals()
         singleton.client_process_map[tag].append(self.mvision_process) # .. and recycle it
         # print(self.pre, "close: process_map=", singleton.process_map)
         self.mvision_process = None
@@ -320,10 +393,7 @@ class MVisionClientContainer(MVisionContainer):
         return singleton.get_avail_master_process(tag)
 
     def clearMasterProcess(self):
-        if self.mvision_master_process is None:
-            return
-        master_tag = self.mvision_master_process.tag
-        singleton.master_process_map[master_tag].append(self.mvision_master_process)
+        # master processes are shared: they stay in singleton.master_process_map
         self.mvision_master_process = None
 
 
@@ -331,8 +401,13 @@ class MVisionClientContainer(MVisionContainer):
         self.mvision_process.activate(
             n_buffer         = constant.shmem_n_buffer,
             image_dimensions = constant.shmem_image_dimensions,
-            shmem_name       = self.shmem_name
+            shmem_name       = self.shmem_name,
+            use_event_fd     = True
             )
+        self.mvision_master_process = self.getMasterProcess(self.mvision_process.master)
+        if self.mvision_master_process is None:
+            print(self.pre, "activate: no master process with space for clients")
+            return
         self.mvision_process.setMasterProcess(self.mvision_master_process)
 
 
@@ -248,6 +248,7 @@ class DataModel:
                 "blocksize"  : default.get_valkkafs_config()["blocksize"],
                 "fs_flavor"  : default.get_valkkafs_config()["fs_flavor"],
                 "record"     : default.get_valkkafs_config()["record"],
+                "record_analyzer" : default.get_valkkafs_config()["record_analyzer"],
                 "partition_uuid" : default.get_valkkafs_config()["partition_uuid"]
             })
 
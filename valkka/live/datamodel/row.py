@@ -365,6 +365,12 @@ class ValkkaFSConfigRow(Row):
             label_name  = "Activate recording & playback",
             def_value   = False),
 
+        ColumnSpec(
+            CheckBoxColumn, 
+            key_name    = "record_analyzer", 
+            label_name  = "Record only when machine vision triggers",
+            def_value   = default.get_valkkafs_config()["record_analyzer"]),
+
         ColumnSpec(
             SpinBoxIntegerColumn,
             key_name    = "blocksize",
@@ -404,6 +410,7 @@ class ValkkaFSConfigRow(Row):
         
         cc = 0
         self.placeWidget(cc, "record"); cc+=1
+        self.placeWidget(cc, "record_analyzer"); cc+=1
         self.placeWidget(cc, "blocksize"); cc+=1
         self.placeWidget(cc, "n_blocks"); cc+=1
 
@@ -41,6 +41,7 @@ def get_valkkafs_config():
         "blocksize"  : 10,
         "fs_flavor"  : "file",
         "record"     : False,
+        "record_analyzer" : False,
         "partition_uuid" : None
     }
     return valkkafs_config
@@ -0,0 +1,121 @@
+"""
+forkserver.py : Fork multiprocesses on demand from a process started at program startup
+
+Copyright 2019 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the Valkka Live video surveillance program
+
+Valkka Live is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+@file    forkserver.py
+@author  Sampsa Riikonen
+@date    2019
+@version 0.12.1
+@brief   Fork multiprocesses on demand from a process started at program startup
+"""
+
+import pickle
+import select
+import socket
+import multiprocessing
+from multiprocessing import Process, reduction
+from valkka.live.tools import getLogger
+
+
+class ForkServer(Process):
+    """Forks QMultiProcesses on demand
+
+    Forking a program that runs Qt and libValkka threads is asking for trouble (see MyGui.startProcesses).  The fork server is a small process that is started at program startup, while there are no threads yet.  When a new multiprocess is needed, the fork server creates & forks it.  The frontend ends of the new process (the intercom pipe & the file descriptors listed by QMultiProcess.frontendFds) are passed back over a unix socket, where QMultiProcess.attach takes them into use.
+
+    The processes are children of the fork server, that joins them once they have exited
+    """
+
+    timeout = 1.0 # how often (secs) the fork server joins exited processes
+
+    def __init__(self):
+        super().__init__()
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
+        # packets keep the requests & replies apart
+        self.front_sock, self.back_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+
+    # *** backend ***
+
+    def run(self):
+        self.front_sock.close()
+        loop = True
+        while loop:
+            r, w, e = select.select([self.back_sock], [], [], self.timeout)
+            multiprocessing.active_children() # joins the exited processes
+            if self.back_sock not in r:
+                continue
+            buf = self.back_sock.recv(65536)
+            if len(buf) < 1: # the main program has exited
+                break
+            command, kwargs = pickle.loads(buf)
+            if command == "spawn":
+                self.spawn__(**kwargs)
+            elif command == "stop":
+                loop = False
+        for p in multiprocessing.active_children():
+            p.join()
+        self.logger.debug("bye!")
+
+
+    def spawn__(self, mvision_class = None, kwargs = {}):
+        try:
+            p = mvision_class(**kwargs)
+            p.start()
+        except Exception as e:
+            self.logger.error("spawn__: could not start %s: %s", mvision_class, e)
+            self.back_sock.send(pickle.dumps(("error", str(e))))
+            return
+        fds = [p.front_pipe.fileno()] + p.frontendFds()
+        self.back_sock.send(pickle.dumps(("spawned", p.pid, len(fds))))
+        reduction.sendfds(self.back_sock, fds)
+        # the frontend has its own copies now.  The rest of p is released when it's joined
+        p.front_pipe.close()
+        p.back_pipe.close()
+
+
+    # *** frontend ***
+
+    def spawn(self, mvision_class, **kwargs):
+        """Create a new mvision_class(**kwargs) process & start it in the fork server.  Returns the frontend of the process
+
+        Raises OSError if the process could not be started
+        """
+        p = mvision_class(**kwargs) # the frontend
+        self.front_sock.send(pickle.dumps(("spawn", {"mvision_class" : mvision_class, "kwargs" : kwargs})))
+        reply = pickle.loads(self.front_sock.recv(65536))
+        if reply[0] != "spawned":
+            raise(OSError("ForkServer: could not start " + str(mvision_class) + " : " + reply[1]))
+        command, pid, n = reply
+        fds = reduction.recvfds(self.front_sock, n)
+        p.attach(fds[0], fds[1:], pid)
+        return p
+
+
+    def go(self):
+        self.start()
+        self.back_sock.close()
+
+
+    def requestStop(self):
+        self.front_sock.send(pickle.dumps(("stop", {})))
+
+
+    def waitStop(self):
+        self.join()
+        self.front_sock.close()
+
+
+    def stop(self):
+        self.requestStop()
+        self.waitStop()
@@ -20,6 +20,7 @@ You should have received a copy of the GNU Affero General Public License along w
 @brief   Main graphical user interface for the Valkka Live program
 """
 import imp
+import os
 import sys
 import pydoc
 import json
@@ -64,6 +65,9 @@ from valkka.live.gpuhandler import GPUHandler
 from valkka.live import style, container, tools, constant
 from valkka.live import default
 from valkka.live.cpu import CPUScheme
+from valkka.live.pool import MVisionProcessPool
+from valkka.live.forkserver import ForkServer
+from valkka.live.metadata import MetadataWriter
 from valkka.live.quickmenu import QuickMenu, QuickMenuElement
 from valkka.live.qt.playback import PlaybackController
 from valkka.live.qt.tools import QCapsulate, QTabCapsulate, getCorrectedGeom
@@ -597,7 +601,7 @@ class MyGui(QtWidgets.QMainWindow):
         
         Read all about it in here : http://www.linuxprogrammingblog.com/threads-and-fork-think-twice-before-using-them
         """
-        singleton.process_map = {} # each key is a list of started multiprocesses
+        singleton.process_map = {} # each key is a process pool: standalone multiprocesses are started on demand
         # self.process_avail = {} # count instances
 
         singleton.client_process_map = {}
@@ -620,12 +624,41 @@ class MyGui(QtWidgets.QMainWindow):
                         p.go()
                         process_map[tag].append(p)
             
-        span(self.mvision_classes, singleton.process_map)
+        # standalone processes are forked later on from the fork server, so it must be started before openValkka starts the libValkka threads
+        self.fork_server = ForkServer()
+        self.fork_server.go()
+
+        for mvision_class in self.mvision_classes:
+            if (mvision_class.tag not in singleton.process_map):
+                print("startProcesses: pool for", mvision_class.tag)
+                singleton.process_map[mvision_class.tag] = MVisionProcessPool(
+                    mvision_class = mvision_class,
+                    fork_server   = self.fork_server,
+                    n_warm        = constant.mvision_warm_processes,
+                    idle_timeout  = constant.mvision_idle_timeout,
+                    verbose       = singleton.mvision_verbose
+                    )
+        # client & master processes share eventfds, pipes, etc. through forking, so they are all started here
         span(self.mvision_client_classes, singleton.client_process_map)
         span(self.mvision_master_classes, singleton.master_process_map)
+
+        # migrate clients between master processes according to their load
+        self.rebalance_timer = QtCore.QTimer()
+        self.rebalance_timer.setInterval(constant.mvision_rebalance_interval)
+        self.rebalance_timer.timeout.connect(singleton.rebalance_master_processes)
+        if len(self.mvision_master_classes) > 0:
+            self.rebalance_timer.start()
+
+        # stop idle standalone processes
+        self.pool_timer = QtCore.QTimer()
+        self.pool_timer.setInterval(constant.mvision_pool_interval)
+        self.pool_timer.timeout.connect(singleton.maintain_process_pools)
+        self.pool_timer.start()
         
         
     def closeProcesses(self):
+        self.rebalance_timer.stop()
+        self.pool_timer.stop()
 
         def stop(process_map):
             for key in process_map:
@@ -638,13 +671,16 @@ class MyGui(QtWidgets.QMainWindow):
                 for p in process_map[key]:
                     p.waitStop()
 
-        stop(singleton.process_map)
+        for pool in singleton.process_map.values():
+            pool.requestStop()
         stop(singleton.client_process_map)
         stop(singleton.master_process_map)
 
-        wait(singleton.process_map)
+        for pool in singleton.process_map.values():
+            pool.waitStop()
         wait(singleton.client_process_map)
         wait(singleton.master_process_map)
+        self.fork_server.stop() # after its processes have exited
 
         
     # *** Valkka ***
@@ -701,6 +737,8 @@ class MyGui(QtWidgets.QMainWindow):
         n_blocks  = valkkafs_config["n_blocks"]
         fs_flavor = valkkafs_config["fs_flavor"] 
         record    = valkkafs_config["record"]
+        # configs saved before this option existed don't have the key
+        record_analyzer = valkkafs_config.get("record_analyzer", False)
 
         # TODO: activate this if ValkkaFS changed in config!
         if fs_flavor == "file":
@@ -749,6 +787,7 @@ class MyGui(QtWidgets.QMainWindow):
                     "blocksize"      : valkkafs_config["blocksize"],
                     "fs_flavor"      : valkkafs_config["fs_flavor"],
                     "record"         : record,
+                    "record_analyzer": record_analyzer,
                     "partition_uuid" : partition_uuid
                 })
 
@@ -775,9 +814,20 @@ class MyGui(QtWidgets.QMainWindow):
             cpu_scheme    = self.cpu_scheme)
         self.filterchain_group.read()
 
-        if record:
+        if record and record_analyzer:
+            # gates stay closed until a machine vision process opens them
+            # (see MVisionMixin.triggerRecording__)
+            print("openValkka: ValkkaFS **ANALYZER TRIGGERED RECORDING ACTIVATED**")
+            self.filterchain_group.setRecording(RecordType.analyzer, self.valkkafsmanager)
+        elif record:
             print("openValkka: ValkkaFS **RECORDING ACTIVATED**")
             self.filterchain_group.setRecording(RecordType.always, self.valkkafsmanager)
+
+        # detections & events of the machine vision processes, for searching the recordings
+        singleton.metadata_writer = MetadataWriter(
+            directory = os.path.join(singleton.config_dir.get(), "metadata")
+            )
+        singleton.metadata_writer.start()
         
         # self.filterchain_group.update() # TODO: use this once fixed
         
@@ -823,6 +873,10 @@ class MyGui(QtWidgets.QMainWindow):
         
         print("Closing ValkkaFS threads")
         self.valkkafsmanager.close()
+
+        print("Closing metadata writer")
+        singleton.metadata_writer.close()
+        singleton.metadata_writer = None
         
         # print("Closing multiprocessing frontend")
         """
@@ -881,7 +935,7 @@ class MyGui(QtWidgets.QMainWindow):
         if cl.auto_menu == False:
             return
         def slot_func():
-            if ( (cl.tag in singleton.process_map) and (len(singleton.process_map[cl.tag])>0) ):
+            if ( (cl.tag in singleton.process_map) and singleton.process_map[cl.tag].available() ):
                 cont = container.VideoContainerNxM(
                     parent            = None,
                     gpu_handler       = self.gpu_handler,
@@ -0,0 +1,416 @@
+"""
+metadata.py : Append-only store for detections & events of the machine vision processes
+
+Copyright 2019 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the Valkka Live video surveillance program
+
+Valkka Live is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+@file    metadata.py
+@author  Sampsa Riikonen
+@date    2019
+@version 0.12.1
+@brief   Append-only store for detections & events of the machine vision processes
+"""
+
+import sys
+import os
+import time
+import json
+import queue
+import threading
+import numpy
+
+from valkka.api2.tools import parameterInitCheck
+from valkka.live.tools import getLogger
+
+
+# a record: detection (tag, box, score) or an event (tag, zero box) of a camera (slot) at a time (mstimestamp)
+record_dtype = numpy.dtype([
+    ("mstimestamp", "<i8"),
+    ("slot",        "<i4"),
+    ("tag",         "<i4"),         # index into the tag table, see MetadataStore.getTag
+    ("box",         "<f4", (4,)),   # x0, x1, y0, y1 in relative coordinates, as in the bbox_list of the YOLO processes
+    ("score",       "<f4")
+])
+
+partition_ms = 3600 * 1000 # records are partitioned by the hour
+
+
+# The store is a directory with:
+#
+#   tags.json                   : list of tag names.  Records refer to tags by their index in this list
+#   <partition>/                : records having mstimestamp // partition_ms == partition
+#       mstimestamp, slot, ..   : one file per column of record_dtype: the raw values of the column
+#       summary.json            : number of records, time range, slots & tags present & whether the records are in time order
+#
+# Column files are only appended to & read with numpy.memmap.  The record count in summary.json is written after the columns,
+# so readers never see partially written records
+
+
+def writeJson__(fname, obj):
+    tmp = fname + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, fname) # atomic
+
+
+def readJson__(fname, default):
+    try:
+        with open(fname, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+
+class MetadataWriter(threading.Thread):
+    """Writes records to the store from a background thread
+
+    Call add from the frontend (i.e. from Qt slots): records are queued & written every flush_interval seconds, sorted by time & split into partitions
+    """
+
+    parameter_defs = {
+        "directory"         : str,          # :param directory:         Directory of the store
+        "flush_interval"    : (float, 1.0), # :param flush_interval:    Write queued records this often (secs)
+        "verbose"           : (bool, False)
+    }
+
+    def __init__(self, **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        super().__init__()
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
+        os.makedirs(self.directory, exist_ok = True)
+        self.queue = queue.Queue()
+        self.tag_file = os.path.join(self.directory, "tags.json")
+        self.tags = readJson__(self.tag_file, [])
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        self.summaries = {} # partition => summary dict, for the partitions touched by this writer
+        self.loop = True
+
+
+    # *** frontend ***
+
+    def add(self, slot, mstimestamp, tags, boxes = None, scores = None):
+        """Queue records of a frame: a list of tags, with optional lists of boxes & scores.  Thread-safe & doesn't block
+        """
+        if len(tags) < 1:
+            return
+        self.queue.put((slot, mstimestamp, list(tags), boxes, scores))
+
+
+    def addEvent(self, slot, mstimestamp, tag):
+        """Queue an event, i.e. "start_move"
+        """
+        self.queue.put((slot, mstimestamp, [tag], None, None))
+
+
+    def requestClose(self):
+        self.queue.put(None)
+
+
+    def waitClose(self):
+        self.join()
+
+
+    def close(self):
+        self.requestClose()
+        self.waitClose()
+
+
+    # *** writer thread ***
+
+    def run(self):
+        while self.loop:
+            items = []
+            try:
+                items.append(self.queue.get(timeout = self.flush_interval))
+                while True:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in items: # write what came before closing
+                items = items[0:items.index(None)]
+                self.loop = False
+            if len(items) > 0:
+                self.write__(items)
+        self.logger.debug("run: bye!")
+
+
+    def tagIndex__(self, tag):
+        i = self.tag_index.get(tag, None)
+        if i is None:
+            i = len(self.tags)
+            self.tags.append(tag)
+            self.tag_index[tag] = i
+            writeJson__(self.tag_file, self.tags) # before any record refers to it
+        return i
+
+
+    def records__(self, items):
+        n = sum(len(tags) for slot, mstimestamp, tags, boxes, scores in items)
+        records = numpy.zeros(n, dtype = record_dtype)
+        i = 0
+        for slot, mstimestamp, tags, boxes, scores in items:
+            m = len(tags)
+            records["mstimestamp"][i:i+m] = mstimestamp
+            records["slot"][i:i+m] = slot
+            records["tag"][i:i+m] = [self.tagIndex__(tag) for tag in tags]
+            if boxes is not None and len(boxes) > 0:
+                k = min(m, len(boxes))
+                records["box"][i:i+k] = numpy.asarray(boxes[0:k], dtype = numpy.float32)
+            if scores is not None and len(scores) > 0:
+                k = min(m, len(scores))
+                records["score"][i:i+k] = numpy.asarray(scores[0:k], dtype = numpy.float32)
+            else:
+                records["score"][i:i+m] = 1.0
+            i += m
+        return records
+
+
+    def write__(self, items):
+        records = self.records__(items)
+        records = records[numpy.argsort(records["mstimestamp"], kind = "stable")]
+        partitions = records["mstimestamp"] // partition_ms
+        bounds = numpy.flatnonzero(numpy.diff(partitions)) + 1
+        for chunk in numpy.split(records, bounds):
+            self.append__(int(chunk["mstimestamp"][0] // partition_ms), chunk)
+        self.logger.debug("write__: wrote %s records", len(records))
+
+
+    def summary__(self, partition):
+        """Summary of a partition.  The first time a partition is touched, column files are truncated to the committed record count (in case the program died while writing)
+        """
+        summary = self.summaries.get(partition, None)
+        if summary is not None:
+            return summary
+        dirname = os.path.join(self.directory, str(partition))
+        os.makedirs(dirname, exist_ok = True)
+        summary = readJson__(os.path.join(dirname, "summary.json"), None)
+        if summary is None:
+            summary = {"count" : 0, "t_min" : None, "t_max" : None, "slots" : [], "tags" : [], "sorted" : True}
+        for name in record_dtype.names:
+            fname = os.path.join(dirname, name)
+            size = summary["count"] * record_dtype[name].itemsize
+            if os.path.exists(fname) and (os.path.getsize(fname) > size):
+                os.truncate(fname, size)
+        self.summaries[partition] = summary
+        return summary
+
+
+    def append__(self, partition, records):
+        summary = self.summary__(partition)
+        dirname = os.path.join(self.directory, str(partition))
+        for name in record_dtype.names:
+            with open(os.path.join(dirname, name), "ab") as f:
+                f.write(numpy.ascontiguousarray(records[name]).tobytes())
+
+        t_min = int(records["mstimestamp"][0]) # records are sorted
+        t_max = int(records["mstimestamp"][-1])
+        if summary["t_max"] is not None:
+            summary["sorted"] = summary["sorted"] and (t_min >= summary["t_max"])
+            t_min = min(t_min, summary["t_min"])
+            t_max = max(t_max, summary["t_max"])
+        summary["count"] += len(records)
+        summary["t_min"] = t_min
+        summary["t_max"] = t_max
+        summary["slots"] = sorted(set(summary["slots"]) | set(numpy.unique(records["slot"]).tolist()))
+        summary["tags"] = sorted(set(summary["tags"]) | set(numpy.unique(records["tag"]).tolist()))
+        writeJson__(os.path.join(dirname, "summary.json"), summary) # commits the records
+
+
+
+class MetadataStore:
+    """Queries the store written by MetadataWriter
+
+    Partitions outside the time range, or without any of the requested slots or tags, are skipped using their summaries.  Within a partition, the time range is found with a binary search (if the records are in time order) and slots & tags are filtered with numpy array ops over memory-mapped columns
+    """
+
+    parameter_defs = {
+        "directory" : str,  # :param directory: Directory of the store
+        "verbose"   : (bool, False)
+    }
+
+    def __init__(self, **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
+        self.tags = []
+        self.tags_mtime = None
+        self.summaries = {} # partition => (mtime, summary)
+        self.columns = {} # partition => (count, dict of memmaps)
+
+
+    def readTags__(self):
+        fname = os.path.join(self.directory, "tags.json")
+        try:
+            mtime = os.path.getmtime(fname)
+        except OSError:
+            return
+        if mtime != self.tags_mtime:
+            self.tags = readJson__(fname, self.tags)
+            self.tags_mtime = mtime
+
+
+    def getTags(self):
+        """List of all tag names
+        """
+        self.readTags__()
+        return list(self.tags)
+
+
+    def getTag(self, i):
+        """Tag name of a record's tag index
+        """
+        if i >= len(self.tags):
+            self.readTags__()
+        return self.tags[i]
+
+
+    def partitions__(self, t0, t1):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        partitions = sorted(int(name) for name in names if name.isdigit())
+        p0 = None if t0 is None else t0 // partition_ms
+        p1 = None if t1 is None else t1 // partition_ms
+        return [p for p in partitions if ((p0 is None) or (p >= p0)) and ((p1 is None) or (p <= p1))]
+
+
+    def summary__(self, partition):
+        fname = os.path.join(self.directory, str(partition), "summary.json")
+        try:
+            mtime = os.path.getmtime(fname)
+        except OSError:
+            return None
+        cached = self.summaries.get(partition, None)
+        if (cached is None) or (cached[0] != mtime):
+            cached = (mtime, readJson__(fname, None))
+            self.summaries[partition] = cached
+        return cached[1]
+
+
+    def columns__(self, partition, count):
+        cached = self.columns.get(partition, None)
+        if (cached is None) or (cached[0] != count):
+            dirname = os.path.join(self.directory, str(partition))
+            columns = {}
+            for name in record_dtype.names:
+                dtype = record_dtype[name]
+                columns[name] = numpy.memmap(os.path.join(dirname, name), dtype = dtype.base, mode = "r", shape = (count,) + dtype.shape)
+            cached = (count, columns)
+            self.columns[partition] = cached
+        return cached[1]
+
+
+    def query(self, t0 = None, t1 = None, slots = None, tags = None):
+        """Records with t0 <= mstimestamp <= t1, slot in slots & tag (name) in tags.  None = any.  Returns a record_dtype array in time order (per partition)
+
+        i.e. all persons on camera 5 between 02:00 and 03:00:
+
+        ::
+
+            store.query(t0, t1, slots = [5], tags = ["person"])
+
+        """
+        self.readTags__()
+        slot_ids = None if slots is None else numpy.asarray(slots, dtype = numpy.int32)
+        tag_ids = None
+        if tags is not None:
+            tag_ids = numpy.asarray([self.tags.index(tag) for tag in tags if tag in self.tags], dtype = numpy.int32)
+            if len(tag_ids) < 1:
+                return numpy.zeros(0, dtype = record_dtype)
+
+        results = []
+        for partition in self.partitions__(t0, t1):
+            summary = self.summary__(partition)
+            if (summary is None) or (summary["count"] < 1):
+                continue
+            if ((t0 is not None) and (summary["t_max"] < t0)) or ((t1 is not None) and (summary["t_min"] > t1)):
+                continue
+            if (slot_ids is not None) and not set(summary["slots"]).intersection(slot_ids.tolist()):
+                continue
+            if (tag_ids is not None) and not set(summary["tags"]).intersection(tag_ids.tolist()):
+                continue
+
+            columns = self.columns__(partition, summary["count"])
+            ts = columns["mstimestamp"]
+            if summary["sorted"]: # binary search for the time range
+                lo = 0 if t0 is None else int(numpy.searchsorted(ts, t0, side = "left"))
+                hi = len(ts) if t1 is None else int(numpy.searchsorted(ts, t1, side = "right"))
+                mask = numpy.ones(hi - lo, dtype = numpy.bool_)
+            else:
+                lo, hi = 0, len(ts)
+                mask = numpy.ones(hi, dtype = numpy.bool_)
+                if t0 is not None: mask &= (ts >= t0)
+                if t1 is not None: mask &= (ts <= t1)
+            if slot_ids is not None:
+                mask &= numpy.isin(columns["slot"][lo:hi], slot_ids)
+            if tag_ids is not None:
+                mask &= numpy.isin(columns["tag"][lo:hi], tag_ids)
+
+            index = numpy.flatnonzero(mask) + lo
+            if len(index) < 1:
+                continue
+            result = numpy.empty(len(index), dtype = record_dtype)
+            for name in record_dtype.names:
+                result[name] = columns[name][index]
+            if not summary["sorted"]:
+                result = result[numpy.argsort(result["mstimestamp"], kind = "stable")]
+            results.append(result)
+
+        if len(results) < 1:
+            return numpy.zeros(0, dtype = record_dtype)
+        return numpy.concatenate(results)
+
+
+
+def test1():
+    """Write a few days of random detections & query them
+    """
+    import tempfile
+    directory = tempfile.mkdtemp()
+    writer = MetadataWriter(directory = directory, flush_interval = 0.1)
+    writer.start()
+    t_start = int(time.time() * 1000) - 3 * 24 * partition_ms
+    tag_names = ["person", "car", "dog", "start_move", "stop_move"]
+    n = 0
+    for t in range(t_start, t_start + 3 * 24 * partition_ms, 1000): # a frame per second per camera
+        for slot in range(1, 5):
+            tags = [tag_names[i] for i in numpy.random.randint(0, 3, numpy.random.randint(0, 4))]
+            writer.add(slot, t, tags, boxes = numpy.random.rand(len(tags), 4), scores = numpy.random.rand(len(tags)))
+            n += len(tags)
+    writer.close()
+    print("wrote", n, "records into", directory)
+
+    store = MetadataStore(directory = directory)
+    t0 = t_start + 26 * partition_ms
+    t1 = t0 + partition_ms
+    t = time.time()
+    result = store.query(t0, t1, slots = [2], tags = ["person"])
+    print("query: %i records in %.2f ms" % (len(result), (time.time() - t) * 1000))
+    t = time.time()
+    result = store.query(tags = ["dog"])
+    print("query over everything: %i records in %.2f ms" % (len(result), (time.time() - t) * 1000))
+    print(result[0:3], [store.getTag(i) for i in result["tag"][0:3]])
+
+
+def main():
+    pre = "main :"
+    print(pre, "main: arguments: ", sys.argv)
+    if (len(sys.argv) < 2):
+        print(pre, "main: needs test number")
+    else:
+        st = "test" + str(sys.argv[1]) + "()"
+        exec(st)
+
+
+if (__name__ == "__main__"):
+    main()
@@ -21,11 +21,16 @@ You should have received a copy of the GNU Affero General Public License along w
 """
 
 from multiprocessing import Process, Pipe
+from multiprocessing.connection import Connection
+import os
 import select
 import errno
 import time
 import sys
 import logging
+import struct
+import pickle
+import numpy
 
 from PySide2 import QtCore, QtWidgets
 from valkka.live.tools import getLogger, setLogger
@@ -46,6 +51,153 @@ class MessageObject:
         return self.kwargs[key]
 
 
+class MessageCodec:
+    """A fixed binary schema for MessageObjects of a command having exactly the given kwargs
+
+    fields is a list of tuples (name, kind), where kind is a struct format character for a scalar (i.e. "i", "q", "d" or "?") or one of:
+
+    ::
+
+        "str"       : a string
+        "strs"      : a list of strings
+        "array"     : a numpy array of any dtype & shape
+        "tuples"    : a list of equal-length tuples of numbers (i.e. bounding boxes), decoded as tuples of floats
+
+    Encoded messages start with the one-byte id of the codec, followed by the scalars & the variable-length fields, each prefixed with its length
+    """
+
+    length = struct.Struct("<I")
+
+    def __init__(self, command, fields):
+        self.command = command
+        self.id = None # set by registerMessage
+        self.names = frozenset(name for name, kind in fields)
+        self.scalar_names = [name for name, kind in fields if len(kind) == 1]
+        self.variable = [(name, kind) for name, kind in fields if len(kind) > 1]
+        self.header = struct.Struct("<B" + "".join(kind for name, kind in fields if len(kind) == 1))
+        for name, kind in self.variable:
+            if not hasattr(self, "encode_" + kind):
+                raise(AttributeError("Unknown field kind " + kind))
+        self.encoders = [(name, getattr(self, "encode_" + kind)) for name, kind in self.variable]
+        self.decoders = [(name, getattr(self, "decode_" + kind)) for name, kind in self.variable]
+
+
+    def encode(self, kwargs):
+        parts = [self.header.pack(self.id, *[kwargs[name] for name in self.scalar_names])]
+        for name, encoder in self.encoders:
+            payload = encoder(kwargs[name])
+            parts.append(self.length.pack(len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+
+    def decode(self, buf):
+        values = self.header.unpack_from(buf)
+        kwargs = dict(zip(self.scalar_names, values[1:]))
+        offset = self.header.size
+        for name, decoder in self.decoders:
+            n = self.length.unpack_from(buf, offset)[0]
+            offset += self.length.size
+            kwargs[name] = decoder(buf[offset:offset + n])
+            offset += n
+        return MessageObject(self.command, **kwargs)
+
+
+    @staticmethod
+    def encode_str(st):
+        return st.encode("utf-8")
+
+    @staticmethod
+    def decode_str(buf):
+        return buf.decode("utf-8")
+
+    @staticmethod
+    def encode_strs(lis):
+        # the count tells apart [] and [""]
+        return MessageCodec.length.pack(len(lis)) + "\0".join(lis).encode("utf-8")
+
+    @staticmethod
+    def decode_strs(buf):
+        if MessageCodec.length.unpack_from(buf)[0] < 1:
+            return []
+        return buf[MessageCodec.length.size:].decode("utf-8").split("\0")
+
+    @staticmethod
+    def encode_array(arr):
+        arr = numpy.ascontiguousarray(arr)
+        dtype = arr.dtype.str.encode("ascii")
+        return struct.pack("<BB", len(dtype), arr.ndim) + dtype + struct.pack("<%iI" % arr.ndim, *arr.shape) + arr.tobytes()
+
+    @staticmethod
+    def decode_array(buf):
+        n_dtype, ndim = struct.unpack_from("<BB", buf)
+        dtype = buf[2:2 + n_dtype].decode("ascii")
+        offset = 2 + n_dtype
+        shape = struct.unpack_from("<%iI" % ndim, buf, offset)
+        offset += 4 * ndim
+        return numpy.frombuffer(buf, dtype = dtype, offset = offset).reshape(shape).copy()
+
+    @staticmethod
+    def encode_tuples(lis):
+        if len(lis) < 1:
+            return b""
+        arr = numpy.asarray(lis, dtype = numpy.float64)
+        if arr.ndim != 2:
+            raise(ValueError("tuples of unequal length"))
+        return struct.pack("<I", arr.shape[1]) + arr.tobytes()
+
+    @staticmethod
+    def decode_tuples(buf):
+        if len(buf) < 1:
+            return []
+        width = struct.unpack_from("<I", buf)[0]
+        arr = numpy.frombuffer(buf, dtype = numpy.float64, offset = 4).reshape(-1, width)
+        return [tuple(row) for row in arr.tolist()]
+
+
+# codec id 0 is pickle, for everything that doesn't match a registered schema.  Ids are given in
+# registration order, so both ends of a pipe must register the same schemas in the same order,
+# i.e. at module import (before forking)
+message_codecs = [None] # id => MessageCodec
+message_codecs_by_key = {} # (command, frozenset of kwarg names) => MessageCodec
+
+
+def registerMessage(command, fields = []):
+    """Register a binary schema for MessageObjects of a command with these fields (see MessageCodec)
+    """
+    codec = MessageCodec(command, fields)
+    key = (command, codec.names)
+    if key in message_codecs_by_key:
+        return message_codecs_by_key[key]
+    if len(message_codecs) > 255:
+        raise(AttributeError("Too many message schemas"))
+    codec.id = len(message_codecs)
+    message_codecs.append(codec)
+    message_codecs_by_key[key] = codec
+    return codec
+
+
+def encodeMessage(obj):
+    """MessageObject (or None) => bytes
+    """
+    if obj is not None:
+        codec = message_codecs_by_key.get((obj.command, frozenset(obj.kwargs)), None)
+        if codec is not None:
+            try:
+                return codec.encode(obj.kwargs)
+            except (struct.error, TypeError, ValueError, AttributeError):
+                logger.debug("encodeMessage: %s does not fit its schema, pickling", obj.command)
+    return b"\0" + pickle.dumps(obj, protocol = pickle.HIGHEST_PROTOCOL)
+
+
+def decodeMessage(buf):
+    """bytes => MessageObject (or None)
+    """
+    if buf[0] == 0:
+        return pickle.loads(buf[1:])
+    return message_codecs[buf[0]].decode(buf)
+
+
 
 def safe_select(l1, l2, l3, timeout = None):
     """
@@ -74,30 +226,94 @@ def safe_select(l1, l2, l3, timeout = None):
 
 class QFrontThread(QtCore.QThread):
     """A QThread that is used to read messages MessageObjects coming from multiprocess & turning them into Qt signals
+
+    Messages whose command is in coalesce are not emitted right away: only the latest one per command (and per slot, for messages carrying one) is kept & they're emitted at most rate times per second.  This keeps per-frame results from flooding the GUI thread.  rate 0 = emit everything right away
+
+    Listeners (see listen) get every message, before coalescing, in this thread
     """
-    def __init__(self, signals, pipe):
+    def __init__(self, signals, pipe, coalesce = [], rate = 0.0):
         self.pre = __name__ + "." + self.__class__.__name__
         self.logger = getLogger(self.pre)
         super().__init__()
         self.signals = signals
         self.pipe = pipe
         self.loop = True
+        self.coalesce = set(coalesce)
+        self.setRate(rate)
+        self.pending = {} # (command, slot) => latest MessageObject
+        self.t_emit = 0 # when the pending messages were last emitted
+        self.listeners = {} # command => tuple of callbacks, see listen
         # self.setDebug()
 
 
     def setDebug(self):
         setLogger(self.logger, logging.DEBUG)
 
+    def setRate(self, rate):
+        """Max emission rate (1/s) of the coalesced signals.  Can be called from the frontend while running
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0
+
+    def listen(self, command, callback):
+        """Call callback(kwargs) for every message having command, also for the coalesced ones.  Can be called from the frontend while running
+
+        The callback is called in this thread, so it must be thread-safe & quick (i.e. queue the message)
+        """
+        # a new dict, so that readPipes__ always sees a consistent one
+        listeners = dict(self.listeners)
+        listeners[command] = listeners.get(command, ()) + (callback,)
+        self.listeners = listeners
+
+    def unlisten(self, command, callback):
+        listeners = dict(self.listeners)
+        callbacks = tuple(c for c in listeners.get(command, ()) if c != callback)
+        if len(callbacks) > 0:
+            listeners[command] = callbacks
+        else:
+            listeners.pop(command, None)
+        self.listeners = listeners
+
     def run(self):
         while self.loop:
-            self.readPipes__(timeout = None)
+            self.readPipes__(timeout = self.timeout__())
         self.logger.debug("QFrontThread: bye!")
 
+    def timeout__(self):
+        """Wait for messages at most until the pending ones are due
+        """
+        if len(self.pending) < 1:
+            return None
+        return max(0, self.t_emit + self.interval - time.monotonic())
+
     def readPipes__(self, timeout):
-        obj = self.pipe.recv()
-        if obj is None:
-            self.loop = False
-            return
+        if (timeout is None) or self.pipe.poll(timeout):
+            obj = decodeMessage(self.pipe.recv_bytes())
+            if obj is None:
+                self.loop = False
+                return
+            self.callListeners__(obj)
+            if (self.interval > 0) and (obj.command in self.coalesce):
+                self.pending[(obj.command, obj.kwargs.get("slot", None))] = obj # replaces the previous one
+            else:
+                self.emit__(obj)
+        if (len(self.pending) > 0) and ((time.monotonic() - self.t_emit) >= self.interval):
+            self.flush__()
+
+    def callListeners__(self, obj):
+        for callback in self.listeners.get(obj.command, ()):
+            try:
+                callback(obj.kwargs)
+            except Exception as e: # don't let a listener kill this thread
+                self.logger.warning("QFrontThread: listener %s failed with %s", callback, e)
+
+    def flush__(self):
+        pending = self.pending
+        self.pending = {}
+        self.t_emit = time.monotonic()
+        for obj in pending.values():
+            self.emit__(obj)
+
+    def emit__(self, obj):
         # convert a messages from the multiprocess into a Qt signal
         if hasattr(self.signals, obj.command):
             signal = getattr(self.signals, obj.command)
@@ -132,6 +348,8 @@ class QMultiProcess(Process):
     """
 
     timeout = 1.0
+    coalesced_signals = [] # outgoing signals that are rate-limited to gui_rate, keeping only the latest message (see QFrontThread)
+    gui_rate = 0.0 # max rate (1/s) of the coalesced signals.  0 = no rate limit
 
     class Signals(QtCore.QObject):
         pong = QtCore.Signal(object) # demo outgoing signal
@@ -155,9 +373,11 @@ class QMultiProcess(Process):
         self.signals = self.Signals()
         print("class, signals:", self.__class__.__name__, self.signals)
         self.front_pipe, self.back_pipe = Pipe() # incoming messages
-        self.qt_front_thread = QFrontThread(self.signals, self.front_pipe)
+        self.qt_front_thread = QFrontThread(self.signals, self.front_pipe,
+            coalesce = self.coalesced_signals, rate = self.gui_rate)
         self.loop = True
         self.listening = False # are we listening something else than just the intercom pipes?
+        self.remote_pid = None # frontend: set if the backend was forked by a fork server (see attach)
 
     def __str__(self):
         return "<"+self.pre+">"
@@ -177,7 +397,7 @@ class QMultiProcess(Process):
                 self.readPipes__(timeout = self.timeout) # timeout of 1 sec
 
         # indicate front end qt thread to exit
-        self.back_pipe.send(None)
+        self.send_out__(None)
         self.logger.debug("bye!")
 
 
@@ -188,7 +408,7 @@ class QMultiProcess(Process):
         r, w, e = safe_select(rlis, [], [], timeout = timeout) # timeout = 0 == this is just a poll
         # handle the main intercom pipe
         if self.back_pipe in r:
-            obj = self.back_pipe.recv()
+            obj = self.recv_in__()
             r.remove(self.back_pipe)
             self.routeMainPipe__(obj)
         # in your subclass, handle rest of the pipes
@@ -218,33 +438,75 @@ class QMultiProcess(Process):
             self.logger.warning("routeMainPipe : no such method %s" %(method_name))
 
 
+    def recv_in__(self):
+        """Read a MessageObject (or None) from the incoming pipe
+        """
+        return decodeMessage(self.back_pipe.recv_bytes())
+
+
     def send_out__(self, obj):
-        """Pickle obj & send to outgoing pipe
+        """Encode obj (see encodeMessage) & send to outgoing pipe
         """
-        self.back_pipe.send(obj) # these are mapped to Qt signals
+        self.back_pipe.send_bytes(encodeMessage(obj)) # these are mapped to Qt signals
 
 
 
     # **** frontend ****
 
     def sendMessageToBack(self, message: MessageObject):
-        self.front_pipe.send(message)
+        self.front_pipe.send_bytes(encodeMessage(message))
 
     def go(self):
         self.qt_front_thread.start()
         self.start()
 
+    def frontendFds(self):
+        """File descriptors, besides the intercom pipe, that the frontend shares with the backend.  See attach
+        """
+        return []
+
+    def attach(self, pipe_fd, fds, pid):
+        """Use a backend that was forked elsewhere (see valkka.live.forkserver.ForkServer) instead of calling go
+
+        :param pipe_fd: frontend end of the intercom pipe of the backend
+        :param fds:     file descriptors of the backend that replace frontendFds, in the same order
+        :param pid:     process id of the backend
+        """
+        self.front_pipe.close()
+        self.back_pipe.close()
+        self.front_pipe = Connection(pipe_fd)
+        self.qt_front_thread.pipe = self.front_pipe
+        for fd, own_fd in zip(fds, self.frontendFds()):
+            os.dup2(fd, own_fd) # objects owning own_fd (i.e. eventfds) now refer to those of the backend
+            os.close(fd)
+        self.remote_pid = pid
+        self.qt_front_thread.start()
+
     def requestStop(self):
         self.sendMessageToBack(None)
         
     def waitStop(self):
-        self.join()
+        if self.remote_pid is None: # a backend forked by a fork server is joined there
+            self.join()
         self.qt_front_thread.wait()
 
     def stop(self):
         self.requestStop()
         self.waitStop()
 
+    def setGuiRate(self, rate):
+        """Change the max rate of the coalesced signals.  0 = no rate limit
+        """
+        self.qt_front_thread.setRate(rate)
+
+    def listen(self, command, callback):
+        """Get every outgoing message having command, even if its signal is coalesced.  callback(kwargs) is called in the frontend thread, see QFrontThread.listen
+        """
+        self.qt_front_thread.listen(command, callback)
+
+    def unlisten(self, command, callback):
+        self.qt_front_thread.unlisten(command, callback)
+
     # **** slots ****
 
     def ping_slot(self):
@@ -264,6 +526,31 @@ def test1():
     mp.waitStop()
 
 
+def test2():
+    """Binary codec vs. pickle: bytes & time per message
+    """
+    registerMessage("objects", [("object_list", "strs"), ("bbox_list", "tuples")])
+    registerMessage("activity", [("slot", "i"), ("activity", "array"), ("mstimestamp", "q")])
+    messages = [
+        MessageObject("objects", object_list = ["dog", "car"], bbox_list = [(0.1, 0.2, 0.3, 0.4), (0.5, 0.6, 0.7, 0.8)]),
+        MessageObject("activity", slot = 1, activity = numpy.zeros((9, 16), dtype = numpy.uint8), mstimestamp = int(time.time() * 1000)),
+        MessageObject("ping", lis = [1, 2, 3]) # no schema: pickled
+    ]
+    n = 10000
+    for message in messages:
+        t = time.perf_counter()
+        for i in range(n):
+            decodeMessage(encodeMessage(message))
+        t_codec = (time.perf_counter() - t) / n * 1e6
+        t = time.perf_counter()
+        for i in range(n):
+            pickle.loads(pickle.dumps(message))
+        t_pickle = (time.perf_counter() - t) / n * 1e6
+        print("%10s : codec %4i bytes %6.2f us, pickle %4i bytes %6.2f us" % (
+            message.command, len(encodeMessage(message)), t_codec, len(pickle.dumps(message)), t_pickle))
+        print("           ", decodeMessage(encodeMessage(message)))
+
+
 
 if __name__ == "__main__":
     import logging    
@@ -0,0 +1,157 @@
+"""
+pool.py : Start machine vision multiprocesses on demand
+
+Copyright 2019 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the Valkka Live video surveillance program
+
+Valkka Live is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+@file    pool.py
+@author  Sampsa Riikonen
+@date    2019
+@version 0.12.1
+@brief   Start machine vision multiprocesses on demand
+"""
+
+import time
+from valkka.api2.tools import parameterInitCheck
+from valkka.live.tools import getLogger
+
+
+class MVisionProcessPool:
+    """Starts multiprocesses of a machine vision class on demand, up to max_instances of the class
+
+    Processes are started in get, when there is no idle process, so nothing is started for classes that are never used.  They're forked from a fork server (see valkka.live.forkserver.ForkServer) that was started at program startup: forking the running program itself (having Qt and libValkka threads) is asking for trouble.
+
+    A process that is given back to the pool stays running for idle_timeout seconds & is then stopped, unless it's one of the n_warm most recently used idle processes, that are kept running.  Call maintain periodically to stop the idle processes.
+
+    For multi-stream classes (having max_streams > 1, see valkka.mvision.multiprocess.MVisionMultiBaseProcess), get returns a stream handle.  Streams are packed into the running processes before new processes are started
+    """
+
+    parameter_defs = {
+        "mvision_class" : None,             # a QShmemProcess subclass
+        "fork_server"   : None,             # a valkka.live.forkserver.ForkServer that has been started
+        "n_warm"        : (int, 1),         # number of idle processes to keep running
+        "idle_timeout"  : (float, 300.0),   # stop idle processes after this many seconds
+        "verbose"       : (bool, False)     # passed to the processes
+    }
+
+    def __init__(self, **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
+        self.idle = [] # running processes not in use: tuples (process, time when given back)
+        self.busy = [] # processes in use
+        self.max_streams = getattr(self.mvision_class, "max_streams", 1)
+
+
+    def __str__(self):
+        return "<MVisionProcessPool %s: %i idle, %i busy>" % (self.mvision_class.tag, len(self.idle), len(self.busy))
+
+
+    def spawn__(self):
+        self.logger.debug("spawn__: starting %s", self.mvision_class.tag)
+        return self.fork_server.spawn(self.mvision_class, verbose = self.verbose)
+
+
+    def getRunning(self):
+        return len(self.idle) + len(self.busy)
+
+
+    def shared__(self):
+        """Busy multi-stream processes that have free streams
+        """
+        if self.max_streams < 2:
+            return []
+        return [p for p in self.busy if p.freeStreams() > 0]
+
+
+    def available(self):
+        """Can a process (or a stream) be given out
+        """
+        return (len(self.shared__()) > 0) or (len(self.idle) > 0) or (self.getRunning() < self.mvision_class.max_instances)
+
+
+    def get(self):
+        """Returns an idle process, starts a new one or returns None if max_instances are in use (or the process could not be started)
+
+        For multi-stream classes, returns a stream of a running process (MVisionStream) if possible
+        """
+        shared = self.shared__()
+        if len(shared) > 0:
+            # the fullest process: keep the others free for reaping
+            return min(shared, key = lambda p: p.freeStreams()).openStream()
+        if len(self.idle) > 0:
+            p, t = self.idle.pop() # the most recently used one
+        elif self.getRunning() < self.mvision_class.max_instances:
+            try:
+                p = self.spawn__()
+            except OSError as e:
+                self.logger.error("get: %s", e)
+                return None
+        else:
+            return None
+        self.busy.append(p)
+        if self.max_streams > 1:
+            return p.openStream()
+        return p
+
+
+    def put(self, p):
+        """Give a process (or a stream) back to the pool
+        """
+        if self.max_streams > 1:
+            stream = p
+            p = stream.process
+            p.closeStream(stream)
+            if p.freeStreams() < self.max_streams: # still in use
+                return
+        self.busy.remove(p)
+        self.idle.append((p, time.time()))
+
+
+    def reap(self):
+        """Stop processes that have been idle for too long.  Returns the number of stopped processes
+        """
+        t = time.time()
+        n_reap = len(self.idle) - self.n_warm
+        reaped = []
+        keep = []
+        for p, t0 in self.idle: # the oldest first
+            if (len(reaped) < n_reap) and ((t - t0) >= self.idle_timeout):
+                reaped.append(p)
+            else:
+                keep.append((p, t0))
+        self.idle = keep
+        for p in reaped:
+            self.logger.debug("reap: stopping %s", p)
+            p.requestStop()
+        for p in reaped:
+            p.waitStop()
+        return len(reaped)
+
+
+    def maintain(self):
+        self.reap()
+
+
+    def requestStop(self):
+        for p, t in self.idle:
+            p.requestStop()
+        for p in self.busy:
+            p.requestStop()
+
+
+    def waitStop(self):
+        for p, t in self.idle:
+            p.waitStop()
+        for p in self.busy:
+            p.waitStop()
+        self.idle = []
+        self.busy = []
@@ -455,7 +455,7 @@ class VideoShmemThread(QtCore.QThread):
                 pass
             else:
                 # print(self.pre, "VideoShmemThread: client index, w, h =", index, meta.width, meta.height)
-                data = self.client.shmem_list[index]
+                data = self.client.shmem_list[index][0:meta.size] # frames may be smaller than the shmem buffers
                 img = data.reshape(
                     (meta.height, meta.width, 3))
                 pixmap = numpy2QPixmap(img)
@@ -484,11 +484,16 @@ class AnalyzerWidget(QtWidgets.QWidget):
     - Runs a VideoShmemThread that reads frames from shmem
     - ..frames from shmem => self.video.set_pixmap_slot
     - self.video is a custom analyzer video widget class (i.e. for defining lines, areas, etc.) that is encapsulated into this QMainWindow
+    - Tells the mvision process the preview budget: preview_fps & the size of self.video.  The mvision process pushes only that many frames, downscaled to that size
     """
 
+    preview_fps = 10 # preview frames per second requested from the mvision process
+    preview_delay = 300 # after a resize, wait this many msecs before sending the new size
+
     class Signals(QtCore.QObject):
         show = QtCore.Signal()
         close = QtCore.Signal()
+        preview = QtCore.Signal(object) # preview budget: dict with fps, width & height
 
     def __init__(self, parent = None, analyzer_video_widget_class = SimpleVideoWidget):
         super().__init__(parent)
@@ -506,6 +511,11 @@ class AnalyzerWidget(QtWidgets.QWidget):
         self.signals = self.Signals()
         self.lay.addWidget(self.video)
         self.thread_ = None # woops.. thread seems to be a member of QWidget..!
+        # resizing fires lots of events: send the size once the resizing has settled
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(self.preview_delay)
+        self.preview_timer.timeout.connect(self.sendPreviewBudget)
 
 
     def parametersToMvision(self) -> dict:
@@ -524,11 +534,26 @@ class AnalyzerWidget(QtWidgets.QWidget):
 
     def showEvent(self, e):
         print("AnalyzerWindow: showEvent")
-        # request shmem server from mvision process
+        # request shmem server from mvision process.  The budget first: the server is sized for it
+        self.sendPreviewBudget()
         self.signals.show.emit()
         e.accept()
 
 
+    def resizeEvent(self, e):
+        self.preview_timer.start()
+        super().resizeEvent(e)
+
+
+    def sendPreviewBudget(self):
+        size = self.video.size()
+        self.signals.preview.emit({
+            "fps"       : self.preview_fps,
+            "width"     : size.width(),
+            "height"    : size.height()
+        })
+
+
     def closeEvent(self, e):
         # TODO: why this is not fired?
         print("AnalyzerWindow: closeEvent: thread_", self.thread_)
@@ -551,6 +576,9 @@ class AnalyzerWidget(QtWidgets.QWidget):
         shmem_n_buffer = kwargs["shmem_n_buffer"]
         width = kwargs["width"]
         height = kwargs["height"]
+        if self.thread_ is not None: # the server was created anew, i.e. for a larger preview
+            self.thread_.stop()
+            self.thread_.signals.pixmap.disconnect(self.video.set_pixmap_slot)
         self.thread_ = VideoShmemThread(
                 shmem_name,
                 shmem_n_buffer,
@@ -52,22 +52,50 @@ data_model = None
 devices_by_id = {}
 
 # process map for different analyzers
-process_map = {}
+process_map = {} # standalone analyzers: a valkka.live.pool.MVisionProcessPool per tag
 client_process_map = {}
 master_process_map = {}
 
 
+# places client processes on master processes
+placement_engine = None
+
+# valkka.live.metadata.MetadataWriter: stores detections & events of the machine vision processes
+metadata_writer = None
+
+
+def get_placement_engine():
+    global placement_engine
+    if placement_engine is None:
+        from valkka.mvision.placement import PlacementEngine
+        placement_engine = PlacementEngine()
+    return placement_engine
+
+
 def get_avail_master_process(tag):
     global master_process_map
     try:
         queue = master_process_map[tag]
     except KeyError:
         return None
-    # return master process that still has space for clients
-    for process in queue: 
-        if process.available():
-            return process
-    return None
+    # return the least loaded master process that still has space for clients
+    return get_placement_engine().choose(queue)
+
+
+def rebalance_master_processes():
+    """Migrate client processes from busy master processes to idle ones
+    """
+    global master_process_map
+    for tag in master_process_map:
+        get_placement_engine().rebalance(master_process_map[tag])
+
+
+def maintain_process_pools():
+    """Stop standalone machine vision processes that have been idle for too long, except for a few warm ones (see valkka.live.pool.MVisionProcessPool)
+    """
+    global process_map
+    for tag in process_map:
+        process_map[tag].maintain()
 
 
 # QThread for interprocess communication
@@ -0,0 +1,77 @@
+"""Tests for valkka.live.forkserver.ForkServer
+"""
+import os
+import pytest
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import Connection
+
+pytest.importorskip("valkka.core") # valkka.live checks the libValkka version
+
+from valkka.live.forkserver import ForkServer
+
+
+class Echo(Process):
+    """A minimal process having the interface ForkServer expects (see QMultiProcess)
+    """
+
+    def __init__(self, prefix = ""):
+        super().__init__()
+        self.prefix = prefix
+        self.front_pipe, self.back_pipe = Pipe()
+        self.r, self.w = os.pipe() # shared with the frontend, like an eventfd
+        self.remote_pid = None
+
+    def run(self):
+        message = self.back_pipe.recv()
+        os.write(self.w, b"x")
+        self.back_pipe.send(self.prefix + message)
+
+    def frontendFds(self):
+        return [self.r]
+
+    def attach(self, pipe_fd, fds, pid):
+        self.front_pipe.close()
+        self.back_pipe.close()
+        self.front_pipe = Connection(pipe_fd)
+        for fd, own_fd in zip(fds, self.frontendFds()):
+            os.dup2(fd, own_fd)
+            os.close(fd)
+        self.remote_pid = pid
+
+
+main_pid = os.getpid()
+
+
+class Broken(Echo):
+    """Can be created in the main process only
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if os.getpid() != main_pid:
+            raise(AttributeError("can't start here"))
+
+
+@pytest.fixture
+def fork_server():
+    fork_server = ForkServer()
+    fork_server.go()
+    yield fork_server
+    fork_server.stop()
+
+
+def test_spawn(fork_server):
+    p = fork_server.spawn(Echo, prefix = "echo: ")
+    assert p.remote_pid not in (None, os.getpid())
+    assert not p.is_alive() # not forked from this process
+    p.front_pipe.send("hello")
+    assert p.front_pipe.recv() == "echo: hello"
+    assert os.read(p.r, 1) == b"x" # the shared fd refers to that of the backend
+
+
+def test_spawn_fails(fork_server):
+    with pytest.raises(OSError):
+        fork_server.spawn(Broken)
+    p = fork_server.spawn(Echo) # still serving
+    p.front_pipe.send("hello")
+    assert p.front_pipe.recv() == "hello"
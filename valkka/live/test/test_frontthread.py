@@ -0,0 +1,78 @@
+"""Tests for valkka.live.multiprocess.QFrontThread: coalescing & listeners
+"""
+import pytest
+from multiprocessing import Pipe
+
+pytest.importorskip("valkka.core") # valkka.live checks the libValkka version
+pytest.importorskip("valkka.api2")
+QtCore = pytest.importorskip("PySide2.QtCore")
+
+from valkka.live.multiprocess import QFrontThread, MessageObject, encodeMessage
+from valkka.live.metadata import MetadataWriter, MetadataStore
+
+
+class Signals(QtCore.QObject):
+    objects = QtCore.Signal(object)
+
+
+def frames(pipe, n):
+    """Send objects messages of n frames, as an object detector would
+    """
+    for i in range(n):
+        pipe.send_bytes(encodeMessage(MessageObject("objects",
+            object_list = ["person"],
+            bbox_list   = [(0.1, 0.2, 0.3, 0.4)],
+            score_list  = [0.9],
+            mstimestamp = 1000 + i
+            )))
+
+
+@pytest.fixture
+def front_thread():
+    front_pipe, back_pipe = Pipe()
+    signals = Signals()
+    thread = QFrontThread(signals, front_pipe, coalesce = ["objects"], rate = 1.0)
+    thread.emitted = []
+    signals.objects.connect(thread.emitted.append)
+    thread.back_pipe = back_pipe
+    return thread
+
+
+def test_listeners_get_coalesced_messages(front_thread):
+    listened = []
+    front_thread.listen("objects", listened.append)
+    frames(front_thread.back_pipe, 10)
+    for i in range(10):
+        front_thread.readPipes__(timeout = 0)
+    assert len(front_thread.emitted) == 1 # the rest are pending
+    assert [kwargs["mstimestamp"] for kwargs in listened] == list(range(1000, 1010))
+    front_thread.flush__()
+    assert front_thread.emitted[-1]["mstimestamp"] == 1009 # only the latest one
+
+
+def test_unlisten(front_thread):
+    listened = []
+    def broken(kwargs):
+        raise(ValueError("broken listener"))
+    front_thread.listen("objects", broken)
+    front_thread.listen("objects", listened.append)
+    frames(front_thread.back_pipe, 2)
+    front_thread.readPipes__(timeout = 0)
+    front_thread.unlisten("objects", listened.append)
+    front_thread.readPipes__(timeout = 0)
+    assert len(listened) == 1
+    assert len(front_thread.emitted) == 1 # a failing listener doesn't stop the signals
+
+
+def test_every_frame_is_stored(front_thread, tmp_path):
+    writer = MetadataWriter(directory = str(tmp_path), flush_interval = 0.1)
+    writer.start()
+    # as in MVisionContainer.storeObjects
+    front_thread.listen("objects", lambda kwargs: writer.add(
+        5, kwargs["mstimestamp"], kwargs["object_list"], boxes = kwargs["bbox_list"], scores = kwargs["score_list"]))
+    frames(front_thread.back_pipe, 20)
+    for i in range(20):
+        front_thread.readPipes__(timeout = 0)
+    writer.close()
+    records = MetadataStore(directory = str(tmp_path)).query(slots = [5], tags = ["person"])
+    assert list(records["mstimestamp"]) == list(range(1000, 1020))
@@ -0,0 +1,76 @@
+"""Tests for the binary message codecs of valkka.live.multiprocess
+"""
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("valkka.core") # valkka.live checks the libValkka version
+pytest.importorskip("PySide2")
+
+from valkka.live.multiprocess import MessageObject, MessageCodec, registerMessage, encodeMessage, decodeMessage
+
+
+codec = registerMessage("test_detections", [
+    ("slot",        "i"),
+    ("mstimestamp", "q"),
+    ("score",       "d"),
+    ("moving",      "?"),
+    ("name",        "str"),
+    ("object_list", "strs"),
+    ("bbox_list",   "tuples"),
+    ("mask",        "array")
+])
+
+
+def message(**kwargs):
+    dic = {
+        "slot"          : 3,
+        "mstimestamp"   : 2**40,
+        "score"         : 0.5,
+        "moving"        : True,
+        "name"          : "kamera ä",
+        "object_list"   : ["person", "car"],
+        "bbox_list"     : [(0.1, 0.2, 0.3, 0.4), (0.5, 0.6, 0.7, 0.8)],
+        "mask"          : numpy.arange(12, dtype = numpy.uint16).reshape(3, 4)
+    }
+    dic.update(kwargs)
+    return MessageObject("test_detections", **dic)
+
+
+def test_roundtrip():
+    obj = message()
+    buf = encodeMessage(obj)
+    assert buf[0] == codec.id
+    decoded = decodeMessage(buf)
+    assert decoded.command == "test_detections"
+    mask = decoded.kwargs.pop("mask")
+    assert (mask.dtype, mask.tolist()) == (numpy.uint16, obj["mask"].tolist())
+    obj.kwargs.pop("mask")
+    assert decoded.kwargs == obj.kwargs
+
+
+def test_empty_fields():
+    decoded = decodeMessage(encodeMessage(message(object_list = [], bbox_list = [])))
+    assert (decoded["object_list"], decoded["bbox_list"]) == ([], [])
+    decoded = decodeMessage(encodeMessage(message(object_list = [""])))
+    assert decoded["object_list"] == [""]
+
+
+def test_pickle_fallback():
+    # other kwargs than in the schema
+    obj = MessageObject("test_detections", slot = 1)
+    assert encodeMessage(obj)[0] == 0
+    assert decodeMessage(encodeMessage(obj)).kwargs == {"slot" : 1}
+    # values that don't fit the schema
+    obj = message(slot = "three", bbox_list = [(1, 2), (3,)])
+    assert encodeMessage(obj)[0] == 0
+    assert decodeMessage(encodeMessage(obj))["slot"] == "three"
+    # unregistered command & the exit message
+    assert decodeMessage(encodeMessage(MessageObject("test_unregistered", a = 1)))["a"] == 1
+    assert decodeMessage(encodeMessage(None)) is None
+
+
+def test_register():
+    assert registerMessage("test_detections", [("slot", "i"), ("mstimestamp", "q"), ("score", "d"), ("moving", "?"),
+        ("name", "str"), ("object_list", "strs"), ("bbox_list", "tuples"), ("mask", "array")]) is codec
+    with pytest.raises(AttributeError):
+        MessageCodec("test_bad", [("x", "complex")])
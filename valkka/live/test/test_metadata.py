@@ -0,0 +1,66 @@
+"""Tests for valkka.live.metadata: writing & querying the store of detections & events
+"""
+import os
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("valkka.core") # valkka.live checks the libValkka version
+pytest.importorskip("valkka.api2")
+
+from valkka.live.metadata import MetadataWriter, MetadataStore, partition_ms
+
+
+def write(directory, frames):
+    """frames: list of (slot, mstimestamp, tags)
+    """
+    writer = MetadataWriter(directory = directory, flush_interval = 0.1)
+    writer.start()
+    for slot, mstimestamp, tags in frames:
+        writer.add(slot, mstimestamp, tags, boxes = [(0.1, 0.2, 0.3, 0.4)] * len(tags), scores = [0.5] * len(tags))
+    writer.close()
+
+
+def test_query(tmp_path):
+    directory = str(tmp_path)
+    t = 10 * partition_ms
+    write(directory, [
+        (1, t, ["person", "car"]),
+        (2, t + 10, ["person"]),
+        (1, t + partition_ms, ["dog"]), # next partition
+        (1, t + 20, []) # nothing
+        ])
+    store = MetadataStore(directory = directory)
+    assert len(store.query()) == 4
+    records = store.query(slots = [1], tags = ["person"])
+    assert (records["mstimestamp"].tolist(), records["slot"].tolist()) == ([t], [1])
+    assert store.getTag(int(records["tag"][0])) == "person"
+    assert numpy.allclose(records["box"][0], (0.1, 0.2, 0.3, 0.4)) and records["score"][0] == 0.5
+    assert store.query(t0 = t + 1, t1 = t + partition_ms)["mstimestamp"].tolist() == [t + 10, t + partition_ms]
+    assert len(store.query(tags = ["cat"])) == 0
+    assert sorted(store.getTags()) == ["car", "dog", "person"]
+
+
+def test_events_and_order(tmp_path):
+    directory = str(tmp_path)
+    t = 10 * partition_ms
+    writer = MetadataWriter(directory = directory, flush_interval = 0.1)
+    writer.start()
+    writer.addEvent(3, t + 5, "stop_move")
+    writer.addEvent(3, t, "start_move")
+    writer.close()
+    write(directory, [(3, t + 2, ["person"])]) # a second writer, going back in time
+    records = MetadataStore(directory = directory).query(slots = [3])
+    assert records["mstimestamp"].tolist() == [t, t + 2, t + 5]
+    assert records["score"].tolist() == [1.0, 0.5, 1.0] # events have no score
+
+
+def test_uncommitted_records_are_dropped(tmp_path):
+    directory = str(tmp_path)
+    t = 10 * partition_ms
+    write(directory, [(1, t, ["person"])])
+    with open(os.path.join(directory, str(t // partition_ms), "slot"), "ab") as f:
+        f.write(b"garbage") # the program died while writing
+    assert len(MetadataStore(directory = directory).query()) == 1
+    write(directory, [(1, t + 1, ["person"])])
+    records = MetadataStore(directory = directory).query()
+    assert (records["slot"].tolist(), records["mstimestamp"].tolist()) == ([1, 1], [t, t + 1])
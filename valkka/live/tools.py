@@ -245,6 +245,19 @@ def getFreeGPU_MB():
     return val
 
 
+def getAvailableMemory_MB():
+    """Memory available for new allocations without swapping (MemAvailable of /proc/meminfo), in MB.  -1 if it can't be read
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024 # kB
+    except (OSError, ValueError):
+        pass
+    return -1
+
+
 def parameterInitCheck(definitions, parameters, obj, undefined_ok=False):
     """ Checks that parameters are consistent with a definition
 
@@ -17,7 +17,10 @@ This plugin is free software: you can redistribute it and/or modify it under the
 """
 
 import sys
+import time
 import logging
+import numpy
+import cv2
 from valkka.api2 import parameterInitCheck
 from valkka.live.tools import getLogger, setLogger
 
@@ -80,6 +83,16 @@ class Analyzer(object):
         raise(AssertionError("virtual method"))
 
 
+    def analyzeBatch(self, imgs, keys = None):
+        """Do the magic for a list of images.  Returns a list of results, one per image
+
+        keys identify the streams the images come from.  Not used here, see CachedAnalyzer
+
+        By default, calls the analyzer for each image.  Overwrite in child classes that can analyze several images in one go
+        """
+        return [self(img) for img in imgs]
+
+
     def report(self, *args):
         if (self.verbose):
             print(self.pre, *args)
@@ -90,5 +103,115 @@ class Analyzer(object):
         """Release any resources acquired by the analyzer
         """
         pass
-        
-        
+
+
+
+def checkAttribute_analyzer(analyzer):
+    """For parameter_defs of wrapping analyzers: any Analyzer subclass is ok (a class in parameter_defs must match exactly)
+    """
+    return isinstance(analyzer, Analyzer)
+
+
+
+class CachedAnalyzer(Analyzer):
+    """Wraps an analyzer & skips the analysis of frames that have not changed
+
+    For each stream, a signature of the last analyzed frame is kept: a downscaled image where each cell is the mean of the pixels it covers.  A cell has changed if any of its channels differs more than pixel_threshold from the stored signature.  If the fraction of changed cells is at most threshold, the results of the last analyzed frame are returned instead of calling the wrapped analyzer.
+
+    Unlike a mean difference over the whole frame, this catches small objects: a change covering a single cell is enough with threshold = 0.
+
+    Streams are identified by the keys given to __call__ / analyzeBatch.  Without keys, all frames are treated as a single stream
+    """
+
+    parameter_defs = {
+        "analyzer"  : checkAttribute_analyzer, # :param analyzer:  The analyzer to be wrapped
+        "threshold" : (float, 0.0),     # :param threshold: Frames where at most this fraction of cells changed since the last analyzed frame are not analyzed
+        "pixel_threshold" : (int, 12),  # :param pixel_threshold: A cell has changed if its mean value changed more than this (0-255).  Keep above sensor noise
+        "max_age"   : (float, 60.0),    # :param max_age:   Analyze a frame at least this often (secs), even if nothing changes
+        "samples"   : (int, 64),        # :param samples:   Number of cells in the signature along the longer image dimension
+        "max_keys"  : (int, 64),        # :param max_keys:  Max number of streams to remember
+        "verbose"   : (bool, False),
+        "debug"     : (bool, False)
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.pre = self.__class__.__name__ + "(" + self.analyzer.__class__.__name__ + ")"
+        self.reset()
+
+
+    def init(self):
+        self.analyzer.init()
+        self.reset()
+
+
+    def reset(self):
+        self.cache = {} # key => (signature, results, time)
+        self.hits = 0 # number of frames that were not analyzed
+        self.misses = 0 # number of frames that were analyzed
+
+
+    def signature__(self, img):
+        step = max(1, max(img.shape[0], img.shape[1]) // self.samples)
+        size = (max(1, img.shape[1] // step), max(1, img.shape[0] // step))
+        return cv2.resize(img, size, interpolation = cv2.INTER_AREA).astype(numpy.int16)
+
+
+    def unchanged__(self, entry, signature, t):
+        if entry is None:
+            return False
+        old, results, t0 = entry
+        if (old.shape != signature.shape) or ((t - t0) >= self.max_age):
+            return False
+        changed = (numpy.abs(signature - old) > self.pixel_threshold)
+        if changed.ndim > 2: # a cell has changed if any of its channels has
+            changed = changed.any(axis = 2)
+        return changed.mean() <= self.threshold
+
+
+    def store__(self, key, signature, results, t):
+        self.cache.pop(key, None)
+        if len(self.cache) >= self.max_keys: # forget the stream that has been cached for the longest time
+            self.cache.pop(next(iter(self.cache)))
+        self.cache[key] = (signature, results, t)
+
+
+    def __call__(self, img, key = None):
+        return self.analyzeBatch([img], keys = [key])[0]
+
+
+    def analyzeBatch(self, imgs, keys = None):
+        """Analyze the images that have changed with the wrapped analyzer.  For the rest, return the cached results
+        """
+        if keys is None:
+            keys = [None for img in imgs]
+        t = time.time()
+        results = [None for img in imgs]
+        changed = [] # tuples (index, signature)
+        for i, (img, key) in enumerate(zip(imgs, keys)):
+            signature = self.signature__(img)
+            entry = self.cache.get(key, None)
+            if self.unchanged__(entry, signature, t):
+                results[i] = entry[1]
+            else:
+                changed.append((i, signature))
+
+        self.hits += len(imgs) - len(changed)
+        self.misses += len(changed)
+        self.logger.debug("analyzeBatch: %s of %s frames changed", len(changed), len(imgs))
+        if len(changed) < 1:
+            return results
+
+        analyzed = self.analyzer.analyzeBatch(
+            [imgs[i] for i, signature in changed],
+            keys = [keys[i] for i, signature in changed]) # i.e. MotionCropAnalyzer keeps state per stream
+        for (i, signature), result in zip(changed, analyzed):
+            results[i] = result
+            self.store__(keys[i], signature, result, t)
+        return results
+
+
+    def close(self):
+        self.analyzer.close()
+        self.cache = {}
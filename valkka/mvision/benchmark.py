@@ -0,0 +1,212 @@
+"""
+benchmark.py : Measure analyzer throughput without the GUI
+
+Copyright 2018 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the machine vision plugin for the Valkka Live program
+
+This plugin is free software: you can redistribute it and/or modify it under the terms of the MIT License.  This code is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the MIT License for more details.
+
+@file    benchmark.py
+@author  Sampsa Riikonen
+@date    2018
+@version 0.12.1
+@brief   Measure analyzer throughput without the GUI
+"""
+
+import sys
+import time
+import json
+import resource
+import argparse
+import importlib
+import contextlib
+import numpy
+
+
+def loadAnalyzerClass(path):
+    """"valkka.mvision.movement.base.MovementDetector" => the class
+    """
+    module_name, class_name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def syntheticFrames(source, width = None, height = None, n = 25):
+    """A list of n frames: "static" (a gradient), "noise" (random pixels) or "moving" (a square moving on the gradient).  Default size is 1920/4 x 1080/4
+    """
+    width = width or 1920 // 4
+    height = height or 1080 // 4
+    background = numpy.empty((height, width, 3), dtype = numpy.uint8)
+    background[:, :, 0] = numpy.linspace(0, 255, width, dtype = numpy.uint8)[None, :]
+    background[:, :, 1] = numpy.linspace(0, 255, height, dtype = numpy.uint8)[:, None]
+    background[:, :, 2] = 128
+    if source == "static":
+        return [background]
+    if source == "noise":
+        return [numpy.random.randint(0, 256, (height, width, 3), dtype = numpy.uint8) for i in range(n)]
+    if source == "moving":
+        frames = []
+        size = max(1, min(width, height) // 6)
+        for i in range(n):
+            img = background.copy()
+            x = (i * (width - size)) // max(1, n - 1)
+            y = (height - size) // 2
+            img[y:y + size, x:x + size, :] = 255
+            frames.append(img)
+        return frames
+    raise(AttributeError("Unknown frame source " + str(source)))
+
+
+def recordedFrames(fname, width = None, height = None, n = 250):
+    """Up to n frames from a .npy file or a video file
+    """
+    if fname.endswith(".npy"):
+        frames = numpy.load(fname, mmap_mode = "r")
+        if frames.ndim == 3:
+            frames = frames[None]
+        return [numpy.ascontiguousarray(frame, dtype = numpy.uint8) for frame in frames[0:n]]
+    import cv2
+    cap = cv2.VideoCapture(fname)
+    frames = []
+    while len(frames) < n:
+        ok, img = cap.read()
+        if not ok:
+            break
+        if width and height:
+            img = cv2.resize(img, (width, height))
+        frames.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    cap.release()
+    if len(frames) < 1:
+        raise(AttributeError("Could not read frames from " + fname))
+    return frames
+
+
+def peakRSS(who):
+    """Peak resident memory in MB (Linux reports ru_maxrss in kB)
+    """
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def benchmark(analyzer, frames, n_frames = 500, warmup = 10, batch = 1):
+    """Feed n_frames frames (cycling through frames) to the analyzer, batch frames per call.  Returns a dict of results
+    """
+    def feed(i):
+        if batch > 1:
+            imgs = [frames[(i + j) % len(frames)] for j in range(batch)]
+            analyzer.analyzeBatch(imgs)
+        else:
+            analyzer(frames[i % len(frames)])
+
+    for i in range(0, warmup * batch, batch):
+        feed(i)
+
+    n_calls = max(1, n_frames // batch)
+    latencies = numpy.empty(n_calls)
+    t0 = time.perf_counter()
+    for i in range(n_calls):
+        t = time.perf_counter()
+        feed(i * batch)
+        latencies[i] = time.perf_counter() - t
+    total = time.perf_counter() - t0
+
+    latencies *= 1000
+    return {
+        "frames"        : n_calls * batch,
+        "seconds"       : total,
+        "fps"           : n_calls * batch / total,
+        "latency_ms"    : {
+            "mean"  : float(latencies.mean()),
+            "p50"   : float(numpy.percentile(latencies, 50)),
+            "p95"   : float(numpy.percentile(latencies, 95)),
+            "p99"   : float(numpy.percentile(latencies, 99)),
+            "max"   : float(latencies.max())
+        }
+    }
+
+
+usage = """Feeds an Analyzer subclass with synthetic or recorded frames & reports fps, latency percentiles and peak memory as JSON, e.g.
+
+    valkka-mvision-benchmark --analyzer valkka.mvision.movement.base.MovementDetector --width 480 --height 270 --frames 1000
+    valkka-mvision-benchmark --analyzer valkka.mvision.movement.base.BackgroundMovementDetector --source moving
+    valkka-mvision-benchmark --analyzer valkka.mvision.nix.base.ExternalWorkerPool \\
+        --parameters '{"executable": "python3 example_process1.py", "image_dimensions": [480, 270], "tmpfile": "/dev/shm/bench"}'
+    valkka-mvision-benchmark --analyzer valkka.mvision.movement.base.MovementDetector --input frames.npy
+
+Recorded frames are read from a .npy file (a single frame or an array of frames) or, if OpenCV is available, from a video file
+"""
+
+
+def process_cl_args():
+    parser = argparse.ArgumentParser("valkka-mvision-benchmark",
+        description = usage, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--analyzer", action="store", type=str, required=True,
+        help="analyzer class, e.g. valkka.mvision.movement.base.MovementDetector")
+    parser.add_argument("--parameters", action="store", type=str, default="{}",
+        help="analyzer constructor parameters as json")
+    parser.add_argument("--source", action="store", type=str, default="moving",
+        help="synthetic frames: static, noise or moving")
+    parser.add_argument("--input", action="store", type=str, default=None,
+        help="recorded frames: a .npy file or a video file.  Overrides --source")
+    parser.add_argument("--width", action="store", type=int, default=None,
+        help="frame width.  Default: native size of recorded frames, 1920/4 for synthetic frames")
+    parser.add_argument("--height", action="store", type=int, default=None,
+        help="frame height.  Default: native size of recorded frames, 1080/4 for synthetic frames")
+    parser.add_argument("--frames", action="store", type=int, default=500,
+        help="number of frames to analyze")
+    parser.add_argument("--warmup", action="store", type=int, default=10,
+        help="number of calls before measuring")
+    parser.add_argument("--batch", action="store", type=int, default=1,
+        help="frames per call: >1 uses analyzeBatch")
+    parser.add_argument("--camera-fps", action="store", type=float, default=None,
+        help="if given, report how many cameras at this fps the analyzer keeps up with")
+    parser.add_argument("--output", action="store", type=str, default=None,
+        help="write the json here instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = process_cl_args()
+    parameters = json.loads(args.parameters)
+    if "image_dimensions" in parameters:
+        parameters["image_dimensions"] = tuple(parameters["image_dimensions"])
+
+    if args.input:
+        frames = recordedFrames(args.input, args.width, args.height)
+        source = args.input
+    else:
+        frames = syntheticFrames(args.source, args.width, args.height)
+        source = args.source
+
+    # valkka.mvision & the analyzers print to stdout: keep it clean for the json
+    with contextlib.redirect_stdout(sys.stderr):
+        analyzer = loadAnalyzerClass(args.analyzer)(**parameters)
+        results = benchmark(analyzer, frames, n_frames = args.frames, warmup = args.warmup, batch = args.batch)
+        analyzer.close() # external processes are reaped here, so that their memory is counted
+
+    report = {
+        "analyzer"      : args.analyzer,
+        "parameters"    : parameters,
+        "source"        : source,
+        "shape"         : list(frames[0].shape),
+        "batch"         : args.batch
+    }
+    report.update(results)
+    report["peak_rss_mb"] = {
+        "self"      : peakRSS(resource.RUSAGE_SELF),
+        "children"  : peakRSS(resource.RUSAGE_CHILDREN)
+    }
+    if args.camera_fps:
+        report["cameras"] = report["fps"] / args.camera_fps
+
+    st = json.dumps(report, indent = 2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(st + "\n")
+    else:
+        print(st)
+
+
+if (__name__ == "__main__"):
+    main()
@@ -19,3 +19,4 @@ This plugin is free software: you can redistribute it and/or modify it under the
 pre = "mvision.constant : "
 
 tmpdir="/tmp" 
+shmdir="/dev/shm" # shared memory files for external analyzers, see valkka.mvision.nix.base.FrameRing
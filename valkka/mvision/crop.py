@@ -0,0 +1,243 @@
+"""
+crop.py : Feed an analyzer with crops of the moving parts of frames
+
+Copyright 2018 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the machine vision plugin for the Valkka Live program
+
+This plugin is free software: you can redistribute it and/or modify it under the terms of the MIT License.  This code is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the MIT License for more details.
+
+@file    crop.py
+@author  Sampsa Riikonen
+@date    2018
+@version 0.12.1
+@brief   Feed an analyzer with crops of the moving parts of frames
+"""
+
+import sys
+import time
+import numpy
+import cv2
+
+from valkka.api2 import parameterInitCheck
+from valkka.mvision.base import Analyzer, checkAttribute_analyzer
+
+
+class MotionCropAnalyzer(Analyzer):
+    """Wraps an object detector & analyzes only the moving regions of the frames
+
+    Moving regions are found by differencing a subsampled frame against the one of the last full-frame analysis (not against the previous frame), so slow motion accumulates until it is detected & objects that have moved stay in the crops until the next full-frame analysis.  The regions are cropped from the full-resolution frame & all crops (of all frames in a batch) are given to the wrapped analyzer in one analyzeBatch call, i.e. in a single mosaic for the YOLO analyzers.  Boxes are mapped back to full-frame coordinates.
+
+    Detections of the last full-frame analysis that are outside the moving regions are kept, so static objects don't disappear.  The full frame is analyzed when there is no previous frame, when the moving regions cover more than max_area of the frame and at least every full_interval seconds.
+
+    The wrapped analyzer must return lists of (tag, score, x0, x1, y0, y1), in pixels and y measured from the bottom of the image, like the YOLO analyzers do.  Streams are identified by keys, as in CachedAnalyzer
+    """
+
+    parameter_defs = {
+        "analyzer"          : checkAttribute_analyzer, # :param analyzer:   The object detector to be wrapped
+        "samples"           : (int, 96),        # :param samples:           Motion is detected on a subsampled frame having this many samples along the longer dimension
+        "pixel_threshold"   : (int, 25),        # :param pixel_threshold:   A sample has moved if its intensity (0-255) changed more than this
+        "margin"            : (float, 0.05),    # :param margin:            Crops are grown by this fraction of the frame size on each side
+        "min_size"          : (float, 0.2),     # :param min_size:          Min width & height of a crop as a fraction of the frame size
+        "max_regions"       : (int, 4),         # :param max_regions:       Max number of crops per frame.  The largest regions are used
+        "max_area"          : (float, 0.5),     # :param max_area:          If crops cover more than this fraction of the frame, analyze the full frame
+        "full_interval"     : (float, 5.0),     # :param full_interval:     Analyze the full frame at least this often (secs)
+        "max_keys"          : (int, 64),        # :param max_keys:          Max number of streams to remember
+        "verbose"           : (bool, False),
+        "debug"             : (bool, False)
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.pre = self.__class__.__name__ + "(" + self.analyzer.__class__.__name__ + ")"
+        self.kernel = numpy.ones((3, 3), dtype = numpy.uint8)
+        self.reset()
+
+
+    def init(self):
+        self.analyzer.init()
+        self.reset()
+
+
+    def reset(self):
+        self.streams = {} # key => dict(signature, full, t_full)
+        self.n_full = 0 # number of full frames analyzed
+        self.n_crops = 0 # number of crops analyzed
+
+
+    def signature__(self, img):
+        """Subsampled grayscale frame.  Returns (signature, step)
+        """
+        step = max(1, max(img.shape[0], img.shape[1]) // self.samples)
+        return numpy.asarray(img[::step, ::step], dtype = numpy.int16).sum(axis = 2) // img.shape[2], step
+
+
+    def regions__(self, old, signature, step, shape):
+        """Moving regions as (r0, r1, c0, c1) in full-frame pixels (rows from the top)
+        """
+        moved = (numpy.abs(signature - old) > self.pixel_threshold).astype(numpy.uint8)
+        if not moved.any():
+            return []
+        moved = cv2.dilate(moved, self.kernel)
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(moved)
+        stats = stats[1:] # the first one is the background
+        stats = stats[numpy.argsort(stats[:, cv2.CC_STAT_AREA])[::-1]][0:self.max_regions]
+        height, width = shape[0], shape[1]
+        min_h = int(self.min_size * height)
+        min_w = int(self.min_size * width)
+        regions = []
+        for x, y, w, h, area in stats:
+            r0, r1 = self.grow__(y * step, (y + h) * step, int(self.margin * height), min_h, height)
+            c0, c1 = self.grow__(x * step, (x + w) * step, int(self.margin * width), min_w, width)
+            regions.append((r0, r1, c0, c1))
+        return self.merge__(regions)
+
+
+    def grow__(self, a, b, margin, min_size, size):
+        """Grow interval [a, b) by margin & to min_size.  Keep it within [0, size)
+        """
+        a = a - margin
+        b = b + margin
+        if (b - a) < min_size:
+            c = (a + b) // 2
+            a = c - min_size // 2
+            b = a + min_size
+        if a < 0:
+            b -= a
+            a = 0
+        if b > size:
+            a -= (b - size)
+            b = size
+        return max(0, a), b
+
+
+    def merge__(self, regions):
+        """Merge overlapping regions, so that objects are not detected twice
+        """
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a = regions[i]
+                    b = regions[j]
+                    if (a[0] < b[1]) and (b[0] < a[1]) and (a[2] < b[3]) and (b[2] < a[3]):
+                        regions[i] = (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+                        regions.pop(j)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+
+    def __call__(self, img, key = None):
+        return self.analyzeBatch([img], keys = [key])[0]
+
+
+    def analyzeBatch(self, imgs, keys = None):
+        """Analyze full frames or crops of the moving regions.  All of them are given to the wrapped analyzer in one go
+        """
+        if keys is None:
+            keys = [None for img in imgs]
+        t = time.time()
+        inputs = [] # images for the wrapped analyzer
+        plans = [] # per frame: None = full frame, otherwise a list of regions
+        for img, key in zip(imgs, keys):
+            signature, step = self.signature__(img)
+            stream = self.streams.get(key, None)
+            regions = None
+            if (stream is not None) and (stream["signature"].shape == signature.shape) and ((t - stream["t_full"]) < self.full_interval):
+                regions = self.regions__(stream["signature"], signature, step, img.shape)
+                area = sum((r1 - r0) * (c1 - c0) for r0, r1, c0, c1 in regions)
+                if area > (self.max_area * img.shape[0] * img.shape[1]):
+                    regions = None
+            if regions is None:
+                inputs.append(img)
+                self.n_full += 1
+                self.store__(key, signature, stream) # new reference for the moving regions
+            else:
+                for r0, r1, c0, c1 in regions:
+                    inputs.append(numpy.ascontiguousarray(img[r0:r1, c0:c1]))
+                self.n_crops += len(regions)
+            plans.append(regions)
+
+        self.logger.debug("analyzeBatch: %s frames => %s inputs", len(imgs), len(inputs))
+        if len(inputs) > 0:
+            outputs = iter(self.analyzer.analyzeBatch(inputs))
+        else:
+            outputs = iter([])
+
+        results = []
+        for img, key, regions in zip(imgs, keys, plans):
+            stream = self.streams[key]
+            if regions is None:
+                lis = next(outputs)
+                stream["full"] = lis
+                stream["t_full"] = t
+                results.append(lis)
+                continue
+            height = img.shape[0]
+            lis = []
+            for r0, r1, c0, c1 in regions:
+                dy = height - r1 # y is measured from the bottom
+                for l in next(outputs):
+                    lis.append((l[0], l[1], l[2] + c0, l[3] + c0, l[4] + dy, l[5] + dy))
+            # static objects from the last full-frame analysis
+            for l in stream["full"]:
+                xc = (l[2] + l[3]) / 2
+                yc = height - (l[4] + l[5]) / 2 # from the top
+                if not any((r0 <= yc < r1) and (c0 <= xc < c1) for r0, r1, c0, c1 in regions):
+                    lis.append(l)
+            results.append(lis)
+        return results
+
+
+    def store__(self, key, signature, stream):
+        if stream is None:
+            if len(self.streams) >= self.max_keys: # forget the oldest stream
+                self.streams.pop(next(iter(self.streams)))
+            stream = {"full" : [], "t_full" : 0}
+            self.streams[key] = stream
+        stream["signature"] = signature
+
+
+    def close(self):
+        self.analyzer.close()
+        self.streams = {}
+
+
+
+def test1():
+    """Crop a moving square with a dummy analyzer
+    """
+    class DummyAnalyzer(Analyzer):
+
+        def __call__(self, img):
+            print("DummyAnalyzer: input", img.shape)
+            return [("thing", 99, 0, img.shape[1], 0, img.shape[0])]
+
+    analyzer = MotionCropAnalyzer(analyzer = DummyAnalyzer(), verbose = True)
+    img = numpy.zeros((1080 // 4, 1920 // 4, 3), dtype = numpy.uint8)
+    print("result =", analyzer(img), "\n")
+    img = img.copy()
+    img[100:120, 200:240, :] = 255
+    print("result =", analyzer(img), "\n")
+    print("result =", analyzer(img), "\n")
+
+
+def main():
+    pre = "main :"
+    print(pre, "main: arguments: ", sys.argv)
+    if (len(sys.argv) < 2):
+        print(pre, "main: needs test number")
+    else:
+        st = "test" + str(sys.argv[1]) + "()"
+        exec(st)
+
+
+if (__name__ == "__main__"):
+    main()
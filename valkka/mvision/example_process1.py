@@ -2,6 +2,8 @@
 
 import sys
 import time
+import mmap
+import struct
 import numpy
 
 class StdProcess:
@@ -32,8 +34,16 @@ class StdProcess:
     - All debugging, etc. information is printed to stderr
     - When STDIN receives the string "X\n" the process exits
     
+    If a fourth argument "shm" is given, tmpfilename is a shared memory file with a ring of frames & the processes exchange length-prefixed binary messages instead of text lines (see cycleShm).  There's no pickling or disk access per frame
+
     Create your own class based on this class (see an example below)
     """
+
+    # binary protocol: see valkka.mvision.nix.base.FrameRing
+    message_header = struct.Struct("<cI")
+    ring_header = struct.Struct("<4sI4sIIIIQ")
+    ring_header_size = 64
+    slot_header = struct.Struct("<QII")
     
     def __init__(self, width, height, filename, verbose = False):
         self.pre = self.__class__.__name__+" : "
@@ -78,6 +88,63 @@ class StdProcess:
         """
         sys.stdout.write("C\n"); sys.stdout.flush()
         
+    def readMessage(self):
+        header = sys.stdin.buffer.read(self.message_header.size)
+        if (len(header) < self.message_header.size):
+            return None, b""
+        kind, length = self.message_header.unpack(header)
+        return kind, sys.stdin.buffer.read(length)
+
+    def writeMessage(self, kind, payload = b""):
+        sys.stdout.buffer.write(self.message_header.pack(kind, len(payload)) + payload)
+        sys.stdout.buffer.flush()
+
+    def openRing(self):
+        """Map the shared memory file of frames
+        """
+        with open(self.filename, "r+b") as f:
+            self.mm = mmap.mmap(f.fileno(), 0)
+        magic, version, dtype, n_slots, height, width, channels, slot_size = self.ring_header.unpack_from(self.mm, 0)
+        if (magic != b"VKFR"):
+            raise AssertionError("not a frame ring: " + self.filename)
+        self.dtype = numpy.dtype(dtype.rstrip(b"\x00").decode("ascii"))
+        self.channels = channels
+        self.slot_size = slot_size
+
+    def readFrame(self, slot):
+        """Frame in a slot of the ring.  Returns a numpy array that uses the shared memory: it is valid only until the next message
+        """
+        offset = self.ring_header_size + slot * self.slot_size
+        seq, height, width = self.slot_header.unpack_from(self.mm, offset)
+        return numpy.frombuffer(
+            self.mm, dtype = self.dtype, count = height * width * self.channels,
+            offset = offset + self.slot_header.size).reshape((height, width, self.channels))
+
+    def cycleShm(self):
+        """Like cycle, but with the binary protocol: frames are read from the shared memory ring
+        """
+        self.openRing()
+        while True:
+            kind, payload = self.readMessage()
+            if (kind is None): # stdin closed
+                self.report("fatal error")
+                self.close()
+                break
+            elif (kind == b"T"): #  RESET STATE
+                self.reset()
+                self.writeMessage(b"C")
+            elif (kind == b"X"): #  EXIT
+                self.close()
+                break
+            elif (kind == b"R"): #  READ NEW FRAME
+                seq, slot = struct.unpack("<QI", payload)
+                result = self.run(self.readFrame(slot))
+                if (result):
+                    self.writeMessage(b"D", result.encode("utf-8"))
+                else:
+                    self.writeMessage(b"C")
+        self.mm.close()
+
     def cycle(self):
         ok = True
         while ok:
@@ -140,7 +207,7 @@ class TestStdProcess(StdProcess):
 
 
 if (__name__ == "__main__"):
-    # arguments needed: width, height, tmpfilename
+    # arguments needed: width, height, tmpfilename & optionally "shm"
     try:
         width       = int(sys.argv[1])
         height      = int(sys.argv[2])
@@ -150,7 +217,10 @@ if (__name__ == "__main__"):
         raise SystemExit()
 
     p = TestStdProcess(width, height, filename, verbose = False)
-    p.cycle()
+    if (len(sys.argv) > 4 and sys.argv[4] == "shm"):
+        p.cycleShm()
+    else:
+        p.cycle()
 
-    print("example_process1.py : bye!")
+    sys.stderr.write("example_process1.py : bye!\n") # stdout carries the protocol
 
@@ -1,5 +1,166 @@
+"""
+ipc.py : Eventfds, pipes and events for client / master process intercommunication
+
+Copyright 2018 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the machine vision plugin for the Valkka Live program
+
+This plugin is free software: you can redistribute it and/or modify it under the terms of the MIT License.  This code is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the MIT License for more details.
+
+@file    ipc.py
+@author  Sampsa Riikonen
+@date    2018
+@version 0.12.1
+@brief   Eventfds, pipes and events for client / master process intercommunication
+"""
+
+import time
+import mmap
+import weakref
+import numpy
 from valkka import core
 from multiprocessing import Pipe, Event
+from valkka.live.tools import getLogger
+
+
+class ResultRing:
+    """Detection results in shared memory
+
+    A ring buffer of n_slots entries, each one having a header and max_objects fixed-size records:
+
+    ::
+
+        header  : seq (uint64), mstimestamp (int64), n (int32), flags (int32)
+        records : class_id (int32), score (float32), box (4 x float32: x0, x1, y0, y1)
+
+    Class ids refer to a label table that is also in the shared memory.
+
+    There is a single writer (the master process) and any number of readers.  The memory is an anonymous shared mmap, so the ring must be created before forking the processes that use it.
+
+    The writer zeroes the sequence number of an entry before writing it & sets the number after writing, so a reader can detect an entry that was overwritten while it was being read
+    """
+
+    flag_none = 1 # the frame was not analyzed (no analyzer, dropped frame, etc.)
+    flag_dropped = 2 # the frame was dropped by the master process scheduler: there are no new results
+
+    record_dtype = numpy.dtype([
+        ("class_id",    "<i4"),
+        ("score",       "<f4"),
+        ("box",         "<f4", (4,))
+        ])
+
+    def __init__(self, n_slots = 4, max_objects = 100, max_labels = 256, label_size = 32):
+        self.n_slots = n_slots
+        self.max_objects = max_objects
+        self.max_labels = max_labels
+        self.entry_dtype = numpy.dtype([
+            ("seq",         "<u8"),
+            ("mstimestamp", "<i8"),
+            ("n",           "<i4"),
+            ("flags",       "<i4"),
+            ("records",     self.record_dtype, (max_objects,))
+            ])
+        label_dtype = numpy.dtype("S%i" % label_size)
+        # layout: latest seq, number of labels, entries, labels
+        offset_entries = 16
+        offset_labels = offset_entries + n_slots * self.entry_dtype.itemsize
+        size = offset_labels + max_labels * label_dtype.itemsize
+        self.mem = mmap.mmap(-1, size) # anonymous & shared
+        self.latest = numpy.frombuffer(self.mem, dtype = "<u8", count = 1, offset = 0)
+        self.n_labels = numpy.frombuffer(self.mem, dtype = "<u8", count = 1, offset = 8)
+        self.entries = numpy.frombuffer(self.mem, dtype = self.entry_dtype, count = n_slots, offset = offset_entries)
+        self.labels = numpy.frombuffer(self.mem, dtype = label_dtype, count = max_labels, offset = offset_labels)
+        self.label_ids = {} # writer's cache: label => class_id
+
+    def getSeq(self):
+        """Sequence number of the most recent entry
+        """
+        return int(self.latest[0])
+
+    def labelId(self, label):
+        """Class id of a label.  New labels are appended to the label table (writer only)
+        """
+        try:
+            return self.label_ids[label]
+        except KeyError:
+            pass
+        n = int(self.n_labels[0])
+        st = label.encode("utf-8")
+        # the table might have been filled by another writer earlier
+        ids = numpy.nonzero(self.labels[0:n] == st)[0]
+        if len(ids) > 0:
+            i = int(ids[0])
+        elif n < self.max_labels:
+            i = n
+            self.labels[i] = st
+            self.n_labels[0] = n + 1
+        else:
+            i = -1
+        self.label_ids[label] = i
+        return i
+
+    def label(self, class_id):
+        if class_id < 0:
+            return "?"
+        return self.labels[class_id].decode("utf-8")
+
+    def write(self, tags, scores, boxes, mstimestamp = 0, flags = 0):
+        """Write a new entry.  Returns its sequence number
+
+        :param tags:    list of label strings
+        :param scores:  list of scores
+        :param boxes:   list of boxes (x0, x1, y0, y1) in fractional coordinates
+        """
+        seq = int(self.latest[0]) + 1
+        i = seq % self.n_slots
+        n = min(len(tags), self.max_objects)
+        self.entries["seq"][i] = 0 # being written
+        records = self.entries["records"][i]
+        if n > 0:
+            records["class_id"][0:n] = [self.labelId(tag) for tag in tags[0:n]]
+            records["score"][0:n] = scores[0:n]
+            records["box"][0:n] = boxes[0:n]
+        self.entries["n"][i] = n
+        self.entries["mstimestamp"][i] = mstimestamp
+        self.entries["flags"][i] = flags
+        self.entries["seq"][i] = seq
+        self.latest[0] = seq
+        return seq
+
+    def readEntry__(self, seq):
+        """Returns (mstimestamp, flags, records) of entry seq or None if it has been overwritten
+        """
+        i = seq % self.n_slots
+        if int(self.entries["seq"][i]) != seq:
+            return None
+        n = int(self.entries["n"][i])
+        mstimestamp = int(self.entries["mstimestamp"][i])
+        flags = int(self.entries["flags"][i])
+        records = self.entries["records"][i][0:n].copy()
+        if int(self.entries["seq"][i]) != seq:
+            return None
+        return mstimestamp, flags, records
+
+    def read(self, last_seq = 0, skip_flags = 0):
+        """Read the most recent entry newer than last_seq, skipping entries that have any of skip_flags set
+
+        Returns a tuple (seq, mstimestamp, flags, records) or None.  Seq is that of the most recent entry, even if an older entry was returned.  If all new entries were skipped, the returned entry has some of skip_flags set.  Records is a copy of the structured array
+        """
+        for retry in range(3): # retry if the writer overwrote an entry while reading it
+            latest = int(self.latest[0])
+            if latest <= last_seq:
+                return None
+            first = max(last_seq + 1, latest - self.n_slots + 1)
+            for seq in range(latest, first - 1, -1):
+                entry = self.readEntry__(seq)
+                if entry is None:
+                    break
+                if ((entry[1] & skip_flags) == 0) or (seq == first):
+                    return (latest,) + entry
+        return None
+
 
 class IPCElement:
 
@@ -8,18 +169,66 @@ class IPCElement:
         self.pipe1, self.pipe2 = Pipe()
         self.event = Event()
         self.event.clear()
+        # results: master => client.  Pipes carry only control messages
+        self.result_fd = core.EventFd()
+        self.results = ResultRing()
+
+
+class Reservation:
+
+    def __init__(self, owner = None):
+        self.name = str(owner)
+        if owner is None:
+            self.owner = None
+        else:
+            self.owner = weakref.ref(owner)
+        self.time = time.time()
 
 
 class IPC:
+    """A growable registry of IPCElements
+
+    Elements are allocated on demand, not at import time.  However, they are shared between processes by forking, so an element must be allocated before the processes using it are forked.  Each client process allocates 1 + max_migrations elements in its constructor (see QShmemClientProcess), so the pool is sized by the number of configured client processes.
+
+    A released element is quarantined until the master process confirms that it has stopped using the element (see release & confirm).
+
+    Once the master processes have been forked, the pool is sealed (see seal): new elements would not be visible to them, so the pool can't grow anymore.  If the pool runs out, reserve first reclaims leaked reservations.  If that doesn't help, it grows the pool if it's not sealed & raises IndexError if it is.
+
+    So there is a cap: after sealing, the pool has (1 + max_migrations) elements per client process.  Each migration to another master process keeps an element quarantined until the old master process confirms, so at most max_migrations migrations per client can be in flight.  PlacementEngine.migrate checks available & refuses to migrate instead of failing at reserve
+    """
 
-    num = 10
+    chunk = 1 # how many new elements to allocate when the pool runs out
 
     def __init__(self):
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
         self.lis = []
-        self.indices = []
-        for i in range(self.num):
+        self.indices = [] # free elements
+        self.reserved = {} # reserved elements: index => Reservation
+        self.quarantine = {} # released elements still in use by a master process: index => Reservation
+        self.peak = 0 # max number of simultaneous reservations
+        self.sealed = False # processes using the elements have been forked: no more elements can be added
+
+    def seal(self):
+        """Call before forking a process that uses the elements (i.e. a master process).  After this, the pool has a fixed size
+        """
+        if not self.sealed:
+            self.logger.debug("seal: pool sealed with %s elements", len(self.lis))
+        self.sealed = True
+
+    def allocate(self, n = 1):
+        """Add n elements to the pool.  Refused if the pool has been sealed
+        """
+        if self.sealed:
+            self.logger.warning("allocate: pool is sealed: not allocating %s element(s) invisible to the running processes", n)
+            return
+        for i in range(n):
+            self.indices.append(len(self.lis))
             self.lis.append(IPCElement())
-            self.indices.append(i)
+
+    def available(self):
+        """Would reserve succeed now?
+        """
+        return (len(self.indices) > 0) or (not self.sealed) or (len(self.leaked()) > 0)
 
     def get1(self, i):
         el = self.lis[i]
@@ -28,17 +237,98 @@ class IPC:
     def get2(self, i):
         el = self.lis[i]
         return el.event_fd, el.pipe2
-    
-    def reserve(self):
-        return self.indices.pop(0)
 
-    def release(self, i):
+    def getResults(self, i):
+        el = self.lis[i]
+        return el.result_fd, el.results
+
+    def reserve(self, owner = None):
+        """Reserve an element.  Owner is the (client) process using the element
+
+        Raises IndexError if there are no free elements & the pool is sealed
+        """
+        if len(self.indices) < 1:
+            self.reclaim()
+        if len(self.indices) < 1:
+            if self.sealed:
+                self.logger.error("reserve: pool exhausted: all %s elements are reserved", len(self.lis))
+                raise(IndexError("IPC pool exhausted"))
+            self.logger.warning("reserve: pool exhausted: allocating %s new element(s)", self.chunk)
+            self.allocate(self.chunk)
+        i = self.indices.pop(0)
+        self.clear(i) # might have been left set by a registration that was given up
+        self.reserved[i] = Reservation(owner)
+        self.peak = max(self.peak, len(self.reserved))
+        self.logger.debug("reserve: %s for %s", i, self.reserved[i].name)
+        return i
+
+    def release(self, i, quarantine = True):
+        """Release a reserved element
+
+        With quarantine, the element is not reused before confirm has been called for it.  Use that when a master process still has to unregister the element
+        """
+        if i not in self.reserved:
+            self.logger.warning("release: element %s is not reserved", i)
+            return
+        reservation = self.reserved.pop(i)
+        if quarantine:
+            self.quarantine[i] = reservation
+        else:
+            self.indices.append(i)
+
+    def confirm(self, i):
+        """A master process has stopped using a quarantined element: it can be reserved again
+        """
+        if self.quarantine.pop(i, None) is None:
+            self.logger.debug("confirm: element %s is not quarantined", i)
+            return
         self.indices.append(i)
-    
+
+    def leaked(self):
+        """Returns indices of leaked reservations
+
+        A reservation has leaked if its owner has been garbage collected, has exited or holds another element
+        """
+        lis = []
+        for i, reservation in self.reserved.items():
+            if reservation.owner is None: # no owner to check against
+                continue
+            owner = reservation.owner()
+            if (owner is None) or\
+                (getattr(owner, "exitcode", None) is not None) or\
+                (getattr(owner, "ipc_index", i) != i):
+                lis.append(i)
+        return lis
+
+    def reclaim(self):
+        """Release leaked reservations.  Returns the number of released elements
+        """
+        lis = self.leaked()
+        for i in lis:
+            self.logger.warning("reclaim: releasing element %s leaked by %s", i, self.reserved[i].name)
+            self.release(i, quarantine = False)
+        return len(lis)
+
+    def stats(self):
+        """Pool usage statistics
+        """
+        return {
+            "allocated" : len(self.lis),
+            "reserved"  : len(self.reserved),
+            "free"      : len(self.indices),
+            "quarantine": len(self.quarantine),
+            "peak"      : self.peak,
+            "leaked"    : len(self.leaked())
+            }
+
     def wait(self, i):
         el = self.lis[i]
         el.event.wait()
 
+    def isSet(self, i):
+        el = self.lis[i]
+        return el.event.is_set()
+
     def set(self, i):
         el = self.lis[i]
         el.event.set()
@@ -47,3 +337,4 @@ class IPC:
         el = self.lis[i]
         el.event.clear()
 
+
@@ -31,6 +31,7 @@ from valkka.api2 import parameterInitCheck, typeCheck
 from valkka.mvision.base import Analyzer
 from valkka.live.multiprocess import MessageObject
 from valkka.mvision.multiprocess import test_process, test_with_file, MVisionBaseProcess
+from valkka.mvision.tracking import LineCrossingCounter, blobCentroids
 from valkka.live import style
 from valkka.live.tools import getLogger, setLogger
 from valkka.live.qt.widget import SimpleVideoWidget, LineCrossingVideoWidget
@@ -92,7 +93,11 @@ class MovementDetector(Analyzer):
         # :param deadtime: Movement inside this time interval belong to the same event
         "deadtime": (int, 3),
         # :param treshold: How much movement is an event (area of the image place)
-        "treshold": (float, 0.001)
+        "treshold": (float, 0.001),
+        # :param grid_columns: Columns of the activity grid
+        "grid_columns": (int, 16),
+        # :param grid_rows: Rows of the activity grid
+        "grid_rows": (int, 9)
     }
 
     def __init__(self, **kwargs):
@@ -116,9 +121,47 @@ class MovementDetector(Analyzer):
         self.wasmoving = False
         self.t0 = 0
         self.ismoving = False
+        self.mask = None # movement mask of the latest frame (nonzero = moved)
+        self.activity = None # activity grid, see activity__
+        self.activity_shape = None # shape of the movement mask the grid buffers were allocated for
+        self.activity_valid = False # is the activity grid up to date with the mask
         
     def isMoving(self):
         return self.ismoving
+
+    def getMask(self):
+        """Movement mask of the latest frame: a low-resolution array, nonzero where the frame moved.  None before the second frame
+        """
+        return self.mask
+
+    def getActivity(self):
+        """Activity grid of the latest frame: (grid_rows, grid_columns) float32 array of the fraction of moved samples in each cell.  None before the second frame
+
+        The grid is computed here, only when asked for.  The array is reused for the next frames: copy it if you need to keep it
+        """
+        if self.mask is None:
+            return None
+        if not self.activity_valid:
+            self.activity__(self.mask)
+            self.activity_valid = True
+        return self.activity
+
+    def activity__(self, moved):
+        """Compute the activity grid from a movement mask (nonzero = moved) into preallocated buffers
+        """
+        if moved.shape != self.activity_shape:
+            self.activity_shape = moved.shape
+            rows = numpy.linspace(0, moved.shape[0], self.grid_rows + 1).astype(numpy.intp)
+            cols = numpy.linspace(0, moved.shape[1], self.grid_columns + 1).astype(numpy.intp)
+            self.activity_rows = rows[0:-1]
+            self.activity_cols = cols[0:-1]
+            self.activity_area = numpy.maximum(numpy.outer(numpy.diff(rows), numpy.diff(cols)), 1).astype(numpy.float32)
+            self.activity_rowsums = numpy.empty((self.grid_rows, moved.shape[1]), dtype = numpy.int32)
+            self.activity_counts = numpy.empty((self.grid_rows, self.grid_columns), dtype = numpy.int32)
+            self.activity = numpy.empty((self.grid_rows, self.grid_columns), dtype = numpy.float32)
+        numpy.add.reduceat(moved, self.activity_rows, axis = 0, dtype = numpy.int32, out = self.activity_rowsums)
+        numpy.add.reduceat(self.activity_rowsums, self.activity_cols, axis = 1, out = self.activity_counts)
+        numpy.divide(self.activity_counts, self.activity_area, out = self.activity)
         
     def __call__(self, img):
         self.logger.info("got frame : %s",img.shape)
@@ -145,31 +188,11 @@ class MovementDetector(Analyzer):
             delta = cv2.threshold(delta, 100, 1, cv2.THRESH_BINARY)[
                 1]  # TODO: how much treshold here..?
             val = delta.sum() / (delta.shape[0] * delta.shape[1])
+            self.mask = delta
+            self.activity_valid = False
             # print(self.pre,"MovementDetector: val=",val)
             self.prevframe = modframe.copy()
-
-            if (val >= self.treshold):  # one promille ok .. there is movement
-                self.t0 = time.time()
-                self.logger.info("==>MOVEMENT!")
-                self.ismoving = True
-                if (self.wasmoving):
-                    result = self.state_same
-                else:
-                    self.t0_event = self.t0
-                    self.wasmoving = True
-                    self.logger.info("==> NEW MOVEMENT EVENT!")
-                    result = self.state_start
-
-            else:  # no movement
-                dt = time.time() - self.t0  # how much time since the last movement event
-                # lets close this event ..
-                if (dt >= self.deadtime and self.wasmoving):
-                    dt_event = time.time() - self.t0_event
-                    self.wasmoving = False
-                    result = self.state_stop
-                    self.logger.info("==> MOVEMENT STOPPED!")
-                else:
-                    result = self.state_same
+            result = self.updateState__(val)
 
             if (self.debug):
                 cv2.imshow("SimpleMovementDetector_channels-delta", delta * 255)
@@ -182,6 +205,144 @@ class MovementDetector(Analyzer):
         return result
 
 
+    def updateState__(self, val):
+        """Movement event state machine: val is the fraction of the image that moved.  Returns state_same, state_start or state_stop
+        """
+        if (val >= self.treshold):  # one promille ok .. there is movement
+            self.t0 = time.time()
+            self.logger.info("==>MOVEMENT!")
+            self.ismoving = True
+            if (self.wasmoving):
+                return self.state_same
+            self.t0_event = self.t0
+            self.wasmoving = True
+            self.logger.info("==> NEW MOVEMENT EVENT!")
+            return self.state_start
+
+        # no movement
+        dt = time.time() - self.t0  # how much time since the last movement event
+        # lets close this event ..
+        if (dt >= self.deadtime and self.wasmoving):
+            self.wasmoving = False
+            self.logger.info("==> MOVEMENT STOPPED!")
+            return self.state_stop
+        return self.state_same
+
+
+
+class BackgroundMovementDetector(MovementDetector):
+    """A cheap movement detector that doesn't allocate memory per frame
+
+    Frames are subsampled to a fixed low resolution (a strided view, no copying) & the max over the color channels is written into a preallocated buffer.  The background is an exponential running average, kept in fixed-point integers having "shift" fractional bits: each frame moves it 1/2**shift of the way towards the current frame.  A sample has moved if it differs from the background by more than pixel_threshold.  All of this is done with in-place integer numpy ops on buffers that are allocated only when the frame size changes.
+
+    Returns the same states as MovementDetector & computes the same activity grid
+    """
+
+    parameter_defs = {
+        "verbose"           : (bool, False),
+        "debug"             : (bool, False),
+        "deadtime"          : (int, 3),         # :param deadtime:          Movement inside this time interval belong to the same event
+        "treshold"          : (float, 0.002),   # :param treshold:          How much movement is an event (fraction of the samples)
+        "width"             : (int, 160),       # :param width:             Approximate width of the subsampled frame
+        "shift"             : (int, 4),         # :param shift:             Background update rate is 1/2**shift per frame
+        "pixel_threshold"   : (int, 25),        # :param pixel_threshold:   A sample has moved if it differs this much (0-255) from the background
+        "grid_columns"      : (int, 16),        # :param grid_columns:      Columns of the activity grid
+        "grid_rows"         : (int, 9)          # :param grid_rows:         Rows of the activity grid
+    }
+
+    def reset(self):
+        super().reset()
+        self.shape = None # shape of the input frames the buffers were allocated for
+
+
+    def allocate__(self, shape):
+        self.shape = shape
+        self.step = max(1, shape[1] // self.width)
+        h = len(range(0, shape[0], self.step))
+        w = len(range(0, shape[1], self.step))
+        self.gray = numpy.empty((h, w), dtype = numpy.uint8)
+        self.background = numpy.empty((h, w), dtype = numpy.int32) # fixed-point, "shift" fractional bits
+        self.current = numpy.empty((h, w), dtype = numpy.int32)
+        self.update = numpy.empty((h, w), dtype = numpy.int32)
+        self.moved = numpy.empty((h, w), dtype = numpy.bool_)
+        self.limit = self.pixel_threshold << self.shift
+        self.logger.debug("allocate__: %s => %s", shape, self.gray.shape)
+
+
+    def __call__(self, img):
+        self.ismoving = False
+        if img.shape != self.shape:
+            self.allocate__(img.shape)
+            first = True
+        else:
+            first = False
+
+        small = img[::self.step, ::self.step] # a view
+        numpy.maximum(small[:, :, 0], small[:, :, 1], out = self.gray)
+        numpy.maximum(self.gray, small[:, :, 2], out = self.gray)
+        numpy.left_shift(self.gray, self.shift, out = self.current, dtype = numpy.int32)
+
+        if first:
+            numpy.copyto(self.background, self.current)
+            self.logger.info("First image found!")
+            return self.state_same
+
+        numpy.subtract(self.current, self.background, out = self.current) # difference to background
+        numpy.right_shift(self.current, self.shift, out = self.update)
+        numpy.add(self.background, self.update, out = self.background)
+        numpy.abs(self.current, out = self.current)
+        numpy.greater(self.current, self.limit, out = self.moved)
+        val = numpy.count_nonzero(self.moved) / self.moved.size
+        self.mask = self.moved
+        self.activity_valid = False
+
+        if (self.debug):
+            cv2.imshow("BackgroundMovementDetector-moved", self.moved.astype(numpy.uint8) * 255)
+            cv2.waitKey(1)
+
+        return self.updateState__(val)
+
+
+
+def activityMessage(activity, mstimestamp):
+    """Contents of the "activity" message: the activity grid as uint8 (255 = all samples in the cell moved) & the timestamp of the frame
+    """
+    return {
+        "activity"      : (activity * 255).astype(numpy.uint8),
+        "mstimestamp"   : mstimestamp
+    }
+
+
+def crossingText(message):
+    """Text for the widget from the contents of the "crossing" message: in & out counts summed over the lines
+    """
+    return "IN %i OUT %i" % (sum(message["counts_in"]), sum(message["counts_out"]))
+
+
+def activityDue(owner, interval):
+    """Is it time to send the activity grid again?  owner (a process or a stream) keeps the time of the last one in t_activity
+    """
+    if interval <= 0:
+        return False
+    t = time.time()
+    if (t - owner.t_activity) < interval:
+        return False
+    owner.t_activity = t
+    return True
+
+
+movement_engines = ["opencv", "background"]
+
+def makeMovementDetector(engine = "opencv", **kwargs):
+    """Movement detector for an engine name: "opencv" (MovementDetector) or "background" (BackgroundMovementDetector)
+    """
+    if engine == "opencv":
+        return MovementDetector(treshold = 0.0001, **kwargs)
+    elif engine == "background":
+        return BackgroundMovementDetector(**kwargs)
+    raise(AttributeError("Unknown movement engine " + str(engine)))
+
+
 
 class MVisionProcess(MVisionBaseProcess):
     """ NOTE: the name of the class must always be MVisionProcess, so that Valkka Live can find the class
@@ -213,8 +374,12 @@ class MVisionProcess(MVisionBaseProcess):
     class Signals(QtCore.QObject):
         pong = QtCore.Signal(object)
         shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
-        start_move = QtCore.Signal()
-        stop_move = QtCore.Signal()
+        start_move = QtCore.Signal(object) # carries the mstimestamp of the frame
+        stop_move = QtCore.Signal(object)
+        activity = QtCore.Signal(object) # activity grid of each analyzed frame, see activityMessage
+        crossing = QtCore.Signal(object) # moving objects crossed the line(s), see valkka.mvision.tracking.LineCrossingCounter.message
+        stats = QtCore.Signal(object) # see valkka.mvision.stats.StageStats.report
+        recording = QtCore.Signal(object) # see valkka.mvision.multiprocess.MVisionBaseProcess.triggerRecording__
     #"""
 
     # backend method
@@ -224,8 +389,13 @@ class MVisionProcess(MVisionBaseProcess):
         "deadtime": (int, 1)
     }
 
+    activity_interval = 1.0 # send the activity grid at most this often (secs).  0 = never
+    engine = "opencv" # movement detector, see movement_engines.  Processes are created by the process pool with default parameters, so change this in a subclass
+    record_on_movement = True # open the recording gate of the stream during movement events
+
     def __init__(self, name = "MVisionProcess", **kwargs):
         parameterInitCheck(self.parameter_defs, kwargs, self)
+        assert(self.engine in movement_engines)
         super().__init__(name = name)
         # self.setDebug()
         
@@ -233,11 +403,20 @@ class MVisionProcess(MVisionBaseProcess):
     def preRun_(self):
         super().preRun_()
         # its a good idea to instantiate the analyzer after the multiprocess has been spawned (like we do here)
-        self.analyzer = MovementDetector(
-            treshold    =0.0001,
+        self.analyzer = makeMovementDetector(
+            engine      =self.engine,
             verbose     =self.verbose,
             deadtime    =self.deadtime
         )
+        # tracks the movement blobs across the line defined with LineCrossingVideoWidget
+        self.counter = LineCrossingCounter(verbose = self.verbose)
+        self.t_activity = 0 # when the activity grid was last sent
+
+    def postActivate_(self):
+        super().postActivate_()
+        # the process might have analyzed another camera before: forget its background & tracks
+        self.analyzer.reset()
+        self.counter.reset()
         
     def postRun_(self):
         self.analyzer.close() # release any resources acquired by the analyzer
@@ -248,8 +427,10 @@ class MVisionProcess(MVisionBaseProcess):
         # NOTE: enable this to see if your multiprocess is alive
         self.logger.debug("cycle_ starts")
         index, meta = self.client.pullFrame()
+        self.stats.mark("pull")
         if (index is None):
             self.logger.debug("cycle_ : client timed out..")
+            self.stats.count("timeouts")
             return
         
         self.logger.debug("cycle_ : client index = %s", index)
@@ -265,11 +446,14 @@ class MVisionProcess(MVisionBaseProcess):
         cv2.waitKey(1)
         """
         self.logger.debug("cycle_ : got frame %s", img.shape)
+        self.stats.count("frames")
         result = self.analyzer(img)
+        self.stats.mark("analyze")
 
-        img_ = img.copy()
+        # overlays are drawn only when somebody's watching
+        img_ = self.getOverlay__(img)
 
-        if self.parameters:
+        if (img_ is not None) and self.parameters:
             # what we have in parameters, depends on the 
             # analyzer video widget class, i.e. on the widget that
             # interacts with the user for defining the machine vision parameters
@@ -286,23 +470,41 @@ class MVisionProcess(MVisionBaseProcess):
                 # print("end",end)
                 # # cross-check the line defined in the interactive qt widget
                 cv2.line(img_, start, end, (0,255,0), 8)
+        self.stats.mark("overlay")
 
-        if self.qt_server is not None:
+        if img_ is not None:
             self.logger.info("cycle_ : pushing frame to server")
             self.qt_server.pushFrame(
                 img_,
                 meta.slot,
                 meta.mstimestamp
             )
+            self.stats.mark("push")
 
         # NOTE: you could use and combine several analyzers here, say first see if there is movement and then do the rest
         # print(self.pre,">>>",data[0:10])
         if (result == MovementDetector.state_same):
             pass
         elif (result == MovementDetector.state_start):
-            self.send_out__(MessageObject("start_move"))
+            self.send_out__(MessageObject("start_move", mstimestamp = meta.mstimestamp))
         elif (result == MovementDetector.state_stop):
-            self.send_out__(MessageObject("stop_move"))
+            self.send_out__(MessageObject("stop_move", mstimestamp = meta.mstimestamp))
+        if self.record_on_movement:
+            self.triggerRecording__(self.analyzer.wasmoving)
+
+        if activityDue(self, self.activity_interval):
+            activity = self.analyzer.getActivity()
+            if activity is not None:
+                self.send_out__(MessageObject("activity", **activityMessage(activity, meta.mstimestamp)))
+
+        self.counter.setParameters(self.parameters)
+        mask = self.analyzer.getMask()
+        if self.counter.hasLines() and (mask is not None):
+            events = self.counter.update(blobCentroids(mask))
+            self.stats.mark("track")
+            if len(events) > 0:
+                self.send_out__(MessageObject("crossing", **self.counter.message(events, meta.mstimestamp)))
+        self.stats.mark("send")
 
 
     # *** create a widget for this machine vision module ***
@@ -315,8 +517,9 @@ class MVisionProcess(MVisionBaseProcess):
         """
         widget = QtWidgets.QLabel("NO MOVEMENT YET")
         widget.setStyleSheet(style.detector_test)
-        self.signals.start_move.connect(lambda : widget.setText("MOVEMENT START"))
-        self.signals.stop_move. connect(lambda : widget.setText("MOVEMENT STOP"))
+        self.signals.start_move.connect(lambda message: widget.setText("MOVEMENT START"))
+        self.signals.stop_move. connect(lambda message: widget.setText("MOVEMENT STOP"))
+        self.signals.crossing.  connect(lambda message : widget.setText(crossingText(message)))
         return widget
 
     
@@ -344,6 +547,25 @@ def test2():
     pass
 
 
+def test5():
+    """Dummy-testing the running-background movement analyzer
+    """
+    analyzer = BackgroundMovementDetector(verbose=True, deadtime=0)
+    img = numpy.zeros((1080 // 4, 1920 // 4, 3), dtype=numpy.uint8)
+    print("\nresult =", analyzer(img), "\n") # first frame
+    print("\nresult =", analyzer(img), "\n") # same
+    img[100:150, 200:260, :] = 200
+    print("\nresult =", analyzer(img), "\n") # start
+    print("\nactivity =\n", analyzer.getActivity(), "\n")
+    for i in range(100): # becomes background
+        analyzer(img)
+    print("\nresult =", analyzer(img), "\n") # stop
+    t = time.time()
+    for i in range(1000):
+        analyzer(img)
+    print("\n%.3f ms per frame\n" % (time.time() - t))
+
+
 def test3():
     """Test the multiprocess
     """
@@ -0,0 +1,167 @@
+"""
+base.py : A movement analyzer process serving several streams
+
+Copyright 2018 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the machine vision plugin for the Valkka Live program
+
+This plugin is free software: you can redistribute it and/or modify it under the terms of the MIT License.  This code is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the MIT License for more details.
+
+@file    base.py
+@author  Sampsa Riikonen
+@date    2018
+@version 0.12.1 
+@brief   A movement analyzer process serving several streams
+"""
+
+# from PyQt5 import QtWidgets, QtCore, QtGui # Qt5
+from PySide2 import QtWidgets, QtCore, QtGui
+import sys
+import cv2
+
+from valkka.api2 import parameterInitCheck
+from valkka.mvision.multiprocess import test_process, MVisionMultiBaseProcess
+from valkka.mvision.movement.base import MovementDetector, makeMovementDetector, movement_engines, activityMessage, activityDue, crossingText
+from valkka.mvision.tracking import LineCrossingCounter, blobCentroids
+from valkka.live import style
+from valkka.live.qt.widget import LineCrossingVideoWidget
+
+
+class MVisionProcess(MVisionMultiBaseProcess):
+    """Like valkka.mvision.movement.MVisionProcess, but a single process analyzes up to max_streams streams.  Each stream has its own movement detector, by default the cheap BackgroundMovementDetector
+    """
+    
+    name = "Simple Movement Detector (multi-stream)"
+    tag  = "movementmulti"
+    auto_menu = True
+    max_instances = 2 # number of processes ..
+    max_streams = 16 # .. each one analyzing this many streams
+    analyzer_video_widget_class = LineCrossingVideoWidget
+
+    # outgoing messages carry the slot of the stream
+    class Signals(QtCore.QObject):
+        pong = QtCore.Signal(object)
+        shmem_server = QtCore.Signal(object)
+        start_move = QtCore.Signal(object)
+        stop_move = QtCore.Signal(object)
+        activity = QtCore.Signal(object)
+        crossing = QtCore.Signal(object)
+        recording = QtCore.Signal(object)
+        stats = QtCore.Signal(object) # process-wide, not routed to the streams
+
+    # .. and are routed to these signals of the stream with that slot
+    class StreamSignals(QtCore.QObject):
+        shmem_server = QtCore.Signal(object)
+        start_move = QtCore.Signal(object) # carries the mstimestamp of the frame
+        stop_move = QtCore.Signal(object)
+        activity = QtCore.Signal(object) # see valkka.mvision.movement.base.activityMessage
+        crossing = QtCore.Signal(object) # see valkka.mvision.tracking.LineCrossingCounter.message
+        recording = QtCore.Signal(object) # see valkka.mvision.multiprocess.MVisionBaseProcess.triggerRecording__
+
+    parameter_defs = {
+        "verbose" : (bool, False),
+        "deadtime": (int, 1)
+    }
+
+    activity_interval = 1.0 # send the activity grid of a stream at most this often (secs).  0 = never
+    engine = "background" # movement detector, see valkka.mvision.movement.base.movement_engines.  Change this in a subclass
+
+    record_on_movement = True # open the recording gate of a stream during its movement events
+
+    def __init__(self, name = "MVisionProcess", **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        assert(self.engine in movement_engines)
+        super().__init__(name = name)
+
+
+    def postActivateSlot_(self, stream):
+        stream.analyzer = makeMovementDetector(
+            engine      =self.engine,
+            verbose     =self.verbose,
+            deadtime    =self.deadtime
+        )
+        stream.counter = LineCrossingCounter(verbose = self.verbose)
+        stream.t_activity = 0 # when the activity grid was last sent
+
+
+    def preDeactivateSlot_(self, stream):
+        super().preDeactivateSlot_(stream)
+        if stream.analyzer is not None: stream.analyzer.close()
+        stream.analyzer = None
+
+
+    def cycleSlot_(self, stream):
+        img, meta = self.pullFrame__(stream)
+        if img is None:
+            return
+        self.logger.debug("cycleSlot_ : slot %s got frame %s", stream.slot, img.shape)
+        result = stream.analyzer(img)
+        self.stats.mark("analyze")
+
+        img_ = self.getOverlay__(img, owner = stream) # only when somebody's watching
+        if img_ is not None:
+            if stream.parameters and ("line" in stream.parameters):
+                # see valkka.live.qt.widget.LineCrossingVideoWidget
+                line = stream.parameters["line"]
+                start = (int(line[0][0]*img_.shape[1]), int((line[0][1])*img_.shape[0]))
+                end =   (int(line[1][0]*img_.shape[1]), int((line[1][1])*img_.shape[0]))
+                cv2.line(img_, start, end, (0,255,0), 8)
+            stream.qt_server.pushFrame(
+                img_,
+                meta.slot,
+                meta.mstimestamp
+            )
+            self.stats.mark("push")
+
+        if (result == MovementDetector.state_start):
+            self.sendSlot__(stream.slot, "start_move", mstimestamp = meta.mstimestamp)
+        elif (result == MovementDetector.state_stop):
+            self.sendSlot__(stream.slot, "stop_move", mstimestamp = meta.mstimestamp)
+        if self.record_on_movement:
+            self.triggerRecording__(stream.analyzer.wasmoving, stream)
+
+        if activityDue(stream, self.activity_interval):
+            activity = stream.analyzer.getActivity()
+            if activity is not None:
+                self.sendSlot__(stream.slot, "activity", **activityMessage(activity, meta.mstimestamp))
+
+        stream.counter.setParameters(stream.parameters)
+        mask = stream.analyzer.getMask()
+        if stream.counter.hasLines() and (mask is not None):
+            events = stream.counter.update(blobCentroids(mask))
+            self.stats.mark("track")
+            if len(events) > 0:
+                self.sendSlot__(stream.slot, "crossing", **stream.counter.message(events, meta.mstimestamp))
+        self.stats.mark("send")
+
+
+    # *** create a widget for a stream of this machine vision module ***
+    def getStreamWidget(self, stream):
+        widget = QtWidgets.QLabel("NO MOVEMENT YET")
+        widget.setStyleSheet(style.detector_test)
+        stream.signals.start_move.connect(lambda message: widget.setText("MOVEMENT START"))
+        stream.signals.stop_move. connect(lambda message: widget.setText("MOVEMENT STOP"))
+        stream.signals.crossing.  connect(lambda message : widget.setText(crossingText(message)))
+        return widget
+
+    
+def test1():
+    """Test the multiprocess
+    """
+    test_process(MVisionProcess)
+
+
+def main():
+    pre = "main :"
+    print(pre, "main: arguments: ", sys.argv)
+    if (len(sys.argv) < 2):
+        print(pre, "main: needs test number")
+    else:
+        st = "test" + str(sys.argv[1]) + "()"
+        exec(st)
+
+
+if (__name__ == "__main__"):
+    main()
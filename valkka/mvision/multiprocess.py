@@ -20,16 +20,36 @@ This plugin is free software: you can redistribute it and/or modify it under the
 from PySide2 import QtWidgets, QtCore, QtGui
 import sys
 import time
+import select
+import numpy
 import logging
 
+from valkka import core
 from valkka.api2 import ValkkaProcess, Namespace, ShmemRGBClient, ShmemRGBServer
 from valkka.api2.tools import *
-from valkka.live.multiprocess import MessageObject, safe_select, QMultiProcess
+from valkka.live.multiprocess import MessageObject, safe_select, QMultiProcess, registerMessage
 from valkka.mvision import singleton
+from valkka.mvision.ipc import ResultRing
+from valkka.mvision.stats import StageStats
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
 
 logger = getLogger(__name__)
 
 
+# binary schemas for the per-frame messages sent to the frontend.  Messages of multi-stream processes carry the slot as well
+for fields in [[], [("slot", "i")]]:
+    registerMessage("start_move",   fields + [("mstimestamp", "q")])
+    registerMessage("stop_move",    fields + [("mstimestamp", "q")])
+    registerMessage("activity",     fields + [("activity", "array"), ("mstimestamp", "q")])
+    registerMessage("objects",      fields + [("object_list", "strs"), ("bbox_list", "tuples"), ("score_list", "array"), ("mstimestamp", "q")])
+    registerMessage("text",         fields + [("message", "str")])
+    registerMessage("recording",    fields + [("recording", "?")])
+
+
 """
 
 ::
@@ -40,13 +60,44 @@ logger = getLogger(__name__)
 
 """
 
+class Reply:
+    """Results from a master process, read from the shared memory result ring
+
+    ::
+
+        seq         : sequence number of the result
+        mstimestamp : timestamp of the analyzed frame
+        records     : numpy structured array with fields class_id, score and box (see ResultRing)
+        tags        : a list of name tags, one per record
+        messages    : a list of strings (control messages, warnings, etc.)
+
+    """
+    def __init__(self, seq = 0, mstimestamp = 0, records = None, tags = [], messages = []):
+        self.seq = seq
+        self.mstimestamp = mstimestamp
+        self.records = records
+        self.tags = tags
+        self.messages = messages
+
+    def __str__(self):
+        return "<Reply %s: %s %s>" % (self.seq, self.tags, self.messages)
+
+
 class QShmemProcess(QMultiProcess):
     """A multiprocess with Qt signals and reading RGB images from shared memory.  Shared memory client is instantiated on demand (by calling activate)
+
+    If the shmem server signals new frames through the eventfd of this process (see getEventFd & activate), the process sleeps in epoll until a frame or a command arrives.  Otherwise it polls the shmem client
+
+    The backend records the time spent in each stage of its loop into self.stats (a StageStats).  Subclasses mark their stages in cycle_ (i.e. "pull", "analyze", "overlay", "push", "send").  The timings are sent to the frontend every stats_interval seconds & on request (requestStats) as the "stats" signal
     """
     timeout = 1.0
+    coalesced_signals = ["objects", "activity"] # per-frame results: only the latest ones reach the GUI, at most gui_rate times per second
+    gui_rate = 10.0
+    stats_interval = 10.0 # send stage timings this often (secs).  0 = only on request
 
     class Signals(QtCore.QObject):
         pong = QtCore.Signal(object) # demo outgoing signal
+        stats = QtCore.Signal(object) # periodic report of stage timings, see StageStats.report
 
     # **** define here backend methods that correspond to incoming slots
     # **** 
@@ -56,10 +107,15 @@ class QShmemProcess(QMultiProcess):
         self.send_out__(MessageObject("pong", lis = [1,2,3]))
 
 
+    def c__requestStats(self):
+        self.send_out__(MessageObject("stats", **self.stats.report()))
+
+
     def c__activate(self, 
         n_buffer:int = None, 
         image_dimensions:tuple = None, 
-        shmem_name:str = None):
+        shmem_name:str = None,
+        use_event_fd:bool = False):
     
         # if not defined, use default values
         # if n_buffer is None: n_buffer = self.n_buffer
@@ -79,6 +135,14 @@ class QShmemProcess(QMultiProcess):
             verbose     =self.shmem_verbose
             )
 
+        if self.event_driven: # activated again
+            self.epoll.unregister(self.event_fd.getFd())
+            self.event_driven = False
+        if use_event_fd:
+            self.client.useEventFd(self.event_fd)
+            self.epoll.register(self.event_fd.getFd(), select.EPOLLIN)
+            self.event_driven = True
+
         self.shmem_name = shmem_name
         self.n_buffer = n_buffer
         self.image_dimensions = image_dimensions
@@ -92,6 +156,9 @@ class QShmemProcess(QMultiProcess):
         self.logger.debug("c__deactivate")
         self.preDeactivate_()
         self.listening = False
+        if self.event_driven:
+            self.epoll.unregister(self.event_fd.getFd())
+            self.event_driven = False
         # self.image_dimensions = None
         self.client = None # shared memory client created when activate is called
     # ****
@@ -107,6 +174,11 @@ class QShmemProcess(QMultiProcess):
     def __init__(self, name = "QShmemProcess", **kwargs):
         super().__init__(name)
         parameterInitCheck(QShmemProcess.parameter_defs, kwargs, self)
+        # created before forking, so that both the frontend & backend have it
+        self.event_fd = core.EventFd()
+        self.stats_report = {} # front-end: latest stats report from the backend
+        if hasattr(self.signals, "stats"):
+            self.signals.stats.connect(self.stats_slot)
         """
         if self.shmem_name is None:
             self.shmem_name = "valkkashmemclient"+str(id(self))
@@ -118,6 +190,8 @@ class QShmemProcess(QMultiProcess):
 
     def preRun_(self):
         self.logger.debug("preRun_")
+        self.stats = StageStats(interval = self.stats_interval)
+        self.initEpoll__()
         self.c__deactivate() # init variables
         
 
@@ -125,38 +199,83 @@ class QShmemProcess(QMultiProcess):
         """Clear shmem variables
         """
         self.c__deactivate()
+        self.epoll.close()
         
 
     def run(self):
         self.preRun_()
 
         while self.loop:
-            if self.listening:
+            if self.listening and not self.event_driven:
+                # no eventfd: cycle_ blocks in pullFrame for max timeout
+                self.stats.begin()
                 self.cycle_()
                 self.readPipes__(timeout = 0) # timeout = 0 == just poll
+                self.checkTimers__()
             else:
-                self.readPipes__(timeout = self.timeout) # timeout of 1 sec
+                self.waitEvents__()
+            self.publishStats__()
 
         self.postRun_()
         # indicate front end qt thread to exit
-        self.back_pipe.send(None)
+        self.send_out__(None)
         self.logger.debug("bye!")
 
 
+    def initEpoll__(self):
+        self.epoll = select.epoll()
+        self.epoll.register(self.back_pipe.fileno(), select.EPOLLIN)
+        self.event_driven = False # is the shmem client using self.event_fd
+
+
+    def publishStats__(self):
+        if self.stats.due():
+            self.send_out__(MessageObject("stats", **self.stats.report(reset = True)))
+
+
+    def waitEvents__(self):
+        """Sleep until there is a new frame, a command or a timer is due (see pollTimeout__)
+        """
+        self.stats.begin()
+        events = self.epoll.poll(self.pollTimeout__())
+        self.stats.mark("wait")
+        for fd, mask in events:
+            if fd == self.back_pipe.fileno():
+                self.readPipes__(timeout = 0)
+            elif self.listening: # a new frame
+                self.cycle_()
+        self.checkTimers__()
+
+
+    def pollTimeout__(self):
+        """Max secs to sleep in waitEvents__ while there are no frames nor commands.  -1 = sleep until something happens.  Overwrite in child classes
+        """
+        return -1
+
+
+    def checkTimers__(self):
+        """Called after each wait for events, even if nothing arrived (see pollTimeout__).  Overwrite in child classes
+        """
+        pass
+
+
     def cycle_(self):
         """Receives frames from the shmem client and does something with them
 
         Typically launch qt signals
         """
         index, meta = self.client.pullFrame()
+        self.stats.mark("pull")
         if (index is None):
             self.logger.debug("Client timed out..")
+            self.stats.count("timeouts")
             return
         
         self.logger.debug("Client index = %s", index)
         if meta.size < 1:
             return
 
+        self.stats.count("frames")
         data = self.client.shmem_list[index][0:meta.size]
         img = data.reshape(
             (meta.height, meta.width, 3))
@@ -204,33 +323,110 @@ class QShmemProcess(QMultiProcess):
         self.sendMessageToBack(MessageObject("ping", message = message))
 
 
+    def getEventFd(self):
+        """The eventfd for signaling new frames.  Pass it to the shmem server (i.e. filterchain.getShmem) & call activate with use_event_fd = True
+        """
+        return self.event_fd
+
+
+    def frontendFds(self):
+        return [self.event_fd.getFd()]
+
+
+    def requestStats(self):
+        """Ask the backend to send its current stage timings (see StageStats.report) through the "stats" signal
+        """
+        self.sendMessageToBack(MessageObject("requestStats"))
+
+
+    def stats_slot(self, kwargs):
+        self.stats_report = kwargs
+
+
+    def getStats(self):
+        """The latest stage timings received from the backend
+        """
+        return self.stats_report
+
+
 
 class QShmemMasterProcess(QShmemProcess):
 
     max_clients = 999 # how many clients can register to this master process
+    max_batch = 1 # how many client frames are analyzed in one go.  1 = no batching
+    batch_window = 0.0 # time in seconds to wait for more client frames to fill a batch
+    load_interval = 2.0 # how often (secs) the load of this master process is reported to the frontend
+    schedule = "round-robin" # how clients with waiting frames are served: "round-robin" or "priority" (weighted by client priority)
+    deadline = 0.0 # drop frames older than this many seconds (according to meta.mstimestamp).  0 = no deadline
+
+    register_timeout = 10.0 # give up a client registration if the client hasn't created its shmem server in this many seconds
+
+    class Signals(QtCore.QObject):
+        pong = QtCore.Signal(object) # demo outgoing signal
+        stats = QtCore.Signal(object) # periodic report of stage timings, see StageStats.report
+        load = QtCore.Signal(object) # periodic report of the master process load
+        unregistered = QtCore.Signal(object) # the backend has stopped using an ipc element: {"ipc_index": int}
     
     class Client:
-        def __init__(self, fd = None, pipe = None, shmem_client = None):
+        def __init__(self, fd = None, pipe = None, shmem_client = None, result_fd = None, results = None, ipc_index = None, priority = 1.0):
             self.fd = fd
             self.pipe = pipe
             self.shmem_client = shmem_client
+            self.result_fd = result_fd # signals the client that there are new results
+            self.results = results # ResultRing
+            self.ipc_index = ipc_index
+            self.priority = priority # weight in the "priority" schedule
+            self.messages = [] # control messages last sent to the client
+            self.frame = None # newest frame waiting to be analyzed: (img, meta)
+            self.credit = 0.0 # "priority" schedule: accumulated claim for service
+            self.served = 0 # number of frames analyzed
+            self.dropped = 0 # number of frames dropped (replaced by a newer frame or past the deadline)
 
 
     def c__registerClient(self,
         n_buffer:int = None, 
         image_dimensions:tuple = None, 
         shmem_name:str = None,
-        ipc_index:int = None):
+        ipc_index:int = None,
+        priority:float = 1.0):
         """Shared mem info is given.  Now we can create the shmem client
 
-        There can be several shmem clients
+        There can be several shmem clients.  The shmem client can be created only after the client process has created the shmem server, so the registration stays pending until then (see registerPending__).  Doesn't block
         """
         self.logger.debug("c__registerClient")
-
+        self.pending[ipc_index] = (time.time(), dict(
+            n_buffer = n_buffer,
+            image_dimensions = image_dimensions,
+            shmem_name = shmem_name,
+            ipc_index = ipc_index,
+            priority = priority
+            ))
+        self.registerPending__()
+
+
+    def registerPending__(self):
+        """Complete pending registrations of clients that have created their shmem server
+        """
+        t = time.time()
+        for ipc_index, (t0, kwargs) in list(self.pending.items()):
+            # this flag is controlled by QShmemClientProcess.c__setMasterProcess
+            if singleton.ipc.isSet(ipc_index):
+                self.pending.pop(ipc_index)
+                singleton.ipc.clear(ipc_index)
+                self.addClient__(**kwargs)
+            elif (t - t0) > self.register_timeout:
+                self.logger.warning("registerPending__: client %s did not create its shmem server: giving up", ipc_index)
+                self.pending.pop(ipc_index)
+
+
+    def addClient__(self,
+        n_buffer:int = None, 
+        image_dimensions:tuple = None, 
+        shmem_name:str = None,
+        ipc_index:int = None,
+        priority:float = 1.0):
         event_fd, pipe = singleton.ipc.get2(ipc_index)
-        singleton.ipc.wait(ipc_index) # wait till the shmem server has been created
-        # this flag is controlled by QShmemClientProcess.c__setMasterProcess
-        singleton.ipc.clear(ipc_index)
+        result_fd, results = singleton.ipc.getResults(ipc_index)
         shmem_client = ShmemRGBClient(
                 name            =shmem_name,
                 n_ringbuffer    =n_buffer,   # size of ring buffer
@@ -247,10 +443,15 @@ class QShmemMasterProcess(QShmemProcess):
         client = self.Client(
             fd = fd,
             pipe = pipe,
-            shmem_client = shmem_client
+            shmem_client = shmem_client,
+            result_fd = result_fd,
+            results = results,
+            ipc_index = ipc_index,
+            priority = priority
             )
 
         self.clients[ipc_index] = client
+        self.order.append(ipc_index)
         self.clients_by_fd[fd] = client
         self.logger.debug("c__registerClient: fd=%s", fd)
         self.rlis.append(fd)
@@ -263,8 +464,17 @@ class QShmemMasterProcess(QShmemProcess):
 
 
     def c__unregisterClient(self, ipc_index = None):
-        client = self.clients.pop(ipc_index)
+        # tell the frontend that the ipc element is not used by this process anymore
+        self.send_out__(MessageObject("unregistered", ipc_index = ipc_index))
+        if self.pending.pop(ipc_index, None) is not None:
+            return
+        client = self.clients.pop(ipc_index, None)
+        if client is None: # registration was given up
+            return
         self.clients_by_fd.pop(client.fd)
+        self.order.remove(ipc_index)
+        self.scheduled.pop(client.shmem_client, None)
+        self.mstimestamps.pop(client.shmem_client, None)
         self.rlis.remove(client.fd)
         if len(self.clients) == 0:
             self.logger.debug("c__unregisterClient: last client unregistered")
@@ -279,13 +489,23 @@ class QShmemMasterProcess(QShmemProcess):
         super().__init__(name)
         parameterInitCheck(QShmemMasterProcess.parameter_defs, kwargs, self)
         self.n_clients = 0 # a front-end variable
+        self.client_processes = {} # front-end: ipc_index => client process
+        self.load = {} # front-end: latest load report from the backend
+        self.signals.load.connect(self.load_slot)
+        self.signals.unregistered.connect(self.unregistered_slot)
 
 
     def preRun_(self):
         self.logger.debug("preRun_")
         self.clients = {}
         self.clients_by_fd = {}
+        self.pending = {} # registrations waiting for the client's shmem server: ipc_index => (time, kwargs)
+        self.mstimestamps = {} # shmem client => timestamp of the latest frame
+        self.order = [] # ipc indices of the clients in the order they are served
+        self.scheduled = {} # shmem client => frame chosen by the scheduler: (img, meta)
         self.rlis = [self.back_pipe]
+        self.stats = StageStats(interval = self.stats_interval)
+        self.resetLoad__()
 
 
     def postRun_(self):
@@ -306,39 +526,279 @@ class QShmemMasterProcess(QShmemProcess):
         self.preRun_()
 
         while self.loop:
+            # don't block if there are frames waiting
+            if self.countWaiting__() > 0:
+                timeout = 0
+            elif len(self.pending) > 0: # poll for pending registrations
+                timeout = min(self.timeout, 0.01)
+            else:
+                timeout = self.timeout
             # self.logger.debug("run: select %s", self.rlis)
-            rlis, wlis, elis = safe_select(self.rlis, [], [], timeout = self.timeout)
+            self.stats.begin()
+            rlis, wlis, elis = safe_select(self.rlis, [], [], timeout = timeout)
+            self.stats.mark("wait")
             # self.logger.debug("run: select done %s", rlis)
 
             if self.back_pipe in rlis:
                 rlis.remove(self.back_pipe)
-                obj = self.back_pipe.recv()
+                obj = self.recv_in__()
                 self.routeMainPipe__(obj)
 
-            for fd in rlis:
-                self.logger.debug("run: handling %s", fd)
-                # an fd removed from clients_by_fd might still be in rlis... routeMainPipe__ => c__unregisterClient => clients_by_fd modified
-                try:
-                    client = self.clients_by_fd[fd]
-                except KeyError:
-                    pass
-                else:
+            if len(self.pending) > 0:
+                self.registerPending__()
+            self.receiveFrames__(self.readyClients__(rlis))
+            if self.max_batch > 1:
+                self.collectBatch__()
+            self.stats.mark("receive")
+            n_waiting = self.countWaiting__()
+            clients = self.schedule__(self.max_batch)
+            self.stats.mark("schedule")
+            t0 = time.time()
+            if (self.max_batch > 1) and (len(clients) > 0):
+                self.logger.debug("run: handling a batch of %s", len(clients))
+                replies = self.handleBatch_([client.shmem_client for client in clients])
+                self.stats.mark("analyze")
+                for client, reply in zip(clients, replies):
+                    self.sendReply__(client, reply)
+                self.stats.mark("reply")
+            else:
+                for client in clients:
+                    self.logger.debug("run: handling %s", client.fd)
                     reply = self.handleFrame_(client.shmem_client)
-                    client.pipe.send(reply)
+                    self.stats.mark("analyze")
+                    self.sendReply__(client, reply)
+                    self.stats.mark("reply")
+            self.stats.count("frames", len(clients))
+            self.measureLoad__(len(clients), time.time() - t0, n_waiting)
+            self.publishStats__()
 
         self.postRun_()
         # indicate front end qt thread to exit
-        self.back_pipe.send(None)
+        self.send_out__(None)
         self.logger.debug("run: bye!")
 
 
-    def handleFrame_(self, shmem_client):
-        """Receives frames from the shmem client.  Reply with results
+    def readyClients__(self, rlis):
+        """Map a list of ready file descriptors into a list of clients
+        """
+        clients = []
+        for fd in rlis:
+            # an fd removed from clients_by_fd might still be in rlis... routeMainPipe__ => c__unregisterClient => clients_by_fd modified
+            try:
+                clients.append(self.clients_by_fd[fd])
+            except KeyError:
+                pass
+        return clients
+
+
+    def readFrame__(self, shmem_client):
+        """Read a frame from a shmem client.  Returns (img, meta), (None, meta) for an empty frame or (None, None) if there was no frame
         """
         index, meta = shmem_client.pullFrame()
+        if index is None:
+            return None, None
         if meta.size < 1:
+            return None, meta
+        data = shmem_client.shmem_list[index][0:meta.size]
+        img = data.reshape(
+            (meta.height, meta.width, 3))
+        return img, meta
+
+
+    def receiveFrames__(self, clients):
+        """Read the newest frame of each client into its waiting slot
+
+        A frame still waiting in the slot is replaced & dropped.  The frame stays in the shmem ring buffer of the client until the client has pushed n_buffer new frames, so it's safe to keep just a reference to it
+        """
+        for client in clients:
+            img, meta = self.readFrame__(client.shmem_client)
+            if meta is None:
+                continue
+            if client.frame is not None:
+                self.dropFrame__(client, client.frame[1])
+            client.frame = (img, meta)
+
+
+    def dropFrame__(self, client, meta):
+        """Answer a frame that will not be analyzed, so that the client process does not keep waiting for it
+        """
+        client.dropped += 1
+        client.results.write([], [], [],
+            mstimestamp = meta.mstimestamp,
+            flags = ResultRing.flag_none | ResultRing.flag_dropped
+            )
+        client.result_fd.set()
+
+
+    def countWaiting__(self):
+        """Number of clients having a frame waiting to be analyzed
+        """
+        return sum(1 for client in self.clients.values() if client.frame is not None)
+
+
+    def collectBatch__(self):
+        """Wait at most batch_window seconds for more frames, until max_batch clients have a frame waiting
+        """
+        t0 = time.time()
+        dt = self.batch_window
+        while (self.countWaiting__() < self.max_batch) and (dt > 0):
+            fds = [client.fd for client in self.clients.values() if client.frame is None]
+            if len(fds) < 1:
+                break
+            rlis, wlis, elis = safe_select(fds, [], [], timeout = dt)
+            self.receiveFrames__(self.readyClients__(rlis))
+            dt = self.batch_window - (time.time() - t0)
+
+
+    def schedule__(self, n):
+        """Choose at most n clients whose waiting frames are analyzed next
+
+        Frames past the deadline are dropped.  Clients are served either round-robin or by weighted priority, see schedule.  Chosen frames are given to handleFrame_ / handleBatch_ through pullFrame__
+        """
+        t = time.time() * 1000
+        waiting = []
+        for client in (self.clients[ipc_index] for ipc_index in self.order):
+            if client.frame is None:
+                continue
+            meta = client.frame[1]
+            if (self.deadline > 0) and (meta.mstimestamp > 0) and ((t - meta.mstimestamp) > (self.deadline * 1000)):
+                self.logger.debug("schedule__: dropping a frame %i ms old", t - meta.mstimestamp)
+                client.frame = None
+                self.dropFrame__(client, meta)
+                continue
+            waiting.append(client)
+
+        if self.schedule == "priority":
+            chosen = self.weightedChoice__(waiting, n)
+        else:
+            chosen = waiting[0:n]
+
+        for client in chosen:
+            # served clients go to the end of the line
+            self.order.remove(client.ipc_index)
+            self.order.append(client.ipc_index)
+            self.scheduled[client.shmem_client] = client.frame
+            client.frame = None
+            client.served += 1
+        return chosen
+
+
+    def weightedChoice__(self, clients, n):
+        """Smooth weighted round-robin: each waiting client gains credit by its priority, chosen clients pay it back
+        """
+        if len(clients) < 1:
+            return []
+        total = 0
+        for client in clients:
+            client.credit += client.priority
+            total += client.priority
+        chosen = sorted(clients, key = lambda client: client.credit, reverse = True)[0:n]
+        for client in chosen:
+            client.credit -= total / len(chosen)
+        return chosen
+
+
+    def resetLoad__(self):
+        self.load_t0 = time.time() # start of the current load reporting interval
+        self.load_busy = 0 # time spent analyzing frames during the interval
+        self.load_frames = 0 # frames analyzed during the interval
+        self.load_cycles = 0 # cycles that had frames to analyze during the interval
+        self.load_waiting = 0 # frames waiting at the start of those cycles
+
+
+    def measureLoad__(self, n_frames, dt, n_waiting):
+        """Accumulate load & report it periodically to the frontend
+
+        Reported values:
+
+        ::
+
+            n_clients   : number of registered clients
+            queue       : mean number of frames waiting per cycle
+            t_inference : mean analysis time per frame (secs)
+            busy        : fraction of time spent analyzing frames
+            clients     : per client counters: ipc_index => {"served": int, "dropped": int}
+
+        """
+        if n_frames > 0:
+            self.load_busy += dt
+            self.load_frames += n_frames
+            self.load_cycles += 1
+            self.load_waiting += n_waiting
+        t = time.time()
+        if (t - self.load_t0) < self.load_interval:
+            return
+        if self.load_frames > 0:
+            queue = self.load_waiting / self.load_cycles
+            t_inference = self.load_busy / self.load_frames
+        else:
+            queue = 0
+            t_inference = None
+        self.send_out__(MessageObject("load",
+            n_clients   = len(self.clients),
+            queue       = queue,
+            t_inference = t_inference,
+            busy        = self.load_busy / (t - self.load_t0),
+            clients     = dict((ipc_index, {"served" : client.served, "dropped" : client.dropped})
+                for ipc_index, client in self.clients.items())
+            ))
+        self.resetLoad__()
+
+
+    def sendReply__(self, client, reply):
+        """Write a reply into the shared memory result ring of the client & signal the client through its result eventfd
+
+        A reply is None or a list having tuples (nametag, x0, x1, y0, y1) or (nametag, x0, x1, y0, y1, score) and strings.  Strings are control messages: they are sent through the pipe, but only when they change
+        """
+        if reply is None:
+            reply = []
+            flags = ResultRing.flag_none
+        else:
+            flags = 0
+        if isinstance(reply, str):
+            reply = [reply]
+        messages = [r for r in reply if isinstance(r, str)]
+        detections = [r for r in reply if not isinstance(r, str)]
+        if messages != client.messages:
+            client.pipe.send(messages)
+            client.messages = messages
+        client.results.write(
+            [d[0] for d in detections],
+            [(d[5] if len(d) > 5 else 1.0) for d in detections],
+            [d[1:5] for d in detections],
+            mstimestamp = self.mstimestamps.get(client.shmem_client, 0),
+            flags = flags
+            )
+        client.result_fd.set()
+
+
+    def pullFrame__(self, shmem_client):
+        """Get the frame the scheduler chose for a shmem client.  Returns (img, meta), (None, meta) or (None, None)
+        """
+        try:
+            img, meta = self.scheduled.pop(shmem_client)
+        except KeyError: # not scheduled: read directly
+            img, meta = self.readFrame__(shmem_client)
+        if meta is not None:
+            self.mstimestamps[shmem_client] = meta.mstimestamp
+        return img, meta
+
+
+    def handleFrame_(self, shmem_client):
+        """Receives frames from the shmem client.  Reply with results
+        """
+        img, meta = self.pullFrame__(shmem_client)
+        if img is None:
             return None
         return "kokkelis"
+
+
+    def handleBatch_(self, shmem_clients):
+        """Receives frames from several shmem clients.  Reply with a list of results, one per client
+
+        By default, handles the frames one by one.  Overwrite in child classes that can analyze several frames in one go
+        """
+        return [self.handleFrame_(shmem_client) for shmem_client in shmem_clients]
         
 
     def postActivate_(self):
@@ -356,19 +816,27 @@ class QShmemMasterProcess(QShmemProcess):
 
     # *** frontend ***
 
-    def registerClient(self, **kwargs):
+    def go(self):
+        # ipc elements allocated after forking this process would be invisible to it
+        singleton.ipc.seal()
+        super().go()
+
+
+    def registerClient(self, client_process = None, **kwargs):
         # keep the books on number of clients at frontend as well
         self.n_clients += 1
         if self.n_clients > self.max_clients:
             self.logger.warning("no more clients available: max is %s", self.max_clients)
             self.n_clients = self.max_clients
             return
+        self.client_processes[kwargs["ipc_index"]] = client_process
         self.sendMessageToBack(MessageObject(
             "registerClient", **kwargs))
         self.logger.debug("registerClient: frontend: number of clients is %s", self.n_clients)
 
 
     def unregisterClient(self, **kwargs):
+        self.client_processes.pop(kwargs["ipc_index"], None)
         self.n_clients -= 1
         if self.n_clients < 1:
             self.n_clients = 0
@@ -384,11 +852,41 @@ class QShmemMasterProcess(QShmemProcess):
         return self.n_clients < self.max_clients
 
 
+    def getLoad(self):
+        """Latest load report from the backend.  See measureLoad__
+        """
+        return self.load
+
+
+    def load_slot(self, kwargs):
+        self.load = kwargs
+        self.logger.debug("load_slot: %s", kwargs)
+
+
+    def unregistered_slot(self, kwargs):
+        # the ipc element released by the client process can now be reused
+        singleton.ipc.confirm(kwargs["ipc_index"])
+
+
+    def getClientStats(self):
+        """Per client served/dropped frame counters from the latest load report: ipc_index => {"served": int, "dropped": int}
+        """
+        return self.load.get("clients", {})
+
+
 
 class QShmemClientProcess(QShmemProcess):
     """Like QShmemProcess, but uses a common master process
+
+    In the asynchronous mode, the process does not wait for the master process to answer.  It keeps on pulling frames and uses the most recent reply from the master process.  A new frame is submitted to the master process only after the previous one has been answered or after master_timeout seconds have passed.
     """
 
+    asynchronous = False # wait for master process reply for each frame or not
+    master_timeout = 1.0 # asynchronous mode: submit a new frame after this many seconds, even if there is no reply
+    sync_timeout = 10.0 # synchronous mode: wait at most this many seconds for a reply
+    priority = 1.0 # weight of this client when the master process uses the "priority" schedule
+    max_migrations = 1 # migrations to another master process that can be in flight at once: old elements are quarantined meanwhile (see IPC)
+
     """
     def c__setMasterProcess(self, 
             ipc_index = None,
@@ -400,6 +898,7 @@ class QShmemClientProcess(QShmemProcess):
         # get shmem parameters from master process frontend
         self.ipc_index = ipc_index
         self.eventfd, self.master_pipe = singleton.ipc.get1(self.ipc_index)
+        self.result_fd, self.results = singleton.ipc.getResults(self.ipc_index)
         # self.n_buffer etc. have been set by a call to c__activate
         self.server = ShmemRGBServer(
             name            =self.shmem_name_server,
@@ -409,6 +908,7 @@ class QShmemClientProcess(QShmemProcess):
             verbose         =self.shmem_verbose
             )        
         self.server.useEventFd(self.eventfd) # activate eventfd API
+        self.resetReplies__()
         singleton.ipc.set(ipc_index)
 
 
@@ -417,6 +917,9 @@ class QShmemClientProcess(QShmemProcess):
         self.server = None
         self.master_pipe = None
         self.eventfd = None
+        self.result_fd = None
+        self.results = None
+        self.resetReplies__()
 
     # ****
 
@@ -426,10 +929,15 @@ class QShmemClientProcess(QShmemProcess):
         # parameterInitCheck(QShmemClientProcess.parameter_defs, kwargs, self)
         self.ipc_index = None # used at the frontend
         self.master_process = None
+        # bring ipc elements into the pool.  They must exist before the master process is forked.  One is in use, while
+        # the rest are spares for migrating to another master process, while the previous elements are quarantined
+        singleton.ipc.allocate(1 + self.max_migrations)
         
         
     def preRun_(self):
         self.logger.debug("preRun_")
+        self.stats = StageStats(interval = self.stats_interval)
+        self.initEpoll__()
         self.c__deactivate() # init variables
         self.c__unsetMasterProcess()
 
@@ -438,21 +946,7 @@ class QShmemClientProcess(QShmemProcess):
         """
         self.c__deactivate()
         self.c__unsetMasterProcess()
-
-        
-    def run(self):
-        self.preRun_()
-        while self.loop:
-            if self.listening:
-                self.cycle_()
-                self.readPipes__(timeout = 0) # timeout = 0 == just poll
-            else:
-                self.readPipes__(timeout = self.timeout) # timeout of 1 sec
-
-        self.postRun_()
-        # indicate front end qt thread to exit
-        self.back_pipe.send(None)
-        self.logger.debug("bye!")
+        self.epoll.close()
 
 
     def cycle_(self):
@@ -461,10 +955,13 @@ class QShmemClientProcess(QShmemProcess):
         """
         # get rgb frame from the filterchain
         index, meta = self.client.pullFrame()
+        self.stats.mark("pull")
         if (index is None):
             self.logger.debug("Client timed out..")
+            self.stats.count("timeouts")
             return
         
+        self.stats.count("frames")
         self.logger.debug("Client index, size = %s", index)
         data = self.client.shmem_list[index][0:meta.size]
         img = data.reshape(
@@ -472,24 +969,112 @@ class QShmemClientProcess(QShmemProcess):
         # forward rgb frame to master process (yolo etc.)
         self.logger.debug("cycle_: got frame %s", img.shape)
 
-        if self.server is not None:
-            self.logger.debug("cycle_ : pushing to server")
+        message, new = self.exchangeFrame__(img, meta)
+        self.stats.mark("master")
+        if new:
+            self.logger.debug("cycle_: reply from master process: %s", message)
+
+
+    def resetReplies__(self):
+        self.latest_reply = None # most recent reply from the master process
+        self.messages = [] # most recent control messages from the master process
+        self.n_pending = 0 # number of frames submitted to the master process & still unanswered
+        self.t_submit = 0 # when the last frame was submitted to the master process
+        if self.results is None:
+            self.last_seq = 0
+        else: # skip results left in the ring by a previous user
+            self.last_seq = self.results.getSeq()
+
+
+    def readResults__(self, timeout):
+        """Wait at most timeout seconds for new results from the master process
+
+        Returns True if there were new results (they are in self.latest_reply), False if the master process answered by dropping the frame(s) and None if there was no answer
+        """
+        fd = self.result_fd.getFd()
+        rlis, wlis, elis = safe_select([fd], [], [], timeout = timeout)
+        if fd not in rlis:
+            return None
+        self.result_fd.clear()
+        while self.master_pipe.poll(): # control messages are sent prior to the results
+            self.messages = self.master_pipe.recv()
+        res = self.results.read(self.last_seq, skip_flags = ResultRing.flag_dropped)
+        if res is None:
+            return None
+        seq, mstimestamp, flags, records = res
+        self.n_pending = max(0, self.n_pending - (seq - self.last_seq))
+        self.last_seq = seq
+        if flags & ResultRing.flag_dropped: # keep the previous results
+            return False
+        if flags & ResultRing.flag_none:
+            self.latest_reply = None
+        else:
+            self.latest_reply = Reply(
+                seq         = seq,
+                mstimestamp = mstimestamp,
+                records     = records,
+                tags        = [self.results.label(class_id) for class_id in records["class_id"]],
+                messages    = self.messages
+                )
+        return True
+
+
+    def exchangeFrame__(self, img, meta):
+        """Forward a frame to the master process and receive results
+
+        Returns a tuple (reply, new), where reply is the most recent Reply from the master process (or None) and new tells if it was received during this call
+        """
+        if self.server is None:
+            return None, False
+
+        if not self.asynchronous:
+            self.logger.debug("exchangeFrame__ : pushing to server")
             self.server.pushFrame(
                 img,
                 meta.slot,
                 meta.mstimestamp
             )
             # receive results from master process
-            message = self.master_pipe.recv()
-            print("reply from master process:", message)
+            new = self.readResults__(self.sync_timeout)
+            if new is None:
+                # master process might have unregistered us, i.e. during a migration
+                self.logger.warning("exchangeFrame__ : no reply from master process")
+                return self.latest_reply, False
+            return self.latest_reply, new
+
+        new = bool(self.readResults__(0)) # collect results without blocking
+
+        t = time.time()
+        if (self.n_pending < 1) or ((t - self.t_submit) >= self.master_timeout):
+            if self.n_pending > 0:
+                self.logger.debug("exchangeFrame__ : master process deadline passed")
+            self.logger.debug("exchangeFrame__ : pushing to server")
+            self.server.pushFrame(
+                img,
+                meta.slot,
+                meta.mstimestamp
+            )
+            # a frame past its deadline is not waited for anymore
+            self.n_pending = 1
+            self.t_submit = t
+
+        return self.latest_reply, new
 
 
     # *** frontend ***
 
     def setMasterProcess(self, master_process = None):
+        """Start using master_process.  Returns False if there was no free ipc element (see IPC.reserve)
+        """
         # ipc_index, n_buffer, image_dimensions, shmem_name # TODO
+        if self.master_process is not None: # don't leak the previous reservation
+            self.unsetMasterProcess()
+        try:
+            self.ipc_index = singleton.ipc.reserve(owner = self)
+        except IndexError:
+            self.logger.error("setMasterProcess: no free ipc elements: can't use master process %s", master_process)
+            return False
         self.master_process = master_process
-        self.ipc_index = singleton.ipc.reserve()
 
         # first, create the server
         self.sendMessageToBack(MessageObject(
@@ -499,12 +1084,21 @@ class QShmemClientProcess(QShmemProcess):
         # this will create the client:
         # self.n_buffer etc. have been set by call to self.activate
         master_process.registerClient(
+            client_process = self,
             ipc_index = self.ipc_index,
+            priority = self.priority,
             n_buffer = self.n_buffer,
             image_dimensions = self.image_dimensions,
             shmem_name = self.shmem_name_server)
+        return True
         
 
+    def canMigrate(self):
+        """Is there a free ipc element for moving to another master process?  See IPC.available
+        """
+        return singleton.ipc.available()
+
+
     def unsetMasterProcess(self): # , master_process):
         if self.master_process is None:
             self.logger.warning("unsetMasterProcess: none set")
@@ -541,20 +1135,59 @@ class QShmemClientProcess(QShmemProcess):
     """
 
 
-class MVisionBaseProcess(QShmemProcess):
+def previewInterval(overlay_interval, budget):
+    """Min interval (secs) between preview frames: overlay_interval or longer if the preview budget (fps, width, height) asks for less frames
+    """
+    fps = budget[0]
+    if fps > 0:
+        return max(overlay_interval, 1.0 / fps)
+    return overlay_interval
 
-    class Signals(QtCore.QObject):
-        pong = QtCore.Signal(object) # demo outgoing signal
-        shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
 
+def previewShape(shape, budget):
+    """Shape of a preview frame: image shape downscaled to fit into the width & height of the preview budget, keeping the aspect ratio.  Never upscales
+    """
+    width, height = budget[1], budget[2]
+    if (width < 1) or (height < 1):
+        return shape
+    scale = min(width / shape[1], height / shape[0], 1.0)
+    return (max(1, int(shape[0] * scale)), max(1, int(shape[1] * scale))) + tuple(shape[2:])
+
+
+def previewCopy(img, out):
+    """Copy img into out, downscaling it if out is smaller
+    """
+    if out.shape == img.shape:
+        numpy.copyto(out, img)
+    elif cv2 is not None:
+        cv2.resize(img, (out.shape[1], out.shape[0]), dst = out, interpolation = cv2.INTER_LINEAR)
+    else: # nearest neighbour
+        rows = numpy.arange(out.shape[0]) * img.shape[0] // out.shape[0]
+        cols = numpy.arange(out.shape[1]) * img.shape[1] // out.shape[1]
+        out[:] = img[rows[:, None], cols]
+
+
+
+class MVisionMixin:
+    """Preview frames & recording triggers, common to MVisionBaseProcess & MVisionClientBaseProcess
+
+    Put it before the QShmemProcess class in the bases
+    """
+
+    overlay_interval = 0.1 # max rate of preview frames (secs between frames)
+    record_hold = 5.0 # keep the recording gate open this many secs after the trigger is gone (see triggerRecording__)
 
     def __init__(self, **kwargs):
-        self.parameters = None
-        self.qt_server = None
+        self.overlay = None # reusable buffer for drawing overlays, see getOverlay__
+        self.t_overlay = 0 # when the last preview frame was pushed
+        self.preview_budget = (0, 0, 0) # fps, width, height requested by the analyzer widget, see c__setPreviewBudget
+        self.qt_server_shape = None # shape of the frames in the preview shmem server, see openQtServer__
+        self.recording = False # is the recording gate open, see triggerRecording__
+        self.t_record = None # when the recording was last triggered
         super().__init__(**kwargs)
 
 
-    # *** common back-end methods for machine vision processes ***
+    # *** back-end ***
 
     def c__updateAnalyzerParameters(self, **kwargs):
         self.logger.debug("got analyzer parameters %s", kwargs)
@@ -564,22 +1197,7 @@ class MVisionBaseProcess(QShmemProcess):
     def c__requestQtShmemServer(self, **kwargs):
         self.logger.debug("shmem server requested")
         # should be called only after the shmem client has been instantiated
-        self.shmem_name_qt_server = self.shmem_name + "_qt_server"
-        self.qt_server = ShmemRGBServer(
-            name            =self.shmem_name_qt_server,
-            n_ringbuffer    =self.n_buffer,   # size of ring buffer
-            width           =self.image_dimensions[0],
-            height          =self.image_dimensions[1],
-            verbose         =self.shmem_verbose
-            )
-        # inform frontend & widgets that the shmem server is available:
-        self.send_out__(MessageObject("shmem_server",  # this is routed to the qt signal with the same name
-            shmem_name      =self.shmem_name_qt_server, 
-            shmem_n_buffer  =self.n_buffer, 
-            width           =self.image_dimensions[0],
-            height          =self.image_dimensions[1],
-            verbose         =self.shmem_verbose
-        ))
+        self.openQtServer__()
 
 
     def c__releaseQtShmemServer(self, **kwargs):
@@ -587,6 +1205,13 @@ class MVisionBaseProcess(QShmemProcess):
         self.qt_server = None
 
 
+    def c__setPreviewBudget(self, fps = 0, width = 0, height = 0):
+        """Push preview frames at most fps times per second, downscaled to fit into width x height.  Zero means no limit
+        """
+        self.logger.debug("preview budget: %s fps, %s x %s", fps, width, height)
+        self.setPreviewBudget__((fps, width, height))
+
+
     def postActivate_(self):
         """Whatever you need to do after creating the shmem client:
 
@@ -598,39 +1223,154 @@ class MVisionBaseProcess(QShmemProcess):
         """Whatever you need to do prior to deactivating the shmem client
         """
         self.qt_server = None
-        pass
+        self.closeRecording__()
 
 
-    # *** common frontend methods for machine vision processes ***
+    def openQtServer__(self, owner = None):
+        """Create the preview shmem server (qt_server) & inform the frontend & widgets
 
-    def connectAnalyzerWidget(self, analyzer_widget):
-        analyzer_widget.video.signals.update_analyzer_parameters.connect(
-            self.updateAnalyzerParameters)
-        # print("connectAnalyzerWidget: signals:", self.signals)
-        self.signals.shmem_server.connect(
-            analyzer_widget.setShmem_slot
-        )
-        analyzer_widget.signals.show.connect(
-            self.requestQtShmemServer
-        )
-        analyzer_widget.signals.close.connect(
-            self.releaseQtShmemServer
-        )
-        
-    def disconnectAnalyzerWidget(self, analyzer_widget):
-        analyzer_widget.video.signals.update_analyzer_parameters.disconnect(
-            self.updateAnalyzerParameters)
-        self.signals.shmem_server.disconnect(
-            analyzer_widget.setShmem_slot
-        )
-        analyzer_widget.signals.show.disconnect(
-            self.requestQtShmemServer
-        )
-        analyzer_widget.signals.close.disconnect(
-            self.releaseQtShmemServer
-        )
+        The frames of the server are sized for the preview budget (see previewShape), not for the full image.  owner is self (default) or a stream
+        """
+        if owner is None:
+            owner = self
+        width, height = owner.image_dimensions[0], owner.image_dimensions[1]
+        owner.qt_server_shape = previewShape((height, width, 3), owner.preview_budget)
+        shmem_name = owner.shmem_name + "_qt_server"
+        owner.qt_server = None # the old server, if any, is removed before a new one with the same name is created
+        owner.qt_server = ShmemRGBServer(
+            name            =shmem_name,
+            n_ringbuffer    =owner.n_buffer,   # size of ring buffer
+            width           =owner.qt_server_shape[1],
+            height          =owner.qt_server_shape[0],
+            verbose         =self.shmem_verbose
+            )
+        kwargs = {
+            "shmem_name"     : shmem_name,
+            "shmem_n_buffer" : owner.n_buffer,
+            "width"          : owner.qt_server_shape[1],
+            "height"         : owner.qt_server_shape[0],
+            "verbose"        : self.shmem_verbose
+        }
+        # this is routed to the qt signal with the same name
+        if owner is self:
+            self.send_out__(MessageObject("shmem_server", **kwargs))
+        else:
+            self.send_out__(MessageObject("shmem_server", slot = owner.slot, **kwargs))
+
+
+    def setPreviewBudget__(self, budget, owner = None):
+        """Set the preview budget (fps, width, height).  If the preview frames don't fit into the preview shmem server anymore, it is created anew
+        """
+        if owner is None:
+            owner = self
+        owner.preview_budget = budget
+        if owner.qt_server is None:
+            return
+        width, height = owner.image_dimensions[0], owner.image_dimensions[1]
+        shape = previewShape((height, width, 3), budget)
+        if (shape[0] > owner.qt_server_shape[0]) or (shape[1] > owner.qt_server_shape[1]):
+            self.logger.debug("setPreviewBudget__ : preview server grows to %s", shape)
+            self.openQtServer__(owner)
 
 
+    def previewDue__(self, owner = None):
+        """Should a frame be pushed to the preview shmem server (qt_server) now?
+
+        True if owner has a preview server & no frame has been pushed to it during the last overlay_interval seconds (or during a longer interval set by the preview budget).  owner is the object having the preview server: self (default) or a stream
+        """
+        if owner is None:
+            owner = self
+        if owner.qt_server is None:
+            return False
+        t = time.time()
+        if (t - owner.t_overlay) < previewInterval(self.overlay_interval, owner.preview_budget):
+            return False
+        owner.t_overlay = t
+        return True
+
+
+    def getOverlay__(self, img, owner = None):
+        """Returns a copy of img for drawing overlays on or None if no preview frame is due (see previewDue__)
+
+        The copy is downscaled to the size of the analyzer widget (see c__setPreviewBudget) & made into a buffer that is reused as long as the dimensions stay the same.  Draw overlays in the coordinates of the copy
+        """
+        if owner is None:
+            owner = self
+        if not self.previewDue__(owner):
+            return None
+        shape = previewShape(img.shape, owner.preview_budget)
+        if (shape[0] > owner.qt_server_shape[0]) or (shape[1] > owner.qt_server_shape[1]): # must fit into the preview server
+            shape = previewShape(img.shape, (0, owner.qt_server_shape[1], owner.qt_server_shape[0]))
+        if (owner.overlay is None) or (owner.overlay.shape != shape):
+            owner.overlay = numpy.empty(shape, dtype = img.dtype)
+        previewCopy(img, owner.overlay)
+        return owner.overlay
+
+
+    def triggerRecording__(self, active, owner = None):
+        """Call for each analyzed frame: active tells if the frame should be recorded (i.e. "a person is present")
+
+        The "recording" signal is sent when the gate should open & when it should close, i.e. record_hold seconds after the last active frame.  The frontend relays it to the filterchain of the stream (see MultiForkFilterchain.openRecordingGate).  owner is self (default) or a stream
+        """
+        if owner is None:
+            owner = self
+        t = time.time()
+        if active:
+            owner.t_record = t
+        recording = (owner.t_record is not None) and ((t - owner.t_record) < self.record_hold)
+        if recording != owner.recording:
+            self.logger.debug("triggerRecording__ : recording %s", recording)
+            self.sendRecording__(recording, owner)
+
+
+    def sendRecording__(self, recording, owner = None):
+        if owner is None:
+            owner = self
+        owner.recording = recording
+        if owner is self:
+            self.send_out__(MessageObject("recording", recording = recording))
+        else:
+            self.send_out__(MessageObject("recording", slot = owner.slot, recording = recording))
+
+
+    def closeRecording__(self, owner = None):
+        """Close the recording gate, i.e. at deactivation
+        """
+        if owner is None:
+            owner = self
+        if owner.recording: # don't leave the gate open
+            self.sendRecording__(False, owner)
+        owner.t_record = None
+
+
+    def recordingOwners__(self):
+        """Objects having a recording gate: self or the streams (see MVisionMultiBaseProcess)
+        """
+        return [self]
+
+
+    def pollTimeout__(self):
+        """While a recording gate is open, wake up when its hold time ends, even if no frames arrive
+        """
+        t = time.time()
+        timeout = -1
+        for owner in self.recordingOwners__():
+            if owner.recording and (owner.t_record is not None):
+                # a bit of slack, so that the gate is surely due at checkTimers__
+                dt = max(0, owner.t_record + self.record_hold - t) + 0.01
+                timeout = dt if timeout < 0 else min(timeout, dt)
+        return timeout
+
+
+    def checkTimers__(self):
+        """Close the recording gates whose hold time has passed, even if the stream has stopped sending frames
+        """
+        for owner in self.recordingOwners__():
+            if owner.recording:
+                self.triggerRecording__(False, owner)
+
+
+    # *** frontend ***
 
     # *** create a widget for this machine vision module ***
     def getWidget(self):
@@ -665,68 +1405,6 @@ class MVisionBaseProcess(QShmemProcess):
         self.sendMessageToBack(MessageObject(
             "releaseQtShmemServer", **kwargs))
 
-
-
-
-
-class MVisionClientBaseProcess(QShmemClientProcess):
-
-    class Signals(QtCore.QObject):
-        pong = QtCore.Signal(object) # demo outgoing signal
-        shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
-
-    def __init__(self, **kwargs):
-        self.parameters = {}
-        self.qt_server = None
-        super().__init__(**kwargs)
-
-    # *** common back-end methods for machine vision processes ***
-
-    def c__updateAnalyzerParameters(self, **kwargs):
-        self.logger.debug("Movement mvision: got analyzer parameters %s", kwargs)
-        self.parameters = kwargs # update parameters at the backend
-
-
-    def c__requestQtShmemServer(self, **kwargs):
-        self.logger.debug("shmem server requested")
-        # should be called only after the shmem client has been instantiated
-        self.shmem_name_qt_server = self.shmem_name + "_qt_server"
-        self.qt_server = ShmemRGBServer(
-            name            =self.shmem_name_qt_server,
-            n_ringbuffer    =self.n_buffer,   # size of ring buffer
-            width           =self.image_dimensions[0],
-            height          =self.image_dimensions[1],
-            verbose         =self.shmem_verbose
-            )
-        # inform frontend & widgets that the shmem server is available:
-        self.send_out__(MessageObject("shmem_server",  # this is routed to the qt signal with the same name
-            shmem_name      =self.shmem_name_qt_server, 
-            shmem_n_buffer  =self.n_buffer, 
-            width           =self.image_dimensions[0],
-            height          =self.image_dimensions[1],
-            verbose         =self.shmem_verbose
-        ))
-
-
-    def c__releaseQtShmemServer(self, **kwargs):
-        self.logger.debug("shmem server released")
-        self.qt_server = None
-
-
-    def postActivate_(self):
-        """Whatever you need to do after creating the shmem client:
-
-        - Create a shmem server for visualizing the machine vision process
-        """
-        pass
-
-    def preDeactivate_(self):
-        """Whatever you need to do prior to deactivating the shmem client
-        """
-        self.qt_server = None
-        pass
-
-    
     def connectAnalyzerWidget(self, analyzer_widget):
         analyzer_widget.video.signals.update_analyzer_parameters.connect(
             self.updateAnalyzerParameters)
@@ -737,6 +1415,9 @@ class MVisionClientBaseProcess(QShmemClientProcess):
         analyzer_widget.signals.show.connect(
             self.requestQtShmemServer
         )
+        analyzer_widget.signals.preview.connect(
+            self.setPreviewBudget
+        )
         analyzer_widget.signals.close.connect(
             self.releaseQtShmemServer
         )
@@ -750,47 +1431,382 @@ class MVisionClientBaseProcess(QShmemClientProcess):
         analyzer_widget.signals.show.disconnect(
             self.requestQtShmemServer
         )
+        analyzer_widget.signals.preview.disconnect(
+            self.setPreviewBudget
+        )
         analyzer_widget.signals.close.disconnect(
             self.releaseQtShmemServer
         )
-        
 
-    # *** common frontend methods for machine vision processes ***
 
+    def setPreviewBudget(self, kwargs):
+        self.sendMessageToBack(MessageObject(
+            "setPreviewBudget", **kwargs))
 
-    # *** create a widget for this machine vision module ***
-    def getWidget(self):
-        """Some ideas for your widget:
-        - Textual information (alert, license place number)
-        - Check boxes : if checked, send e-mail to your mom when the analyzer spots something
-        - .. or send an sms to yourself
-        - You can include the cv2.imshow window to the widget to see how the analyzer proceeds
-        """
-        widget = QtWidgets.QLabel("nada de nada")
-        # widget.setStyleSheet(style.detector_test)
-        #self.signals.start_move.connect(lambda : widget.setText("MOVEMENT START"))
-        #self.signals.stop_move. connect(lambda : widget.setText("MOVEMENT STOP"))
-        return widget
 
 
-    def updateAnalyzerParameters(self, kwargs):
-        self.parameters = kwargs
-        self.logger.debug("updateAnalyzerParameters %s", kwargs)
-        self.sendMessageToBack(MessageObject(
-            "updateAnalyzerParameters", **kwargs))
+class MVisionBaseProcess(MVisionMixin, QShmemProcess):
+
+    class Signals(QtCore.QObject):
+        pong = QtCore.Signal(object) # demo outgoing signal
+        stats = QtCore.Signal(object) # periodic report of stage timings, see StageStats.report
+        shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
+        recording = QtCore.Signal(object) # open / close the recording gate of the stream, see triggerRecording__
+
+
+    def __init__(self, **kwargs):
+        self.parameters = None
+        self.qt_server = None
+        super().__init__(**kwargs)
+
+
+
+class MVisionStream:
+    """Frontend handle of one stream of a multi-stream process (see MVisionMultiBaseProcess)
+
+    Has the same frontend methods as a single-stream machine vision process, so containers can use it in place of a process.  Other attributes (name, tag, analyzer_video_widget_class, etc.) are those of the process.
+
+    Signals of the stream are emitted only for messages carrying the slot of this stream
+    """
+
+    def __init__(self, process, slot):
+        self.process = process
+        self.slot = slot
+        self.signals = process.StreamSignals()
+        self.parameters = None
+        self.listeners = {} # (command, callback) => callback filtering the messages of this stream, see listen
+
+    def __getattr__(self, name):
+        return getattr(self.process, name)
+
+    def __str__(self):
+        return "<MVisionStream %s of %s>" % (self.slot, self.process)
+
+    def getEventFd(self):
+        return self.process.event_fds[self.slot]
+
+    def activate(self, **kwargs):
+        kwargs["use_event_fd"] = True # streams are always signaled through eventfds
+        self.process.sendMessageToBack(MessageObject(
+            "activate", slot = self.slot, **kwargs))
+
+    def deactivate(self):
+        self.process.sendMessageToBack(MessageObject(
+            "deactivate", slot = self.slot))
+
+    def listen(self, command, callback):
+        """As QMultiProcess.listen, but only for the messages of this stream
+        """
+        def filtered(kwargs):
+            if kwargs.get("slot", None) == self.slot:
+                kwargs = dict(kwargs)
+                kwargs.pop("slot")
+                callback(kwargs)
+        self.listeners[(command, callback)] = filtered
+        self.process.listen(command, filtered)
+
+    def unlisten(self, command, callback):
+        filtered = self.listeners.pop((command, callback), None)
+        if filtered is not None:
+            self.process.unlisten(command, filtered)
+
+    # same wiring as in a process, but with the signals & methods of the stream
+    connectAnalyzerWidget = MVisionMixin.connectAnalyzerWidget
+    disconnectAnalyzerWidget = MVisionMixin.disconnectAnalyzerWidget
+
+    def getWidget(self):
+        return self.process.getStreamWidget(self)
 
     def getAnalyzerParameters(self):
         return self.parameters
 
+    def updateAnalyzerParameters(self, kwargs):
+        self.parameters = kwargs
+        self.process.sendMessageToBack(MessageObject(
+            "updateAnalyzerParameters", slot = self.slot, parameters = kwargs))
+
     def requestQtShmemServer(self):
-        kwargs = {}
-        self.sendMessageToBack(MessageObject(
-            "requestQtShmemServer", **kwargs))
+        self.process.sendMessageToBack(MessageObject(
+            "requestQtShmemServer", slot = self.slot))
 
     def releaseQtShmemServer(self):
-        kwargs = {}
-        self.sendMessageToBack(MessageObject(
-            "releaseQtShmemServer", **kwargs))
+        self.process.sendMessageToBack(MessageObject(
+            "releaseQtShmemServer", slot = self.slot))
+
+    def setPreviewBudget(self, kwargs):
+        self.process.sendMessageToBack(MessageObject(
+            "setPreviewBudget", slot = self.slot, **kwargs))
+
+
+
+class MVisionMultiBaseProcess(MVisionBaseProcess):
+    """A machine vision process that analyzes up to max_streams streams, each one having its own shmem client & analyzer state
+
+    Meant for cheap analyzers: a handful of processes can serve dozens of cameras.
+
+    Streams are identified by their slot (0 .. max_streams-1) in the process.  At the frontend, a stream is opened with openStream, that returns a MVisionStream handle.  Containers use the handle as if it was a process.  The shmem servers must signal new frames through the eventfd of the stream (MVisionStream.getEventFd), so that the backend can wait for all streams with epoll.
+
+    Outgoing messages carry the slot.  Signals declares them with an object argument at the process, while StreamSignals declares them as seen by the stream handles.  Subclasses implement the backend hooks postActivateSlot_, preDeactivateSlot_ and cycleSlot_
+    """
+
+    max_streams = 8 # how many streams a process can analyze
+
+    class Signals(QtCore.QObject):
+        pong = QtCore.Signal(object) # demo outgoing signal
+        stats = QtCore.Signal(object) # periodic report of stage timings, see StageStats.report
+        shmem_server = QtCore.Signal(object) # a stream has established a shared mem server for visualization.  Carries the slot
+        recording = QtCore.Signal(object) # open / close the recording gate of a stream.  Carries the slot
+
+    class StreamSignals(QtCore.QObject):
+        shmem_server = QtCore.Signal(object) # launched when the stream has established a shared mem server
+        recording = QtCore.Signal(object) # see triggerRecording__
+
+
+    class Slot:
+        """Backend state of a stream
+        """
+        def __init__(self, slot = None, client = None, fd = None, shmem_name = None, n_buffer = None, image_dimensions = None):
+            self.slot = slot
+            self.client = client
+            self.fd = fd
+            self.shmem_name = shmem_name
+            self.n_buffer = n_buffer
+            self.image_dimensions = image_dimensions
+            self.parameters = None
+            self.qt_server = None
+            self.overlay = None # see getOverlay__
+            self.t_overlay = 0
+            self.preview_budget = (0, 0, 0) # see c__setPreviewBudget
+            self.qt_server_shape = None # see openQtServer__
+            self.recording = False # see triggerRecording__
+            self.t_record = None
+            self.analyzer = None # set in postActivateSlot_
+
+
+    # *** backend ***
+
+    def c__activate(self,
+        slot:int = None,
+        n_buffer:int = None,
+        image_dimensions:tuple = None,
+        shmem_name:str = None,
+        use_event_fd:bool = True):
+
+        self.logger.debug("c__activate: slot %s", slot)
+        if slot in self.slots: # activated again
+            self.c__deactivate(slot = slot)
+        client = ShmemRGBClient(
+            name            =shmem_name,
+            n_ringbuffer    =n_buffer,   # size of ring buffer
+            width           =image_dimensions[0],
+            height          =image_dimensions[1],
+            mstimeout       =int(self.timeout*1000),
+            verbose         =self.shmem_verbose
+            )
+        event_fd = self.event_fds[slot]
+        client.useEventFd(event_fd)
+        fd = event_fd.getFd()
+        self.epoll.register(fd, select.EPOLLIN)
+        self.slots[slot] = self.Slot(
+            slot = slot,
+            client = client,
+            fd = fd,
+            shmem_name = shmem_name,
+            n_buffer = n_buffer,
+            image_dimensions = image_dimensions
+            )
+        self.slots_by_fd[fd] = slot
+        self.listening = True
+        self.postActivateSlot_(self.slots[slot])
+
+
+    def c__deactivate(self, slot = None):
+        """Deactivate a stream.  Slot None deactivates all streams
+        """
+        if slot is None:
+            for slot in list(self.slots.keys()):
+                self.c__deactivate(slot = slot)
+            return
+        try:
+            stream = self.slots.pop(slot)
+        except KeyError:
+            return
+        self.logger.debug("c__deactivate: slot %s", slot)
+        self.preDeactivateSlot_(stream)
+        self.epoll.unregister(stream.fd)
+        self.slots_by_fd.pop(stream.fd)
+        self.listening = len(self.slots) > 0
+
+
+    def c__updateAnalyzerParameters(self, slot = None, parameters = None):
+        self.logger.debug("slot %s got analyzer parameters %s", slot, parameters)
+        if slot in self.slots:
+            self.slots[slot].parameters = parameters
+
+
+    def c__requestQtShmemServer(self, slot = None):
+        stream = self.slots.get(slot, None)
+        if stream is None:
+            return
+        self.logger.debug("shmem server requested for slot %s", slot)
+        self.openQtServer__(stream)
+
+
+    def c__releaseQtShmemServer(self, slot = None):
+        self.logger.debug("shmem server released for slot %s", slot)
+        if slot in self.slots:
+            self.slots[slot].qt_server = None
+
+
+    def c__setPreviewBudget(self, slot = None, fps = 0, width = 0, height = 0):
+        if slot in self.slots:
+            self.setPreviewBudget__((fps, width, height), self.slots[slot])
+
+
+    def preRun_(self):
+        self.slots = {} # slot => Slot
+        self.slots_by_fd = {} # eventfd => slot
+        super().preRun_()
+
+
+    def initEpoll__(self):
+        super().initEpoll__()
+        self.event_driven = True # all streams use eventfds
+
+
+    def waitEvents__(self):
+        """Sleep until there is a new frame in any of the streams, a command or a timer is due (see pollTimeout__)
+        """
+        self.stats.begin()
+        events = self.epoll.poll(self.pollTimeout__())
+        self.stats.mark("wait")
+        for fd, mask in events:
+            if fd == self.back_pipe.fileno():
+                self.readPipes__(timeout = 0)
+                continue
+            slot = self.slots_by_fd.get(fd, None)
+            if slot is not None:
+                self.stats.begin()
+                self.cycleSlot_(self.slots[slot])
+        self.checkTimers__()
+
+
+    def recordingOwners__(self):
+        return list(self.slots.values())
+
+
+    def sendSlot__(self, slot, command, **kwargs):
+        """Send a message carrying the slot to the frontend
+        """
+        self.send_out__(MessageObject(command, slot = slot, **kwargs))
+
+
+    def pullFrame__(self, stream):
+        """Pull a frame from the shmem client of a stream.  Returns (img, meta) or (None, meta)
+        """
+        index, meta = stream.client.pullFrame()
+        self.stats.mark("pull")
+        if (index is None) or (meta.size < 1):
+            return None, meta
+        self.stats.count("frames")
+        data = stream.client.shmem_list[index][0:meta.size]
+        img = data.reshape(
+            (meta.height, meta.width, 3))
+        return img, meta
+
+
+    def postActivateSlot_(self, stream):
+        """A stream was activated: create the analyzer etc.  Overwrite in child classes
+        """
+        pass
+
+
+    def preDeactivateSlot_(self, stream):
+        """A stream is about to be deactivated: release analyzer resources etc.  Overwrite in child classes
+        """
+        stream.qt_server = None
+        self.closeRecording__(stream)
+
+
+    def cycleSlot_(self, stream):
+        """There is a new frame in a stream.  Overwrite in child classes
+        """
+        img, meta = self.pullFrame__(stream)
+        if img is not None:
+            self.logger.debug("cycleSlot_: slot %s got frame %s", stream.slot, img.shape)
+
+
+    # *** frontend ***
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # created before forking, so that both the frontend & backend have them
+        self.event_fds = [core.EventFd() for i in range(self.max_streams)]
+        self.streams = {} # slot => MVisionStream
+        # route slot-carrying signals to the stream handles
+        for name in dir(self.StreamSignals):
+            if isinstance(getattr(self.StreamSignals, name), QtCore.Signal):
+                getattr(self.signals, name).connect(self.makeRouter__(name))
+
+
+    def makeRouter__(self, name):
+        def route(kwargs):
+            kwargs = dict(kwargs)
+            stream = self.streams.get(kwargs.pop("slot"), None)
+            if stream is None: # closed meanwhile
+                return
+            signal = getattr(stream.signals, name)
+            if len(kwargs) < 1:
+                signal.emit()
+            else:
+                signal.emit(kwargs)
+        return route
+
+
+    def frontendFds(self):
+        return super().frontendFds() + [event_fd.getFd() for event_fd in self.event_fds]
+
+
+    def freeStreams(self):
+        return self.max_streams - len(self.streams)
+
+
+    def openStream(self):
+        """Returns a MVisionStream handle or None if all slots are in use
+        """
+        for slot in range(self.max_streams):
+            if slot not in self.streams:
+                stream = MVisionStream(self, slot)
+                self.streams[slot] = stream
+                return stream
+        return None
+
+
+    def closeStream(self, stream):
+        self.streams.pop(stream.slot, None)
+
+
+    def getStreamWidget(self, stream):
+        """A widget for a stream.  Overwrite in child classes
+        """
+        return QtWidgets.QLabel("nada de nada")
+
+
+
+class MVisionClientBaseProcess(MVisionMixin, QShmemClientProcess):
+
+    class Signals(QtCore.QObject):
+        pong = QtCore.Signal(object) # demo outgoing signal
+        stats = QtCore.Signal(object) # periodic report of stage timings, see StageStats.report
+        shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
+        recording = QtCore.Signal(object) # open / close the recording gate of the stream, see triggerRecording__
+
+
+    def __init__(self, **kwargs):
+        self.parameters = {}
+        self.qt_server = None
+        super().__init__(**kwargs)
+
 
 
 
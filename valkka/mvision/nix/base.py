@@ -22,6 +22,11 @@ from PySide2 import QtWidgets, QtCore, QtGui
 import sys
 import time
 import os
+import mmap
+import struct
+import select
+import subprocess
+import collections
 import numpy
 import imutils
 import importlib
@@ -38,8 +43,100 @@ from valkka.mvision.tools import getModulePath
 from valkka.mvision import constant
 
 
+message_header = struct.Struct("<cI")
+
+
+def writeMessage(stream, kind, payload = b""):
+    """Write a message of the "shm" protocol (see FrameRing)
+    """
+    stream.write(message_header.pack(kind, len(payload)) + payload)
+    stream.flush()
+
+
+class FrameRing:
+    """Writes frames into a ring of slots in a shared memory file, for the binary protocol with an external program ("shm" protocol of ExternalDetector)
+
+    The processes exchange length-prefixed messages through the stdin & stdout of the external program.  All integers are little-endian.
+
+    Shared memory file:
+
+    ::
+
+        header (64 bytes) : magic "VKFR", version (uint32), dtype (4 bytes, numpy dtype string, e.g. "|u1"), n_slots, height, width, channels (uint32), slot size in bytes (uint64)
+        n_slots slots     : slot header (16 bytes): sequence number (uint64), height, width (uint32) + frame data (C-order, height x width x channels)
+
+    Messages: kind (1 byte) + payload length (uint32) + payload
+
+    ::
+
+        to external program   : "R" new frame, payload: sequence number (uint64), slot (uint32)
+                                "T" reset state, "X" exit: no payload
+        from external program : "C" done, no results: no payload
+                                "D" done, payload: the (utf-8 text) results of the analysis
+
+    The external program answers each "R" and "T" with a "C" or "D" message
+    """
+
+    magic = b"VKFR"
+    version = 1
+    header = struct.Struct("<4sI4sIIIIQ")
+    header_size = 64
+    slot_header = struct.Struct("<QII")
+
+    parameter_defs = {
+        "filename"          : str,
+        "n_slots"           : (int, 2),
+        "image_dimensions"  : tuple,        # width, height
+        "channels"          : (int, 3),
+        "dtype"             : (str, "|u1")
+    }
+
+    def __init__(self, **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.frame_size = self.image_dimensions[0] * self.image_dimensions[1] * self.channels * numpy.dtype(self.dtype).itemsize
+        self.slot_size = self.slot_header.size + self.frame_size
+        size = self.header_size + self.n_slots * self.slot_size
+        with open(self.filename, "wb") as f:
+            f.truncate(size)
+        with open(self.filename, "r+b") as f:
+            self.mm = mmap.mmap(f.fileno(), size)
+        self.header.pack_into(self.mm, 0,
+            self.magic, self.version, self.dtype.encode("ascii"), self.n_slots,
+            self.image_dimensions[1], self.image_dimensions[0], self.channels, self.slot_size)
+        self.slots = [
+            numpy.frombuffer(self.mm, dtype = self.dtype, count = self.frame_size // numpy.dtype(self.dtype).itemsize,
+                offset = self.header_size + i * self.slot_size + self.slot_header.size)
+            for i in range(self.n_slots)
+        ]
+
+
+    def write(self, img, seq, slot = None):
+        """Copy img into a slot & tag it with sequence number seq.  By default, the slot is seq modulo n_slots.  Returns the slot
+        """
+        if slot is None:
+            slot = seq % self.n_slots
+        n = img.size
+        if n > len(self.slots[slot]):
+            raise(AssertionError("frame %s does not fit into the shmem ring" % str(img.shape)))
+        self.slots[slot][0:n].reshape(img.shape)[:] = img
+        self.slot_header.pack_into(self.mm, self.header_size + slot * self.slot_size, seq, img.shape[0], img.shape[1])
+        return slot
+
+
+    def close(self):
+        self.slots = []
+        self.mm.close()
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+
 class ExternalDetector(Analyzer):
     """A demo analyzer, using an external program
+
+    With protocol "text", frames are dumped into tmpfile & the processes exchange text lines.  With protocol "shm", frames are written into a shared memory ring (tmpfile is its filename) & the processes exchange binary messages (see FrameRing).  The "shm" program is run by an ExternalWorker, having one frame in flight at a time
     """
 
     parameter_defs = {
@@ -47,7 +144,9 @@ class ExternalDetector(Analyzer):
         "debug":            (bool, False),
         "executable":       str,
         "image_dimensions": (tuple, (1920 // 4, 1080 // 4)),
-        "tmpfile":          str
+        "tmpfile":          str,
+        "protocol":         (str, "text"),  # "text" or "shm"
+        "n_slots":          (int, 2)        # size of the shared memory ring with the "shm" protocol
     }
 
     def __init__(self, **kwargs):
@@ -69,8 +168,14 @@ class ExternalDetector(Analyzer):
         
         comlist = self.executable.split() + [width, height, self.tmpfile] # e.g. "python3", "example_process1.py", etc.
         
+        self.seq = 0
+        self.worker = None
         try:
-            self.p = subprocess.Popen(comlist, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+            if (self.protocol == "shm"): # the external program & the shared memory ring are handled by an ExternalWorker
+                self.worker = ExternalWorker(self.executable, self.image_dimensions, self.tmpfile, self.n_slots, self.logger)
+                self.p = self.worker.p
+            else:
+                self.p = subprocess.Popen(comlist, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
         except Exception as e:
             print(self.pre, "Could not open external process.  Failed with '"+str(e)+"'")
             return
@@ -82,22 +187,49 @@ class ExternalDetector(Analyzer):
         """Tell the external analyzer to reset itself
         """
         self.logger.info("sending reset")
+        if (self.worker is not None):
+            self.worker.command(b"T")
+            return
         try:
-            self.p.stdin.write(bytes("T\n","utf-8"))
-            self.p.stdin.flush()
+            self.send__(b"T")
         except IOError:
             self.logger.info("could not send reset command")
 
 
+    def send__(self, kind):
+        self.p.stdin.write(kind + b"\n")
+        self.p.stdin.flush()
+
+
+    def receive__(self):
+        """Results of the previous frame (a string)
+        """
+        if (self.worker is not None): # wait for the answers to everything in flight
+            result = ""
+            while self.worker.inFlight() > 0:
+                select.select([self.worker], [], [])
+                for seq, st in self.worker.receive():
+                    result = st
+            return result
+        st = str(self.p.stdout.readline(),"utf-8")
+        self.logger.info("got >"+st+"<")
+        if (st=="C\n"):
+            return ""
+        return st[0:-1]
+
+
     def close(self):
         """Tell the process to exit
         """
-        try:
-            self.p.stdin.write(bytes("X\n","utf-8"))
-            self.p.stdin.flush()
-        except IOError:
-            self.logger.info("could not send exit command")
-        self.p.wait() # wait until the process is closed
+        if (self.worker is not None):
+            self.worker.close() # also removes the shared memory file
+            self.worker = None
+        else:
+            try:
+                self.send__(b"X")
+            except IOError:
+                self.logger.info("could not send exit command")
+            self.p.wait() # wait until the process is closed
         try:
             os.remove(self.tmpfile) # clean up the temporary file
         except FileNotFoundError:
@@ -109,23 +241,18 @@ class ExternalDetector(Analyzer):
         
         # before sending the new frame, collect results the analyzer produced from the previous frame
         self.logger.info("waiting for external process")
-        st = str(self.p.stdout.readline(),"utf-8")
-        self.logger.info("got >"+st+"<")
+        result = self.receive__()
         
-        if (st=="C\n"):
-            result=""
+        # write the new frame into the shared memory ring or into a tmpfile & inform the external process that there is a new frame available
+        self.seq += 1
+        if (self.worker is not None):
+            self.worker.send(img, self.seq)
         else:
-            result=st[0:-1]
-        
-        # write the new frame into a tmpfile
-        img.dump(self.tmpfile)
-        
-        # inform the external process that there is a new frame available
-        try:
-            self.p.stdin.write(bytes("R\n","utf-8"))
-            self.p.stdin.flush()
-        except IOError:
-            self.logger.info("could not send data")
+            img.dump(self.tmpfile)
+            try:
+                self.send__(b"R")
+            except IOError:
+                self.logger.info("could not send data")
             
         # the data from the previous frame: format here the string into a data structure if you need to
         return result
@@ -150,6 +277,226 @@ class ExternalDetector(Analyzer):
 
 
 
+class ExternalWorker:
+    """An external analyzer program using the "shm" protocol (see FrameRing) that can have up to n_slots frames in flight
+
+    The program answers the frames in the order they were sent.  Answers are read with non-blocking reads from the raw stdout pipe, so that several workers can be waited for with select
+    """
+
+    def __init__(self, executable, image_dimensions, filename, n_slots, logger):
+        self.logger = logger
+        self.ring = FrameRing(
+            filename = filename,
+            n_slots = n_slots,
+            image_dimensions = image_dimensions
+        )
+        comlist = executable.split() + [str(image_dimensions[0]), str(image_dimensions[1]), filename, "shm"]
+        self.p = subprocess.Popen(comlist, stdout=subprocess.PIPE, stdin=subprocess.PIPE, bufsize=0)
+        self.fd = self.p.stdout.fileno()
+        os.set_blocking(self.fd, False)
+        self.buf = bytearray()
+        self.pending = collections.deque() # sequence numbers of the frames in flight, None for commands
+        self.n_sent = 0
+        self.alive = True
+
+
+    def fileno(self):
+        return self.fd
+
+
+    def inFlight(self):
+        return len(self.pending)
+
+
+    def hasRoom(self):
+        return self.alive and (len(self.pending) < self.ring.n_slots)
+
+
+    def command(self, kind):
+        try:
+            writeMessage(self.p.stdin, kind)
+        except IOError:
+            self.logger.info("could not send command %s", kind)
+            return
+        if kind != b"X":
+            self.pending.append(None)
+
+
+    def send(self, img, seq):
+        """Send a frame.  The slots are used in turn, so a slot is rewritten only after its frame has been answered
+        """
+        slot = self.ring.write(img, seq, slot = self.n_sent % self.ring.n_slots)
+        self.n_sent += 1
+        try:
+            writeMessage(self.p.stdin, b"R", struct.pack("<QI", seq, slot))
+        except IOError:
+            self.logger.info("could not send frame %s", seq)
+        self.pending.append(seq)
+
+
+    def receive(self):
+        """Read available answers.  Returns a list of (seq, result).  If the program has died, the frames in flight are answered with empty results
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            data = None
+        if data == b"": # EOF
+            self.logger.warning("external worker exited")
+            self.alive = False
+            answers = [(seq, "") for seq in self.pending if seq is not None]
+            self.pending.clear()
+            return answers
+        if data:
+            self.buf += data
+        answers = []
+        while len(self.buf) >= message_header.size:
+            kind, length = message_header.unpack_from(self.buf, 0)
+            end = message_header.size + length
+            if len(self.buf) < end:
+                break
+            payload = bytes(self.buf[message_header.size:end])
+            del self.buf[0:end]
+            seq = self.pending.popleft() if len(self.pending) > 0 else None
+            if seq is not None:
+                answers.append((seq, payload.decode("utf-8") if kind == b"D" else ""))
+        return answers
+
+
+    def close(self, timeout = 5.0):
+        """Tell the program to exit & wait up to timeout secs for it.  A program that doesn't exit by then is killed
+        """
+        if self.alive:
+            self.command(b"X")
+        try:
+            self.p.stdin.close()
+        except IOError:
+            pass
+        try:
+            self.p.wait(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            self.logger.warning("close: %s did not exit in %s secs, killing it", self.p.args, timeout)
+            self.p.kill()
+            self.p.wait()
+        self.ring.close()
+
+
+
+class ExternalWorkerPool(Analyzer):
+    """Runs n_workers external analyzer programs using the "shm" protocol, keeping up to max_in_flight frames in flight per worker
+
+    Frames are dispatched to the workers "round-robin" or to the "least-busy" one.  Results are reordered by sequence number, so they come out in the order of the frames.  When all workers are full, the call waits for a worker to answer, so a slow analyzer makes upstream drop frames instead of queueing them
+
+    Calling the pool with a frame returns a list of results (strings) of the earlier frames that are ready, in order
+    """
+
+    parameter_defs = {
+        "verbose":          (bool, False),
+        "debug":            (bool, False),
+        "executable":       str,
+        "image_dimensions": (tuple, (1920 // 4, 1080 // 4)),
+        "tmpfile":          str,            # shared memory files are named tmpfile-0, tmpfile-1, etc.
+        "n_workers":        (int, 1),
+        "max_in_flight":    (int, 2),       # frames in flight per worker
+        "dispatch":         (str, "least-busy"), # or "round-robin"
+        "timeout":          (float, 5.0)    # give up waiting for a worker after this many secs
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        assert(self.dispatch in ["least-busy", "round-robin"])
+        self.init()
+
+
+    def init(self):
+        self.workers = []
+        for i in range(self.n_workers):
+            try:
+                worker = ExternalWorker(
+                    self.executable,
+                    self.image_dimensions,
+                    self.tmpfile + "-" + str(i),
+                    self.max_in_flight,
+                    self.logger
+                )
+            except Exception as e:
+                self.logger.warning("could not start external worker: %s", e)
+                continue
+            self.workers.append(worker)
+        self.seq = 0
+        self.next_seq = 1 # next result to give out
+        self.done = {} # seq => result: results waiting for the earlier ones
+        self.rr = 0
+        self.reset()
+
+
+    def reset(self):
+        """Tell the external analyzers to reset themselves
+        """
+        for worker in self.workers:
+            worker.command(b"T")
+
+
+    def close(self):
+        for worker in self.workers:
+            worker.close(timeout = self.timeout)
+        self.workers = []
+
+
+    def collect__(self, timeout):
+        """Wait up to timeout secs for answers from the workers
+        """
+        busy = [worker for worker in self.workers if worker.alive and worker.inFlight() > 0]
+        if len(busy) < 1:
+            return
+        ready, w, x = select.select(busy, [], [], timeout)
+        for worker in ready:
+            for seq, result in worker.receive():
+                self.done[seq] = result
+
+
+    def choose__(self):
+        """A worker that can take a frame or None
+        """
+        free = [worker for worker in self.workers if worker.hasRoom()]
+        if len(free) < 1:
+            return None
+        if self.dispatch == "least-busy":
+            return min(free, key = lambda worker: worker.inFlight())
+        for i in range(len(self.workers)):
+            worker = self.workers[(self.rr + i) % len(self.workers)]
+            if worker.hasRoom():
+                self.rr = (self.rr + i + 1) % len(self.workers)
+                return worker
+
+
+    def __call__(self, img):
+        self.collect__(0)
+        worker = self.choose__()
+        t = time.time()
+        while (worker is None) and any(w.alive for w in self.workers) and ((time.time() - t) < self.timeout):
+            self.collect__(self.timeout)
+            worker = self.choose__()
+        if worker is None:
+            self.logger.warning("no external worker available: dropping frame")
+        else:
+            self.seq += 1
+            worker.send(img, self.seq)
+
+        results = []
+        in_flight = set(seq for worker in self.workers for seq in worker.pending)
+        while self.next_seq <= self.seq:
+            if self.next_seq in self.done:
+                results.append(self.done.pop(self.next_seq))
+            elif self.next_seq in in_flight:
+                break # wait for it
+            # else: lost (dropped or a worker died): skip
+            self.next_seq += 1
+        return results
+
+
+
 class MVisionProcess(MVisionBaseProcess):
     """A multiprocess that uses stdin, stdout and the filesystem to communicate with an external machine vision program
     """
@@ -160,6 +507,9 @@ class MVisionProcess(MVisionBaseProcess):
     
     # The (example) process that gets executed.  You can find it in the module directory
     executable = "python3 "+os.path.join(getModulePath(),"example_process1.py")
+    protocol = "shm" # "shm": frames through shared memory, "text": frames through the filesystem.  See ExternalDetector
+    n_workers = 1 # with the "shm" protocol, run this many external programs ..
+    max_in_flight = 2 # .. each one having this many frames in flight.  See ExternalWorkerPool
     
     # For each outgoing signal, create a Qt signal with the same name.  The
     # frontend Qt thread will read processes communication pipe and emit these
@@ -169,6 +519,7 @@ class MVisionProcess(MVisionBaseProcess):
         pong = QtCore.Signal(object)
         shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
         text = QtCore.Signal(object)
+        stats = QtCore.Signal(object) # see valkka.mvision.stats.StageStats.report
     #"""
 
     parameter_defs = {
@@ -192,13 +543,27 @@ class MVisionProcess(MVisionBaseProcess):
         """Create temporary file for image dumps and the analyzer itself
         """
         super().postActivate_()
-        self.tmpfile = os.path.join(constant.tmpdir,"valkka-"+str(os.getpid())) # e.g. "/tmp/valkka-10968" 
-        self.analyzer = ExternalDetector(
-            executable = self.executable,
-            image_dimensions = self.image_dimensions,
-            tmpfile = self.tmpfile,
-            verbose = self.verbose
-            )
+        if (self.protocol == "shm") and os.path.isdir(constant.shmdir):
+            self.tmpfile = os.path.join(constant.shmdir,"valkka-"+str(os.getpid())) # e.g. "/dev/shm/valkka-10968"
+        else:
+            self.tmpfile = os.path.join(constant.tmpdir,"valkka-"+str(os.getpid())) # e.g. "/tmp/valkka-10968" 
+        if (self.protocol == "shm"):
+            self.analyzer = ExternalWorkerPool(
+                executable = self.executable,
+                image_dimensions = self.image_dimensions,
+                tmpfile = self.tmpfile,
+                n_workers = self.n_workers,
+                max_in_flight = self.max_in_flight,
+                verbose = self.verbose
+                )
+        else:
+            self.analyzer = ExternalDetector(
+                executable = self.executable,
+                image_dimensions = self.image_dimensions,
+                tmpfile = self.tmpfile,
+                protocol = self.protocol,
+                verbose = self.verbose
+                )
         
     def preDeactivate_(self):
         """Whatever you need to do prior to deactivating the shmem client
@@ -223,8 +588,10 @@ class MVisionProcess(MVisionBaseProcess):
             result = self.analyzer(img)
         """
         index, meta = self.client.pullFrame()
+        self.stats.mark("pull")
         if (index is None):
             self.logger.debug("Client timed out..")
+            self.stats.count("timeouts")
             return
         
         self.logger.debug("Client index = %s", index)
@@ -235,19 +602,27 @@ class MVisionProcess(MVisionBaseProcess):
         img = data.reshape(
             (meta.height, meta.width, 3))
         self.logger.debug("got frame %s", img.shape)
-        result = self.analyzer(img) # does something .. returns something ..
-
-        if self.qt_server is not None:
+        self.stats.count("frames")
+        results = self.analyzer(img) # does something .. returns something ..
+        self.stats.mark("analyze")
+        if not isinstance(results, list): # ExternalDetector: the result of the previous frame
+            results = [results]
+
+        img_ = self.getOverlay__(img) # downscaled preview frame, when somebody's watching
+        if img_ is not None:
             self.logger.info("pushing frame to server")
             self.qt_server.pushFrame(
-                img,
+                img_,
                 meta.slot,
                 meta.mstimestamp
             )
+            self.stats.mark("push")
 
-        if (result != ""):
-            self.send_out__(MessageObject("text", message = result))
-            # self.sendSignal_(name="text", message=result)
+        for result in results:
+            if (result != ""):
+                self.send_out__(MessageObject("text", message = result))
+                # self.sendSignal_(name="text", message=result)
+        self.stats.mark("send")
 
     
     # *** create a widget for this machine vision module ***
@@ -285,6 +660,57 @@ def test1():
     analyzer.close()
 
 
+def test5():
+    """Like test1, but using the shared memory protocol
+    """
+    width = 1920 // 4
+    height = 1080 // 4
+    
+    analyzer = ExternalDetector(
+        verbose=True, 
+        executable = "python3 " + os.path.join(getModulePath(),"example_process1.py"),
+        image_dimensions = (width, height),
+        tmpfile = os.path.join(constant.shmdir, "valkka-debug"),
+        protocol = "shm"
+        )
+
+    img = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+    
+    for i in range(10):
+        img[:,:,:]=i
+        result = analyzer(img)
+        print("result =", result)
+    
+    analyzer.close()
+
+
+
+def test6():
+    """Several external programs with several frames in flight
+    """
+    width = 1920 // 4
+    height = 1080 // 4
+    
+    analyzer = ExternalWorkerPool(
+        verbose=True, 
+        executable = "python3 " + os.path.join(getModulePath(),"example_process1.py"),
+        image_dimensions = (width, height),
+        tmpfile = os.path.join(constant.shmdir, "valkka-debug"),
+        n_workers = 3,
+        max_in_flight = 2
+        )
+
+    img = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+    
+    t = time.time()
+    for i in range(30):
+        img[:,:,:]=i
+        print("results =", analyzer(img))
+    print("%.2f secs" % (time.time() - t))
+    
+    analyzer.close()
+
+
 
 def test2():
     """Demo here the OpenCV highgui with valkka
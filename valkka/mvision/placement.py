@@ -0,0 +1,107 @@
+"""
+placement.py : Assign client processes to master processes according to their load
+
+Copyright 2018 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the machine vision plugin for the Valkka Live program
+
+This plugin is free software: you can redistribute it and/or modify it under the terms of the MIT License.  This code is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the MIT License for more details.
+
+@file    placement.py
+@author  Sampsa Riikonen
+@date    2018
+@version 0.12.1
+@brief   Assign client processes to master processes according to their load
+"""
+
+from valkka.api2 import parameterInitCheck
+from valkka.live.tools import getLogger
+
+
+class PlacementEngine:
+    """Places client processes on master processes (QShmemMasterProcess) using the load the master processes report
+
+    The cost of a master process is the number of frames it has to analyze per cycle (clients + queued frames) times the mean analysis time per frame.  New clients go to the master process with the smallest cost.
+
+    rebalance moves clients from the busiest master process to the least busy one, using unsetMasterProcess & setMasterProcess of the client process
+    """
+
+    parameter_defs = {
+        "imbalance" : (float, 0.5),  # :param imbalance: migrate a client if the cost difference is larger than this fraction of the busiest master's cost
+        "min_busy"  : (float, 0.5)   # :param min_busy:  don't migrate clients from a master process that is busy less than this fraction of time
+    }
+
+    def __init__(self, **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
+
+
+    def cost(self, master_process, extra = 0):
+        """Cost of a master process if it had extra clients more
+        """
+        load = master_process.getLoad()
+        n = master_process.n_clients + extra
+        t_inference = load.get("t_inference", None)
+        if t_inference is None: # no measurements yet: just count clients
+            return n
+        queue = load.get("queue", 0)
+        # queue is measured with the current number of clients: scale it to the new number
+        if master_process.n_clients > 0:
+            queue = queue * n / master_process.n_clients
+        return (n + queue) * t_inference
+
+
+    def choose(self, master_processes):
+        """Returns the master process that should take a new client, or None if none of them has space
+        """
+        candidates = [p for p in master_processes if p.available()]
+        if len(candidates) < 1:
+            return None
+        return min(candidates, key = lambda p: (self.cost(p, extra = 1), p.n_clients))
+
+
+    def rebalance(self, master_processes):
+        """Move at most one client from the busiest master process to the least busy one
+
+        Returns a tuple (client_process, from_master_process, to_master_process) or None if nothing was done
+        """
+        if len(master_processes) < 2:
+            return None
+        busiest = max(master_processes, key = self.cost)
+        if (busiest.n_clients < 2) or (busiest.getLoad().get("busy", 0) < self.min_busy):
+            return None
+        candidates = [p for p in master_processes if (p is not busiest) and p.available()]
+        if len(candidates) < 1:
+            return None
+        idlest = min(candidates, key = lambda p: self.cost(p, extra = 1))
+        c_busiest = self.cost(busiest)
+        if (c_busiest - self.cost(idlest, extra = 1)) <= (self.imbalance * c_busiest):
+            return None
+        client_process = next(iter(busiest.client_processes.values()), None)
+        if client_process is None:
+            return None
+        if not self.migrate(client_process, idlest):
+            return None
+        return client_process, busiest, idlest
+
+
+    def migrate(self, client_process, master_process):
+        """Move a client process to another master process.  Returns True if succesful
+
+        The ipc element of the client process stays quarantined until the old master process has unregistered it, so the client process gets a new element (see IPC.release).  If there is no free element, the client process is not moved
+        """
+        if not client_process.canMigrate():
+            self.logger.error("migrate: no free ipc elements (too many migrations in flight): not moving %s", client_process)
+            return False
+        old_master_process = client_process.master_process
+        self.logger.info("migrate: %s from %s to %s", client_process, old_master_process, master_process)
+        client_process.unsetMasterProcess()
+        if client_process.setMasterProcess(master_process):
+            return True
+        self.logger.warning("migrate: could not place %s on %s: going back to %s", client_process, master_process, old_master_process)
+        if not client_process.setMasterProcess(old_master_process):
+            self.logger.error("migrate: %s has no master process", client_process)
+        return False
+
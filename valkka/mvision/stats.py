@@ -0,0 +1,202 @@
+"""
+stats.py : Cheap per-stage timing histograms for machine vision processes
+
+Copyright 2018 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the machine vision plugin for the Valkka Live program
+
+This plugin is free software: you can redistribute it and/or modify it under the terms of the MIT License.  This code is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the MIT License for more details.
+
+@file    stats.py
+@author  Sampsa Riikonen
+@date    2018
+@version 0.12.1
+@brief   Cheap per-stage timing histograms for machine vision processes
+"""
+
+import sys
+import time
+
+
+class Histogram:
+    """Histogram of durations in microseconds with four buckets per octave (max 25% error in the percentiles)
+
+    Durations below 8 us have a bucket each.  Adding a value costs a few integer operations
+    """
+
+    n_buckets = 128
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.counts = [0] * self.n_buckets
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+
+    @staticmethod
+    def bucket(us):
+        if us < 8:
+            return max(0, us)
+        b = us.bit_length() # us is in [2**(b-1), 2**b)
+        return min(Histogram.n_buckets - 1, 8 + (b - 4) * 4 + (us >> (b - 3)) - 4)
+
+
+    @staticmethod
+    def upperBound(i):
+        """Upper bound of bucket i in microseconds
+        """
+        if i < 8:
+            return i + 1
+        b = (i - 8) // 4 + 4
+        return (5 + (i - 8) % 4) << (b - 3)
+
+
+    def add(self, us):
+        self.counts[self.bucket(us)] += 1
+        self.n += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+
+    def percentile(self, p):
+        """Upper bound of the bucket containing the p:th percentile (p in 0..100), in microseconds
+        """
+        if self.n < 1:
+            return 0
+        limit = p * self.n / 100.0
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= limit and count > 0:
+                return min(self.upperBound(i), self.max)
+        return self.max
+
+
+    def report(self):
+        """Summary in milliseconds
+        """
+        return {
+            "count" : self.n,
+            "mean"  : self.total / self.n / 1000 if self.n > 0 else 0,
+            "p50"   : self.percentile(50) / 1000,
+            "p95"   : self.percentile(95) / 1000,
+            "p99"   : self.percentile(99) / 1000,
+            "max"   : self.max / 1000,
+            "total" : self.total / 1000
+        }
+
+
+
+class StageStats:
+    """Per-stage timing histograms & counters of a process loop
+
+    Stages are consecutive segments of the loop: begin starts timing & mark(stage) records the time since the previous begin or mark into the histogram of that stage, i.e.
+
+    ::
+
+        stats.begin()
+        ... wait for a frame
+        stats.mark("wait")
+        ... pull the frame
+        stats.mark("pull")
+        ... analyze it
+        stats.mark("analyze")
+
+    Counters are incremented with count.  Call due periodically: it's True every interval seconds (interval 0 disables periodic reports)
+    """
+
+    def __init__(self, interval = 10.0):
+        self.interval = interval
+        self.stages = {} # stage name => Histogram
+        self.counters = {} # counter name => int
+        self.t = time.perf_counter()
+        self.t_report = time.monotonic()
+
+
+    def begin(self):
+        self.t = time.perf_counter()
+
+
+    def mark(self, stage):
+        t = time.perf_counter()
+        histogram = self.stages.get(stage, None)
+        if histogram is None:
+            histogram = Histogram()
+            self.stages[stage] = histogram
+        histogram.add(int((t - self.t) * 1000000))
+        self.t = t
+
+
+    def count(self, counter, n = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+
+    def due(self):
+        if self.interval <= 0:
+            return False
+        return (time.monotonic() - self.t_report) >= self.interval
+
+
+    def report(self, reset = False):
+        """Stage summaries (see Histogram.report) & counters since the last reset.  Returns a dict with:
+
+        ::
+
+            interval : secs since the last reset
+            stages   : stage name => {"count", "mean", "p50", "p95", "p99", "max", "total"}, times in milliseconds
+            counters : counter name => int
+        """
+        t = time.monotonic()
+        report = {
+            "interval"  : t - self.t_report,
+            "stages"    : {stage: histogram.report() for stage, histogram in self.stages.items()},
+            "counters"  : dict(self.counters)
+        }
+        if reset:
+            self.reset()
+        return report
+
+
+    def reset(self):
+        for histogram in self.stages.values():
+            histogram.reset()
+        self.counters = {}
+        self.t_report = time.monotonic()
+
+
+
+def test1():
+    """Bucket bounds & overhead
+    """
+    for us in [0, 1, 7, 8, 9, 15, 16, 100, 1000, 33000, 10**9]:
+        i = Histogram.bucket(us)
+        print(us, "=> bucket", i, "upper bound", Histogram.upperBound(i))
+    stats = StageStats()
+    n = 100000
+    t = time.perf_counter()
+    for i in range(n):
+        stats.mark("a")
+        stats.mark("b")
+    print("%.3f us per mark" % ((time.perf_counter() - t) / n / 2 * 1e6))
+    print(stats.report())
+
+
+def main():
+    pre = "main :"
+    print(pre, "main: arguments: ", sys.argv)
+    if (len(sys.argv) < 2):
+        print(pre, "main: needs test number")
+    else:
+        st = "test" + str(sys.argv[1]) + "()"
+        exec(st)
+
+
+if (__name__ == "__main__"):
+    main()
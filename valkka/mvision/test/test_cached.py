@@ -0,0 +1,79 @@
+"""Tests for valkka.mvision.base.CachedAnalyzer
+"""
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("valkka.api2")
+pytest.importorskip("PySide2") # valkka.mvision imports the qt multiprocesses
+
+from valkka.mvision.base import Analyzer, CachedAnalyzer
+
+
+class CountingAnalyzer(Analyzer):
+    """An Analyzer subclass that records what it was given
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = [] # keys of each analyzeBatch call
+
+    def __call__(self, img):
+        return [("thing", 99, 0, img.shape[1], 0, img.shape[0])]
+
+    def analyzeBatch(self, imgs, keys = None):
+        self.calls.append(keys)
+        return super().analyzeBatch(imgs, keys = keys)
+
+
+def frame():
+    return numpy.zeros((270, 480, 3), dtype = numpy.uint8)
+
+
+def test_wraps_subclass():
+    inner = CountingAnalyzer()
+    analyzer = CachedAnalyzer(analyzer = inner)
+    assert analyzer.analyzer is inner
+    with pytest.raises(AttributeError):
+        CachedAnalyzer(analyzer = "not an analyzer")
+
+
+def test_unchanged_frame_is_cached():
+    inner = CountingAnalyzer()
+    analyzer = CachedAnalyzer(analyzer = inner)
+    img = frame()
+    first = analyzer(img)
+    assert analyzer(img.copy()) == first
+    assert len(inner.calls) == 1
+    assert (analyzer.hits, analyzer.misses) == (1, 1)
+
+
+def test_noise_is_ignored():
+    inner = CountingAnalyzer()
+    analyzer = CachedAnalyzer(analyzer = inner, pixel_threshold = 12)
+    img = frame()
+    analyzer(img)
+    noisy = img + numpy.uint8(5)
+    analyzer(noisy)
+    assert len(inner.calls) == 1
+
+
+def test_small_object_is_analyzed():
+    inner = CountingAnalyzer()
+    analyzer = CachedAnalyzer(analyzer = inner)
+    img = frame()
+    analyzer(img)
+    img = img.copy()
+    img[100:110, 200:210, :] = 255 # covers about one cell of the signature
+    analyzer(img)
+    assert len(inner.calls) == 2
+
+
+def test_streams_by_key():
+    inner = CountingAnalyzer()
+    analyzer = CachedAnalyzer(analyzer = inner)
+    img = frame()
+    analyzer.analyzeBatch([img, img], keys = ["a", "b"])
+    assert inner.calls == [["a", "b"]] # keys are passed on to the wrapped analyzer
+    analyzer.analyzeBatch([img, img], keys = ["a", "c"])
+    assert inner.calls[-1] == ["c"]
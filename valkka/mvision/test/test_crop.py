@@ -0,0 +1,80 @@
+"""Tests for valkka.mvision.crop.MotionCropAnalyzer
+"""
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("valkka.api2")
+pytest.importorskip("PySide2") # valkka.mvision imports the qt multiprocesses
+
+from valkka.mvision.base import Analyzer
+from valkka.mvision.crop import MotionCropAnalyzer
+
+
+class BoxAnalyzer(Analyzer):
+    """An Analyzer subclass that finds a "thing" covering each input image
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.shapes = [] # shapes of the analyzed images
+
+    def __call__(self, img):
+        self.shapes.append(img.shape)
+        return [("thing", 99, 0, img.shape[1], 0, img.shape[0])]
+
+
+def frame():
+    return numpy.zeros((270, 480, 3), dtype = numpy.uint8)
+
+
+def test_wraps_subclass():
+    inner = BoxAnalyzer()
+    analyzer = MotionCropAnalyzer(analyzer = inner)
+    assert analyzer.analyzer is inner
+    with pytest.raises(AttributeError):
+        MotionCropAnalyzer(analyzer = "not an analyzer")
+
+
+def test_crops_moving_region():
+    inner = BoxAnalyzer()
+    analyzer = MotionCropAnalyzer(analyzer = inner)
+    img = frame()
+    analyzer(img) # no previous frame: full frame
+    assert inner.shapes[-1] == img.shape
+    img = img.copy()
+    img[100:120, 200:240, :] = 255
+    lis = analyzer(img)
+    assert analyzer.n_crops == 1
+    assert inner.shapes[-1][0] < img.shape[0] and inner.shapes[-1][1] < img.shape[1]
+    # the crop box is mapped back to the full frame & the stale full-frame box (centered on the crop) is dropped
+    assert len(lis) == 1
+    tag, score, x0, x1, y0, y1 = lis[0]
+    assert (x0 <= 200) and (x1 >= 240)
+    assert (y0 <= 270 - 120) and (y1 >= 270 - 100) # y from the bottom
+
+
+def test_keeps_static_objects():
+    inner = BoxAnalyzer()
+    analyzer = MotionCropAnalyzer(analyzer = inner, min_size = 0.1)
+    img = frame()
+    analyzer(img)
+    img = img.copy()
+    img[0:20, 0:20, :] = 255 # far from the center of the full-frame box
+    lis = analyzer(img)
+    assert ("thing", 99, 0, 480, 0, 270) in lis
+
+
+def test_slow_motion_accumulates():
+    """Motion below pixel_threshold per frame is found against the last full-frame analysis
+    """
+    inner = BoxAnalyzer()
+    analyzer = MotionCropAnalyzer(analyzer = inner, pixel_threshold = 25)
+    img = frame()
+    analyzer(img)
+    for value in range(10, 100, 10): # 10 per frame
+        img = img.copy()
+        img[100:120, 200:240, :] = value
+        analyzer(img)
+    assert analyzer.n_full == 1
+    assert analyzer.n_crops > 0
@@ -0,0 +1,121 @@
+"""Tests for valkka.mvision.ipc: IPC (growing, sealing, quarantine & the migration budget) & ResultRing
+"""
+import pytest
+
+pytest.importorskip("valkka.core") # the elements use libValkka eventfds
+pytest.importorskip("PySide2") # valkka.mvision imports the qt multiprocesses
+
+from valkka.mvision.ipc import IPC, ResultRing
+
+
+class Owner:
+    """Stands for a client process
+    """
+    exitcode = None
+
+    def __init__(self):
+        self.ipc_index = None
+
+
+def test_grows_until_sealed():
+    ipc = IPC()
+    assert ipc.available()
+    i = ipc.reserve()
+    assert len(ipc.lis) == 1
+    ipc.seal()
+    assert not ipc.available()
+    with pytest.raises(IndexError):
+        ipc.reserve()
+    ipc.allocate(1) # refused
+    assert len(ipc.lis) == 1
+    ipc.release(i, quarantine = False)
+    assert ipc.reserve() == i
+
+
+def test_quarantine():
+    ipc = IPC()
+    ipc.allocate(2)
+    ipc.seal()
+    i = ipc.reserve()
+    ipc.release(i) # quarantined until confirmed
+    j = ipc.reserve()
+    assert j != i
+    assert not ipc.available()
+    ipc.confirm(i)
+    assert ipc.available()
+    assert ipc.reserve() == i
+
+
+def test_migration_budget():
+    """A client with one spare element can migrate once while the old element is quarantined
+    """
+    ipc = IPC()
+    ipc.allocate(2) # 1 + max_migrations
+    ipc.seal()
+    owner = Owner()
+    owner.ipc_index = ipc.reserve(owner = owner)
+    for migration in range(2):
+        if not ipc.available():
+            break
+        ipc.release(owner.ipc_index)
+        owner.ipc_index = ipc.reserve(owner = owner)
+    assert migration == 1 # the second one was refused
+    assert ipc.stats()["quarantine"] == 1
+
+
+def test_reclaim_leaked():
+    ipc = IPC()
+    ipc.allocate(1)
+    ipc.seal()
+    owner = Owner()
+    owner.ipc_index = ipc.reserve(owner = owner)
+    owner.exitcode = 0 # process has exited without releasing
+    assert ipc.leaked() == [owner.ipc_index]
+    assert ipc.available()
+    assert ipc.reserve() == owner.ipc_index
+
+
+def test_event_cleared_at_reserve():
+    ipc = IPC()
+    i = ipc.reserve()
+    ipc.set(i)
+    ipc.release(i, quarantine = False)
+    assert ipc.reserve() == i
+    assert not ipc.isSet(i)
+
+
+def test_ring_roundtrip():
+    ring = ResultRing(n_slots = 4, max_objects = 2)
+    assert ring.read() is None
+    seq = ring.write(["person", "car", "dog"], [0.9, 0.8, 0.7], [(0, 1, 0, 1)] * 3, mstimestamp = 123)
+    seq_, mstimestamp, flags, records = ring.read()
+    assert (seq_, mstimestamp, flags) == (seq, 123, 0)
+    assert [ring.label(i) for i in records["class_id"]] == ["person", "car"] # max_objects
+    assert ring.read(last_seq = seq) is None
+
+
+def test_ring_labels():
+    ring = ResultRing(max_labels = 1)
+    assert ring.labelId("person") == ring.labelId("person") == 0
+    assert ring.labelId("car") == -1 # table full
+    assert ring.label(-1) == "?"
+
+
+def test_ring_latest_and_overwritten():
+    ring = ResultRing(n_slots = 2)
+    for i in range(5):
+        ring.write([], [], [], mstimestamp = i)
+    seq, mstimestamp, flags, records = ring.read(last_seq = 1)
+    assert (seq, mstimestamp, len(records)) == (5, 4, 0) # the latest one
+    ring.entries["seq"][seq % ring.n_slots] = 0 # being written
+    assert ring.readEntry__(seq) is None
+
+
+def test_ring_skip_flags():
+    ring = ResultRing(n_slots = 4)
+    ring.write(["person"], [0.9], [(0, 1, 0, 1)], mstimestamp = 1)
+    ring.write([], [], [], mstimestamp = 2, flags = ResultRing.flag_dropped)
+    seq, mstimestamp, flags, records = ring.read(skip_flags = ResultRing.flag_dropped)
+    assert (seq, mstimestamp, flags) == (2, 1, 0) # seq of the latest, entry of the last analyzed frame
+    seq, mstimestamp, flags, records = ring.read(last_seq = 1, skip_flags = ResultRing.flag_dropped)
+    assert flags & ResultRing.flag_dropped # nothing newer to fall back to
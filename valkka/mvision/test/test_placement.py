@@ -0,0 +1,114 @@
+"""Tests for valkka.mvision.placement.PlacementEngine, with stand-ins for the master & client processes
+"""
+import pytest
+
+pytest.importorskip("valkka.api2")
+pytest.importorskip("PySide2") # valkka.mvision imports the qt multiprocesses
+
+from valkka.mvision.placement import PlacementEngine
+
+
+class Master:
+    """Stands for a QShmemMasterProcess
+    """
+
+    def __init__(self, name, load = {}, max_clients = 10):
+        self.name = name
+        self.load = load
+        self.max_clients = max_clients
+        self.client_processes = {}
+
+    @property
+    def n_clients(self):
+        return len(self.client_processes)
+
+    def getLoad(self):
+        return self.load
+
+    def available(self):
+        return self.n_clients < self.max_clients
+
+
+class Client:
+    """Stands for a QShmemClientProcess
+    """
+
+    def __init__(self, master_process = None, migrations = 1):
+        self.master_process = None
+        self.migrations = migrations # how many times the client can migrate, see QShmemClientProcess.max_migrations
+        if master_process is not None:
+            self.setMasterProcess(master_process)
+
+    def canMigrate(self):
+        return self.migrations > 0
+
+    def setMasterProcess(self, master_process):
+        if not master_process.available():
+            return False
+        master_process.client_processes[id(self)] = self
+        self.master_process = master_process
+        return True
+
+    def unsetMasterProcess(self):
+        self.master_process.client_processes.pop(id(self))
+        self.master_process = None
+        self.migrations -= 1
+
+
+def test_choose_by_cost():
+    engine = PlacementEngine()
+    fast = Master("fast", load = {"t_inference" : 0.01})
+    slow = Master("slow", load = {"t_inference" : 0.1})
+    for i in range(3):
+        Client(fast)
+    assert engine.choose([fast, slow]) is fast # 4 x 0.01 < 1 x 0.1
+    assert engine.choose([Master("a", max_clients = 0)]) is None
+
+
+def test_choose_by_count_without_measurements():
+    engine = PlacementEngine()
+    a, b = Master("a"), Master("b")
+    Client(a)
+    assert engine.choose([a, b]) is b
+
+
+def test_rebalance():
+    engine = PlacementEngine()
+    busy = Master("busy", load = {"t_inference" : 0.1, "busy" : 0.9})
+    idle = Master("idle", load = {"t_inference" : 0.1, "busy" : 0.1})
+    for i in range(4):
+        Client(busy)
+    client_process, from_master, to_master = engine.rebalance([busy, idle])
+    assert (from_master, to_master) == (busy, idle)
+    assert client_process.master_process is idle
+    assert (busy.n_clients, idle.n_clients) == (3, 1)
+
+
+def test_no_rebalance_when_balanced_or_idle():
+    engine = PlacementEngine()
+    a = Master("a", load = {"t_inference" : 0.1, "busy" : 0.9})
+    b = Master("b", load = {"t_inference" : 0.1, "busy" : 0.9})
+    for i in range(2):
+        Client(a)
+        Client(b)
+    assert engine.rebalance([a, b]) is None
+    lazy = Master("lazy", load = {"t_inference" : 0.1, "busy" : 0.1}) # below min_busy
+    for i in range(4):
+        Client(lazy)
+    assert engine.rebalance([lazy, Master("empty")]) is None
+
+
+def test_migrate_refused():
+    engine = PlacementEngine()
+    a, b = Master("a"), Master("b")
+    client_process = Client(a, migrations = 0)
+    assert not engine.migrate(client_process, b)
+    assert client_process.master_process is a
+
+
+def test_migrate_goes_back():
+    engine = PlacementEngine()
+    a, full = Master("a"), Master("full", max_clients = 0)
+    client_process = Client(a, migrations = 2)
+    assert not engine.migrate(client_process, full)
+    assert client_process.master_process is a
@@ -0,0 +1,49 @@
+"""Tests for valkka.mvision.stats: duration histograms & per-stage statistics
+"""
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("valkka.api2")
+pytest.importorskip("PySide2") # valkka.mvision imports the qt multiprocesses
+
+from valkka.mvision.stats import Histogram, StageStats
+
+
+def test_bucket_bounds():
+    for us in list(range(0, 100)) + [1000, 4095, 4096, 33000, 10**6]:
+        i = Histogram.bucket(us)
+        lower = Histogram.upperBound(i - 1) if i > 0 else 0
+        assert lower <= us < Histogram.upperBound(i)
+        assert Histogram.upperBound(i) - lower <= max(1, 0.25 * Histogram.upperBound(i))
+    assert Histogram.bucket(10**12) == Histogram.n_buckets - 1
+
+
+def test_percentiles():
+    histogram = Histogram()
+    for us in range(1, 1001):
+        histogram.add(us)
+    report = histogram.report()
+    assert (report["count"], report["max"]) == (1000, 1.0)
+    assert report["mean"] == pytest.approx(0.5005)
+    assert 0.5 <= report["p50"] <= 0.5 * 1.25
+    assert 0.99 <= report["p99"] <= 1.0 # never above max
+    histogram.reset()
+    assert histogram.report()["p95"] == 0
+
+
+def test_stage_stats():
+    stats = StageStats(interval = 0)
+    for i in range(3):
+        stats.begin()
+        stats.mark("wait")
+        stats.mark("analyze")
+        stats.count("frames")
+    stats.count("dropped", 2)
+    assert not stats.due() # periodic reports disabled
+    report = stats.report(reset = True)
+    assert sorted(report["stages"]) == ["analyze", "wait"]
+    assert report["stages"]["wait"]["count"] == 3
+    assert report["counters"] == {"frames" : 3, "dropped" : 2}
+    report = stats.report()
+    assert report["counters"] == {}
+    assert report["stages"]["wait"]["count"] == 0
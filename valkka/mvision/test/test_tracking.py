@@ -0,0 +1,66 @@
+"""Tests for valkka.mvision.tracking: centroid tracking & line crossing counts
+"""
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("valkka.api2")
+pytest.importorskip("PySide2") # valkka.mvision imports the qt multiprocesses
+
+from valkka.mvision.tracking import blobCentroids, linesFromParameters, crossings, CentroidTracker, LineCrossingCounter
+
+
+vertical = {"line" : [[0.5, 0.0], [0.5, 1.0]], "unitnormal" : [1.0, 0.0]}
+
+
+def test_blob_centroids():
+    mask = numpy.zeros((100, 200), dtype = numpy.bool_)
+    mask[10:20, 20:40] = True
+    mask[50, 50] = True # too small
+    centroids = blobCentroids(mask)
+    assert centroids.shape == (1, 2)
+    assert numpy.allclose(centroids[0], (29.5 / 200, 14.5 / 100))
+
+
+def test_lines_from_parameters():
+    lines, normals = linesFromParameters(vertical)
+    assert (lines.shape, normals.shape) == ((1, 2, 2), (1, 2))
+    lines, normals = linesFromParameters({"lines" : [vertical, vertical]})
+    assert (lines.shape, normals.shape) == ((2, 2, 2), (2, 2))
+    lines, normals = linesFromParameters(None)
+    assert (lines.shape, normals.shape) == ((0, 2, 2), (0, 2))
+
+
+def test_crossings():
+    lines, normals = linesFromParameters(vertical)
+    previous = numpy.array([(0.4, 0.5), (0.6, 0.5), (0.1, 0.5), (0.4, 0.5), (0.5, 0.5)])
+    current = numpy.array([(0.6, 0.5), (0.4, 0.5), (0.2, 0.5), (0.5, 0.5), (0.6, 0.5)])
+    # a track that touches the line & continues is counted once
+    assert crossings(previous, current, lines, normals)[:, 0].tolist() == [1, -1, 0, 1, 0]
+
+
+def test_tracker():
+    tracker = CentroidTracker(max_distance = 0.1, max_missed = 1)
+    ids, previous, current = tracker.update([(0.1, 0.1), (0.9, 0.9)])
+    assert len(ids) == 0 # new tracks
+    ids, previous, current = tracker.update([(0.12, 0.1), (0.5, 0.5)])
+    assert ids.tolist() == [0]
+    assert numpy.allclose(previous, [(0.1, 0.1)]) and numpy.allclose(current, [(0.12, 0.1)])
+    assert sorted(tracker.ids.tolist()) == [0, 1, 2]
+    tracker.update([])
+    tracker.update([])
+    assert len(tracker.ids) == 0 # dropped after max_missed
+
+
+def test_counter():
+    counter = LineCrossingCounter()
+    counter.setParameters(vertical)
+    events = []
+    for x in numpy.linspace(0.2, 0.8, 13):
+        events += counter.update([(x, 0.3), (1 - x, 0.7)]) # one goes in, the other out
+    assert sorted(event[2] for event in events) == ["in", "out"]
+    assert counter.getCounts() == ([1], [1])
+    message = counter.message(events, 123)
+    assert (message["counts_in"], message["counts_out"], message["mstimestamp"]) == ([1], [1], 123)
+    counter.setParameters(dict(vertical)) # new parameters: counts start over
+    assert counter.getCounts() == ([0], [0])
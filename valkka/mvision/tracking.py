@@ -0,0 +1,268 @@
+"""
+tracking.py : Centroid tracking & line-crossing counting
+
+Copyright 2018 Sampsa Riikonen
+
+Authors: Sampsa Riikonen
+
+This file is part of the machine vision plugin for the Valkka Live program
+
+This plugin is free software: you can redistribute it and/or modify it under the terms of the MIT License.  This code is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the MIT License for more details.
+
+@file    tracking.py
+@author  Sampsa Riikonen
+@date    2018
+@version 0.12.1
+@brief   Centroid tracking & line-crossing counting
+"""
+
+import sys
+import time
+import numpy
+import cv2
+
+from valkka.api2 import parameterInitCheck
+from valkka.live.tools import getLogger
+
+
+# all coordinates are relative (0..1), x to the right & y downwards, as in the parameters of valkka.live.qt.widget.LineCrossingVideoWidget
+
+def blobCentroids(mask, min_area = 4):
+    """Centroids of the connected regions of a movement mask (nonzero = moved) having at least min_area samples.  Returns a (N, 2) array
+    """
+    if mask.dtype == numpy.bool_:
+        mask = mask.view(numpy.uint8)
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(mask)
+    centroids = centroids[1:][stats[1:, cv2.CC_STAT_AREA] >= min_area] # the first one is the background
+    return centroids / numpy.array([mask.shape[1], mask.shape[0]])
+
+
+def linesFromParameters(parameters):
+    """Lines & their unit normals from analyzer parameters: a single "line" & "unitnormal" as defined by LineCrossingVideoWidget or a list "lines" of such dicts.  Returns (lines, normals) with shapes (L, 2, 2) & (L, 2)
+    """
+    if not parameters:
+        dics = []
+    elif "lines" in parameters:
+        dics = parameters["lines"]
+    elif "line" in parameters:
+        dics = [parameters]
+    else:
+        dics = []
+    lines = numpy.array([dic["line"] for dic in dics], dtype = numpy.float64).reshape(-1, 2, 2)
+    normals = numpy.array([dic["unitnormal"] for dic in dics], dtype = numpy.float64).reshape(-1, 2)
+    return lines, normals
+
+
+class CentroidTracker:
+    """Associates points (object centroids) between frames
+
+    A track and a point are matched if they are each other's nearest neighbours & closer than max_distance.  Unmatched points start new tracks.  A track is dropped after it has been unmatched in more than max_missed consecutive frames.  All of this is done with numpy array ops over all tracks & points at once
+    """
+
+    parameter_defs = {
+        "max_distance"  : (float, 0.1),     # :param max_distance:  Max distance a point moves between frames (relative coordinates)
+        "max_missed"    : (int, 5),         # :param max_missed:    Drop a track after this many frames without a match
+        "verbose"       : (bool, False)
+    }
+
+    def __init__(self, **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
+        self.reset()
+
+
+    def reset(self):
+        self.ids = numpy.zeros(0, dtype = numpy.int64)
+        self.points = numpy.zeros((0, 2), dtype = numpy.float64)
+        self.missed = numpy.zeros(0, dtype = numpy.int64)
+        self.next_id = 0
+
+
+    def update(self, points):
+        """Feed the points of a new frame.  Returns (ids, previous, current) of the tracks that were matched: track ids (T,) & their previous & current positions, both (T, 2)
+        """
+        points = numpy.asarray(points, dtype = numpy.float64).reshape(-1, 2)
+        n_tracks = len(self.points)
+        n_points = len(points)
+
+        if (n_tracks > 0) and (n_points > 0):
+            dist = numpy.linalg.norm(self.points[:, None, :] - points[None, :, :], axis = 2) # (tracks, points)
+            tracks = numpy.arange(n_tracks)
+            track_to_point = dist.argmin(axis = 1)
+            point_to_track = dist.argmin(axis = 0)
+            matched = (point_to_track[track_to_point] == tracks) & (dist[tracks, track_to_point] <= self.max_distance)
+            matched_tracks = tracks[matched]
+            matched_points = track_to_point[matched]
+        else:
+            matched_tracks = numpy.zeros(0, dtype = numpy.intp)
+            matched_points = numpy.zeros(0, dtype = numpy.intp)
+
+        ids = self.ids[matched_tracks]
+        previous = self.points[matched_tracks]
+        current = points[matched_points]
+
+        self.missed += 1
+        self.missed[matched_tracks] = 0
+        self.points[matched_tracks] = current
+
+        new = numpy.ones(n_points, dtype = numpy.bool_)
+        new[matched_points] = False
+        n_new = numpy.count_nonzero(new)
+        keep = self.missed <= self.max_missed
+
+        self.ids = numpy.concatenate((self.ids[keep], numpy.arange(self.next_id, self.next_id + n_new)))
+        self.points = numpy.concatenate((self.points[keep], points[new]))
+        self.missed = numpy.concatenate((self.missed[keep], numpy.zeros(n_new, dtype = numpy.int64)))
+        self.next_id += n_new
+        self.logger.debug("update: %s points, %s matched, %s tracks", n_points, len(ids), len(self.ids))
+        return ids, previous, current
+
+
+
+def crossings(previous, current, lines, normals):
+    """Which track segments (previous -> current) cross which lines
+
+    Returns a (T, L) int8 array: 1 = crossed in the direction of the line normal ("in"), -1 = against it ("out"), 0 = no crossing.  A point that is exactly on a line is on its negative side, so a track touching a line is counted only once
+    """
+    p = previous[:, None, :] # (T, 1, 2)
+    q = current[:, None, :]
+    a = lines[None, :, 0, :] # (1, L, 2)
+    b = lines[None, :, 1, :]
+
+    def orient(u, v, w): # z-component of (v - u) x (w - u)
+        return (v[..., 0] - u[..., 0]) * (w[..., 1] - u[..., 1]) - (v[..., 1] - u[..., 1]) * (w[..., 0] - u[..., 0])
+
+    # the track endpoints are on different sides of the line ..
+    sides = (orient(a, b, p) > 0) != (orient(a, b, q) > 0)
+    # .. and the line endpoints are on different sides of the track segment
+    hits = sides & ((orient(p, q, a) * orient(p, q, b)) <= 0)
+    direction = numpy.where(((q - p) * normals[None, :, :]).sum(axis = 2) > 0, 1, -1).astype(numpy.int8)
+    return numpy.where(hits, direction, numpy.int8(0))
+
+
+
+class LineCrossingCounter:
+    """Tracks object centroids & counts how many tracks cross each line, in the direction of the line normal ("in") and against it ("out")
+    """
+
+    parameter_defs = {
+        "max_distance"  : (float, 0.1),     # :param max_distance:  see CentroidTracker
+        "max_missed"    : (int, 5),         # :param max_missed:    see CentroidTracker
+        "verbose"       : (bool, False)
+    }
+
+    def __init__(self, **kwargs):
+        parameterInitCheck(self.parameter_defs, kwargs, self)
+        self.logger = getLogger(__name__ + "." + self.__class__.__name__)
+        self.tracker = CentroidTracker(
+            max_distance    = self.max_distance,
+            max_missed      = self.max_missed,
+            verbose         = self.verbose
+        )
+        self.parameters = None
+        self.setLines(numpy.zeros((0, 2, 2)), numpy.zeros((0, 2)))
+
+
+    def setLines(self, lines, normals):
+        """Set the lines & reset counts & tracks
+        """
+        self.lines = numpy.asarray(lines, dtype = numpy.float64).reshape(-1, 2, 2)
+        self.normals = numpy.asarray(normals, dtype = numpy.float64).reshape(-1, 2)
+        self.counts_in = numpy.zeros(len(self.lines), dtype = numpy.int64)
+        self.counts_out = numpy.zeros(len(self.lines), dtype = numpy.int64)
+        self.tracker.reset()
+
+
+    def reset(self):
+        """Reset counts & tracks, keep the lines
+        """
+        self.setLines(self.lines, self.normals)
+
+
+    def setParameters(self, parameters):
+        """Set the lines from analyzer parameters (see linesFromParameters), if they have changed
+        """
+        if parameters is self.parameters:
+            return
+        self.parameters = parameters
+        self.setLines(*linesFromParameters(parameters))
+
+
+    def hasLines(self):
+        return len(self.lines) > 0
+
+
+    def update(self, points):
+        """Feed object centroids of a new frame.  Returns a list of crossing events (track id, line index, "in" or "out")
+        """
+        ids, previous, current = self.tracker.update(points)
+        if (len(ids) < 1) or (len(self.lines) < 1):
+            return []
+        crossed = crossings(previous, current, self.lines, self.normals)
+        self.counts_in += (crossed > 0).sum(axis = 0)
+        self.counts_out += (crossed < 0).sum(axis = 0)
+        track, line = numpy.nonzero(crossed)
+        return [
+            (int(i), int(l), "in" if d > 0 else "out")
+            for i, l, d in zip(ids[track], line, crossed[track, line])
+        ]
+
+
+    def getCounts(self):
+        """In & out counts per line, as lists
+        """
+        return self.counts_in.tolist(), self.counts_out.tolist()
+
+
+    def message(self, events, mstimestamp):
+        """Contents of the "crossing" message
+        """
+        counts_in, counts_out = self.getCounts()
+        return {
+            "crossings"     : events,
+            "counts_in"     : counts_in,
+            "counts_out"    : counts_out,
+            "mstimestamp"   : mstimestamp
+        }
+
+
+
+def test1():
+    """Objects crossing a vertical line in both directions
+    """
+    counter = LineCrossingCounter(verbose = True)
+    counter.setParameters({"line" : [[0.5, 0.0], [0.5, 1.0]], "unitnormal" : [1.0, 0.0]})
+    for x in numpy.linspace(0.2, 0.8, 13):
+        points = [(x, 0.3), (1 - x, 0.7)] # one goes in, the other out
+        print(x, counter.update(points))
+    print("counts in, out =", counter.getCounts())
+
+
+def test2():
+    """Speed with lots of tracks & lines
+    """
+    counter = LineCrossingCounter(max_distance = 0.05)
+    lines = numpy.random.rand(8, 2, 2)
+    normals = numpy.random.rand(8, 2) - 0.5
+    counter.setLines(lines, normals / numpy.linalg.norm(normals, axis = 1)[:, None])
+    points = numpy.random.rand(50, 2)
+    t = time.time()
+    for i in range(1000):
+        points = points + (numpy.random.rand(50, 2) - 0.5) * 0.02
+        counter.update(points)
+    print("%.3f ms per frame" % (time.time() - t))
+    print("counts in, out =", counter.getCounts())
+
+
+def main():
+    pre = "main :"
+    print(pre, "main: arguments: ", sys.argv)
+    if (len(sys.argv) < 2):
+        print(pre, "main: needs test number")
+    else:
+        st = "test" + str(sys.argv[1]) + "()"
+        exec(st)
+
+
+if (__name__ == "__main__"):
+    main()
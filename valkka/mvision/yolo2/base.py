@@ -71,16 +71,7 @@ class MVisionProcess(BaseProcess):
 
     required_mb = 1500      # required GPU memory in MB
     
-    def postActivate_(self):
-        """Whatever you need to do after creating the shmem client
-        """
-        # super().postActivate_() # nopes, since we inherit from yolov3
-        if (self.requiredGPU_MB(self.required_mb)):
-            self.analyzer = YoloV2Analyzer(verbose = self.verbose)
-        else:
-            self.warning_message = "WARNING: not enough GPU memory!"
-            self.analyzer = None
-    
+    analyzer_class = YoloV2Analyzer
         
         
 def test1():
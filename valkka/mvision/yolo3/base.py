@@ -28,11 +28,11 @@ import cv2
 import logging
 
 from valkka.api2 import parameterInitCheck, typeCheck
-from valkka.mvision.base import Analyzer
+from valkka.mvision.base import Analyzer, CachedAnalyzer
 from valkka.live.multiprocess import MessageObject
 from valkka.mvision.multiprocess import test_process, test_with_file, MVisionBaseProcess
 from valkka.live import style
-from valkka.live.tools import getLogger, setLogger, getFreeGPU_MB
+from valkka.live.tools import getLogger, setLogger, getFreeGPU_MB, getAvailableMemory_MB
 
 # if the following works, then darknet is available and the weights file has been downloaded ok
 from darknet.api2.constant import get_yolov2_weights_file, get_yolov3_weights_file, get_yolov3_tiny_weights_file
@@ -92,6 +92,54 @@ class YoloV3Analyzer(Analyzer):
         return lis
 
 
+    def analyzeBatch(self, imgs, keys = None):
+        """Analyze a list of images with a single forward pass
+
+        The images are tiled into a mosaic that is fed to the predictor at once.  Detections are mapped back to the image they belong to.  Note that the network input resolution is shared by all tiles: with four frames, each one is analyzed at about 1/4 of the network input resolution.
+
+        Returns a list of detection lists, one per image
+        """
+        if len(imgs) < 2:
+            return [self(img) for img in imgs]
+        h = max(img.shape[0] for img in imgs)
+        w = max(img.shape[1] for img in imgs)
+        cols = int(numpy.ceil(numpy.sqrt(len(imgs))))
+        rows = int(numpy.ceil(len(imgs) / cols))
+        if (not hasattr(self, "mosaic")) or (self.mosaic.shape != (rows*h, cols*w, 3)):
+            self.mosaic = numpy.zeros((rows*h, cols*w, 3), dtype = numpy.uint8)
+        else:
+            self.mosaic[:,:,:] = 0
+        for i, img in enumerate(imgs):
+            r = i // cols
+            c = i % cols
+            self.mosaic[r*h:r*h+img.shape[0], c*w:c*w+img.shape[1], :] = img
+
+        self.logger.debug("analyzing a mosaic of %s frames : %s", len(imgs), self.mosaic.shape)
+        lis = self.predictor(self.mosaic)
+        results = [[] for img in imgs]
+        for l in lis:
+            # y-coordinates have their origin at the bottom of the image
+            xc = (l[2] + l[3]) / 2
+            yc = rows*h - (l[4] + l[5]) / 2
+            c = min(int(xc // w), cols - 1)
+            r = min(int(yc // h), rows - 1)
+            i = r*cols + c
+            if i >= len(imgs):
+                continue
+            x_shift = c*w
+            y_shift = (rows - 1 - r)*h + (h - imgs[i].shape[0])
+            results[i].append((
+                l[0], 
+                l[1],
+                max(0, l[2] - x_shift),
+                min(imgs[i].shape[1], l[3] - x_shift),
+                max(0, l[4] - y_shift),
+                min(imgs[i].shape[0], l[5] - y_shift)
+            ))
+        self.logger.debug("finished analyzing mosaic")
+        return results
+
+
 
 class MVisionProcess(MVisionBaseProcess):
     """
@@ -109,6 +157,15 @@ class MVisionProcess(MVisionBaseProcess):
     auto_menu = True # append automatically to valkka live machine vision menu or not
 
     required_mb = 2700      # required GPU memory in MB
+
+    # the model is loaded at the first activation & kept loaded when the process is deactivated, so that switching cameras doesn't reload it
+    keep_model = True
+
+    record_tags = ["person"] # open the recording gate of the stream while any of these objects is present
+    unload_below_mb = 0     # .. unless there's less than this much system memory available (MB) at deactivation.  0 = never unload
+
+    analyzer_class = YoloV3Analyzer
+    change_threshold = 0    # don't analyze frames where at most this fraction of the frame changed since the last analyzed one (see CachedAnalyzer), i.e. 0.001.  0 = analyze all frames
     
     # For each outgoing signal, create a Qt signal with the same name.  The
     # frontend Qt thread will read processes communication pipe and emit these
@@ -116,8 +173,9 @@ class MVisionProcess(MVisionBaseProcess):
     class Signals(QtCore.QObject):
         pong = QtCore.Signal(object)
         shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
-        objects = QtCore.Signal(object)
-        bboxes  = QtCore.Signal(object)
+        objects = QtCore.Signal(object) # object_list, bbox_list, score_list & mstimestamp of a frame
+        stats = QtCore.Signal(object) # see valkka.mvision.stats.StageStats.report
+        recording = QtCore.Signal(object) # see valkka.mvision.multiprocess.MVisionBaseProcess.triggerRecording__
 
     parameter_defs = {
         "verbose": (bool, False)
@@ -154,19 +212,48 @@ class MVisionProcess(MVisionBaseProcess):
         """Whatever you need to do after creating the shmem client
         """
         super().postActivate_()
-        if (self.requiredGPU_MB(self.required_mb)):
-            self.analyzer = YoloV3Analyzer(verbose = self.verbose)
+        if (self.analyzer is not None): # kept from a previous activation
+            self.logger.debug("postActivate_ : reusing the loaded model")
+            self.analyzer.reset() # forget the results of the previous stream
+        elif (self.requiredGPU_MB(self.required_mb)):
+            t = time.time()
+            self.analyzer = self.makeAnalyzer_()
+            self.logger.debug("postActivate_ : loaded the model in %.1f secs", time.time() - t)
+            if hasattr(self, "warning_message"): del self.warning_message
         else:
             self.warning_message = "WARNING: not enough GPU memory!"
             self.analyzer = None
             
+
+    def unloadModel__(self):
+        """Should the model be released at deactivation
+        """
+        if not self.keep_model:
+            return True
+        if self.unload_below_mb > 0:
+            available = getAvailableMemory_MB()
+            if (available >= 0) and (available < self.unload_below_mb):
+                self.logger.warning("unloading the model: only %i MB of memory available", available)
+                return True
+        return False
+
         
+    def makeAnalyzer_(self):
+        """Instantiate analyzer_class.  Wrap it into a CachedAnalyzer if change_threshold is set
+        """
+        analyzer = self.analyzer_class(verbose = self.verbose)
+        if self.change_threshold > 0:
+            analyzer = CachedAnalyzer(analyzer = analyzer, threshold = self.change_threshold, verbose = self.verbose)
+        return analyzer
+        
+
     def preDeactivate_(self):
         """Whatever you need to do prior to deactivating the shmem client
         """
         super().preDeactivate_()
-        if (self.analyzer): self.analyzer.close()
-        self.analyzer = None
+        if (self.analyzer) and self.unloadModel__():
+            self.analyzer.close()
+            self.analyzer = None
         
 
     def cycle_(self):
@@ -184,8 +271,10 @@ class MVisionProcess(MVisionBaseProcess):
                 (self.image_dimensions[1], self.image_dimensions[0], 3))
         """
         index, meta = self.client.pullFrame()
+        self.stats.mark("pull")
         if (index is None):
             self.logger.debug("Client timed out..")
+            self.stats.count("timeouts")
             return
         
         self.logger.debug("Client index = %s", index)
@@ -195,15 +284,19 @@ class MVisionProcess(MVisionBaseProcess):
         data = self.client.shmem_list[index][0:meta.size]
         img = data.reshape(
             (meta.height, meta.width, 3))
+        self.stats.count("frames")
         lis = self.analyzer(img)
+        self.stats.mark("analyze")
 
-        if self.qt_server is not None:
+        img_ = self.getOverlay__(img) # downscaled preview frame, when somebody's watching
+        if img_ is not None:
             self.logger.info("pushing frame to server")
             self.qt_server.pushFrame(
-                img,
+                img_,
                 meta.slot,
                 meta.mstimestamp
             )
+            self.stats.mark("push")
 
         """
         print("img.shape=",img.shape)
@@ -220,8 +313,10 @@ class MVisionProcess(MVisionBaseProcess):
         
         object_list=[]
         bbox_list=[]
+        score_list=[]
         for l in lis:
             object_list.append(l[0])
+            score_list.append(l[1]/100.0) # from percent to a fraction
             # """
             bbox_list.append((
                 l[2]/img.shape[1],  # from pixels to fractional coordinates
@@ -231,6 +326,7 @@ class MVisionProcess(MVisionBaseProcess):
             ))
             # """
             
+        self.triggerRecording__(any(tag in self.record_tags for tag in object_list))
         if (hasattr(self, "warning_message")):
             object_list.append(self.warning_message)
   
@@ -238,8 +334,13 @@ class MVisionProcess(MVisionBaseProcess):
         #if (len(lis)>0):
         # self.sendSignal_(name="objects", object_list=object_list)
         # self.sendSignal_(name="bboxes",  bbox_list=bbox_list)
-        self.send_out__(MessageObject("objects", object_list = object_list))
-        self.send_out__(MessageObject("bboxes", bbox_list = bbox_list))
+        self.send_out__(MessageObject("objects",
+            object_list = object_list,
+            bbox_list   = bbox_list,
+            score_list  = numpy.array(score_list, dtype = numpy.float32),
+            mstimestamp = meta.mstimestamp
+            ))
+        self.stats.mark("send")
         
 
     # *** create a widget for this machine vision module ***
@@ -21,7 +21,6 @@ from PySide2 import QtWidgets, QtCore, QtGui
 import sys
 import time
 import os
-import numpy
 import imutils
 import importlib
 import cv2
@@ -41,6 +40,8 @@ class MVisionClientProcess(MVisionClientBaseProcess):
     max_instances = 5
     master = "yolo3master" # name tag of the required master process
     auto_menu = True # append automatically to valkka live machine vision menu or not
+    asynchronous = True # don't wait for the master process: overlay the most recent results instead
+    record_tags = ["person"] # open the recording gate of the stream while any of these objects is present
     
     # For each outgoing signal, create a Qt signal with the same name.  The
     # frontend Qt thread will read processes communication pipe and emit these
@@ -48,8 +49,9 @@ class MVisionClientProcess(MVisionClientBaseProcess):
     class Signals(QtCore.QObject):
         pong = QtCore.Signal(object) # demo outgoing signal
         shmem_server = QtCore.Signal(object) # launched when the mvision process has established a shared mem server
-        objects = QtCore.Signal(object)
-        bboxes  = QtCore.Signal(object)
+        objects = QtCore.Signal(object) # object_list, bbox_list, score_list & mstimestamp of a frame
+        stats = QtCore.Signal(object) # see valkka.mvision.stats.StageStats.report
+        recording = QtCore.Signal(object) # see valkka.mvision.multiprocess.MVisionBaseProcess.triggerRecording__
 
     parameter_defs = {
         "verbose": (bool, False)
@@ -70,12 +72,32 @@ class MVisionClientProcess(MVisionClientBaseProcess):
         super().postRun_()
 
 
+    def resetReplies__(self):
+        super().resetReplies__()
+        self.object_list = []
+        self.bbox_list = []
+        self.tags = [] # name tags of the bounding boxes
+
+
+    def parseReplies__(self, reply):
+        """Turn a Reply from the master process into an object list and a bounding box list
+        """
+        if reply is None:
+            self.tags = []
+            return [], []
+        self.tags = reply.tags
+        object_list = reply.tags + reply.messages
+        bbox_list = [tuple(box) for box in reply.records["box"].tolist()] # x0, x1, y0, y1
+        return object_list, bbox_list
+
+
     def cycle_(self):
-        lis=[]
         self.logger.debug("cycle_ starts")
         index, meta = self.client.pullFrame()
+        self.stats.mark("pull")
         if (index is None):
             self.logger.debug("Client timed out..")
+            self.stats.count("timeouts")
             return
         
         self.logger.debug("Client index = %s", index)
@@ -86,59 +108,50 @@ class MVisionClientProcess(MVisionClientBaseProcess):
         img = data.reshape(
             (meta.height, meta.width, 3))
 
-        scale = numpy.array([meta.height, meta.width])
+        self.stats.count("frames")
         self.logger.debug("cycle_: got frame %s", img.shape)
 
-        img_ = img.copy()
-
-        if self.server is not None:
-            self.logger.debug("cycle_ : pushing to server")
-            self.server.pushFrame(
-                img,
-                meta.slot,
-                meta.mstimestamp
-            )
-            # receive results from master process
-            replies = self.master_pipe.recv()
-            self.logger.debug("reply from master process: %s", replies)
-            if replies is not None:
-                object_list = []
-                bbox_list = []
-                for reply in replies:
-                    if isinstance(reply, str):
-                        object_list.append(reply)
-                    else:
-                        tag = reply[0]
-                        x0 = reply[1] 
-                        x1 = reply[2]
-                        y0 = reply[3]
-                        y1 = reply[4]
-
-                        object_list.append(tag)
-                        bbox_list.append((x0, x1, y0, y1))
-                        # yolo: origo at left lower corner
-                        y0 = 1 - y0 # numpy / opencv: origo at left upper corner
-                        y1 = 1 - y1
-
-                        # start: lower left corner of the box
-                        start = (int(x0 * meta.width), int(y0 * meta.height))
-                        # end: upper right corner of the box
-                        end = (int( x1 * meta.width), int( y1 * meta.height))
-                        
-                        linew = 3 # object box linewidth
-                        label = (int(x0 * meta.width), int(y1 * meta.height) + self.baseline + linew + 2) # object label coordinates
-                        """
-                        print(">", x0, x1, y0, y1)
-                        print("width, height", meta.width, meta.height)
-                        print("start", start)
-                        print("end", end)
-                        """
-                        color = (255, 0, 0)
-                        img_ = cv2.rectangle(img_, start, end, color, linew)
-                        cv2.putText(img_, tag, label, cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2, cv2.LINE_AA)
-
-                self.send_out__(MessageObject("objects", object_list = object_list))
-                self.send_out__(MessageObject("bboxes", bbox_list = bbox_list))
+        # receive results from master process
+        reply, new = self.exchangeFrame__(img, meta)
+        self.stats.mark("master")
+        if new:
+            self.logger.debug("reply from master process: %s", reply)
+            self.object_list, self.bbox_list = self.parseReplies__(reply)
+            if reply is not None:
+                self.send_out__(MessageObject("objects",
+                    object_list = self.object_list,
+                    bbox_list   = self.bbox_list,
+                    score_list  = reply.records["score"],
+                    mstimestamp = reply.mstimestamp
+                    ))
+        self.triggerRecording__(any(tag in self.record_tags for tag in self.tags))
+
+        # overlays are drawn only when somebody's watching
+        img_ = self.getOverlay__(img)
+        if (img_ is not None) and (self.server is not None):
+            height, width = img_.shape[0], img_.shape[1] # the preview frame may be downscaled
+            for tag, (x0, x1, y0, y1) in zip(self.tags, self.bbox_list):
+                # yolo: origo at left lower corner
+                y0 = 1 - y0 # numpy / opencv: origo at left upper corner
+                y1 = 1 - y1
+
+                # start: lower left corner of the box
+                start = (int(x0 * width), int(y0 * height))
+                # end: upper right corner of the box
+                end = (int( x1 * width), int( y1 * height))
+                
+                linew = 3 # object box linewidth
+                label = (int(x0 * width), int(y1 * height) + self.baseline + linew + 2) # object label coordinates
+                """
+                print(">", x0, x1, y0, y1)
+                print("width, height", width, height)
+                print("start", start)
+                print("end", end)
+                """
+                color = (255, 0, 0)
+                cv2.rectangle(img_, start, end, color, linew)
+                cv2.putText(img_, tag, label, cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2, cv2.LINE_AA)
+        self.stats.mark("overlay")
 
         """
         reply can be:
@@ -149,13 +162,14 @@ class MVisionClientProcess(MVisionClientBaseProcess):
                 (nametag, x, y, w, h)
             - string
         """
-        if self.qt_server is not None:
+        if img_ is not None:
             self.logger.info("pushing frame to server")
             self.qt_server.pushFrame(
                 img_,
                 meta.slot,
                 meta.mstimestamp
             )
+            self.stats.mark("push")
 
 
     # *** create a widget for this machine vision module ***
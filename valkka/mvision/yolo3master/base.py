@@ -28,9 +28,11 @@ import cv2
 import logging
 
 from valkka.api2 import parameterInitCheck, typeCheck
-from valkka.mvision.base import Analyzer
+from valkka.mvision.base import Analyzer, CachedAnalyzer
 from valkka.live.multiprocess import MessageObject
 from valkka.mvision.multiprocess import QShmemMasterProcess
+from valkka.mvision.yolo3 import YoloV3Analyzer as BaseAnalyzer
+from valkka.mvision.crop import MotionCropAnalyzer
 from valkka.live import style
 from valkka.live.tools import getLogger, setLogger, getFreeGPU_MB
 
@@ -45,23 +47,10 @@ assert(VERSION_MINOR >= MIN_DARKNET_VERSION_MINOR)
 assert(VERSION_PATCH >= MIN_DARKNET_VERSION_PATCH)
 
 
-class YoloV3Analyzer(Analyzer):
-    """The celebrated Yolo v3 object detector
+class YoloV3Analyzer(BaseAnalyzer):
+    """Yolo v3 object detector for the master process.  Analyzes batches of frames as a mosaic (see valkka.mvision.yolo3.YoloV3Analyzer)
     """
 
-    parameter_defs = {
-        "verbose": (bool, False),   # :param verbose:  Verbose output or not?  Default: False.
-        "debug": (bool, False)     
-    }
-
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        # checks that kwargs is consistent with parameter_defs.  Attaches
-        # parameters as attributes to self
-        parameterInitCheck(self.parameter_defs, kwargs, self)
-        self.init()
-            
-            
     def init(self):
         # from darknet.api2.error import WeightMissingError
         from darknet.api2.predictor import get_YOLOv3_Predictor, get_YOLOv3_Tiny_Predictor, get_YOLOv2_Predictor
@@ -69,27 +58,6 @@ class YoloV3Analyzer(Analyzer):
         self.predictor = get_YOLOv3_Tiny_Predictor()
         # self.predictor = get_YOLOv2_Predictor()
         self.reset()
-        
-    def reset(self):
-        pass
-        
-    def __call__(self, img):
-        self.logger.debug("analyzing frame : %s",img.shape)    
-        lis = self.predictor(img)
-        """
-        lis = [ # debugging ..
-            ('dog', 99, 134, 313, 214, 542), 
-            ('truck', 91, 476, 684, 81, 168),
-            ('bicycle', 99, 99, 589, 124, 447)
-            ]
-        """
-        """
-        lis = [ # debugging ..
-            ('dog', 99, img.shape[0]*0.25, img.shape[0]*0.75, img.shape[1]*0.25, img.shape[1]*0.75)
-            ]
-        """
-        self.logger.debug("finished analyzing frame")
-        return lis
 
 
 
@@ -107,8 +75,15 @@ class MVisionMasterProcess(QShmemMasterProcess):
     tag = "yolo3master"
     max_instances = 1       # just one instance allowed .. this is kinda heavy detector
     max_clients = 4
+    # max_batch > 1 analyzes frames from several clients with a single forward pass.  The frames are tiled into a mosaic
+    # that is scaled to the network input, so each of the four tiles gets about 1/4 of the network input resolution and
+    # small objects are missed.  Opt-in: trades detection accuracy for throughput
+    max_batch = 1
+    batch_window = 0.01     # wait at most this many seconds for the batch to fill up (only if max_batch > 1)
     
     required_mb = 2700      # required GPU memory in MB
+    crop_motion = False     # feed the detector with crops of the moving regions only (see MotionCropAnalyzer)
+    change_threshold = 0    # don't analyze frames where at most this fraction of the frame changed since the last analyzed frame of the same client (see CachedAnalyzer), i.e. 0.001.  0 = analyze all frames
     
     
     parameter_defs = {
@@ -147,6 +122,10 @@ class MVisionMasterProcess(QShmemMasterProcess):
     def firstClientRegistered_(self):
         if (self.requiredGPU_MB(self.required_mb)):
             self.analyzer = YoloV3Analyzer(verbose = self.verbose)
+            if self.crop_motion:
+                self.analyzer = MotionCropAnalyzer(analyzer = self.analyzer, verbose = self.verbose)
+            if self.change_threshold > 0:
+                self.analyzer = CachedAnalyzer(analyzer = self.analyzer, threshold = self.change_threshold, verbose = self.verbose)
             # self.analyzer = None # debug
         else:
             self.warning_message = "WARNING: not enough GPU memory!"
@@ -168,18 +147,41 @@ class MVisionMasterProcess(QShmemMasterProcess):
                 (nametag, x, y, w, h)
             - string
         """
-        index, meta = shmem_client.pullFrame()
-        self.logger.debug("index %s, meta.size %s, meta.height %s, meta.width %s, prod %s", index, meta.size, meta.height, meta.width, meta.height*meta.width*3)
+        img, meta = self.pullFrame__(shmem_client)
         # return [] # debugging
 
-        if (meta.size < 1) or (self.analyzer is None):
+        if (img is None) or (self.analyzer is None): # meta is None for a dropped frame
             return None
+        self.logger.debug("meta.size %s, meta.height %s, meta.width %s, prod %s", meta.size, meta.height, meta.width, meta.height*meta.width*3)
 
-        data = shmem_client.shmem_list[index][0:meta.size]
-        img = data.reshape(
-            (meta.height, meta.width, 3))
-        lis = self.analyzer(img)
+        lis = self.analyzer.analyzeBatch([img], keys = [shmem_client])[0]
+        return self.makeReply__(lis, img)
 
+
+    def handleBatch_(self, shmem_clients):
+        """Receives frames from several shmem clients & analyzes them in one go
+
+        Returns a list of replies, one per client.  See handleFrame_
+        """
+        imgs = [self.pullFrame__(shmem_client)[0] for shmem_client in shmem_clients]
+        if self.analyzer is None:
+            return [None for img in imgs]
+
+        valid = [img for img in imgs if img is not None]
+        keys = [shmem_client for img, shmem_client in zip(imgs, shmem_clients) if img is not None]
+        results = iter(self.analyzer.analyzeBatch(valid, keys = keys))
+        replies = []
+        for img in imgs:
+            if img is None:
+                replies.append(None)
+            else:
+                replies.append(self.makeReply__(next(results), img))
+        return replies
+
+
+    def makeReply__(self, lis, img):
+        """Turn the analyzer results into a reply for the client process
+        """
         """
         print("img.shape=",img.shape)
         for l in lis:
@@ -200,14 +202,15 @@ class MVisionMasterProcess(QShmemMasterProcess):
                 l[2]/img.shape[1],  # from pixels to fractional coordinates
                 l[3]/img.shape[1],
                 l[4]/img.shape[0],
-                l[5]/img.shape[0]
+                l[5]/img.shape[0],
+                l[1]/100.0 # score: from percent to a fraction
             ))
             # """
             
         if (hasattr(self, "warning_message")):
             bbox_list.append(self.warning_message)
   
-        return bbox_list # will be forwarded through pipes to the correct client process
+        return bbox_list # will be written into the shared memory result ring of the correct client process
 
         
 def test1():
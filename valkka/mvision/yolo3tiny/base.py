@@ -69,16 +69,7 @@ class MVisionProcess(BaseProcess):
     auto_menu = True # append automatically to valkka live machine vision menu or not
     required_mb = 150      # required GPU memory in MB
     
-    def postActivate_(self):
-        """Whatever you need to do after creating the shmem client
-        """
-        # super().postActivate_() # nopes..! since we inherit from yolov3
-        if (self.requiredGPU_MB(self.required_mb)):
-            self.analyzer = YoloV3TinyAnalyzer(verbose = self.verbose)
-        else:
-            self.warning_message = "WARNING: not enough GPU memory!"
-            self.analyzer = None
-    
+    analyzer_class = YoloV3TinyAnalyzer
         
         
 def test1():